@@ -1,12 +1,26 @@
+import asyncio
 import logging
+import queue
+import re
 import time
-from langchain_core.messages import HumanMessage
-from typing import List
+import types
+import uuid
+from langchain_core.messages import HumanMessage, messages_from_dict, messages_to_dict
+from langchain_core.runnables import RunnableLambda
+from typing import Callable, List, Optional
 from dataclasses import dataclass
 from langgraph.graph import StateGraph
 from Pages.graph.state import AgentState
-from Pages.graph.nodes import call_model, call_tools, route_to_tools
+from Pages.graph.nodes import call_model, acall_model, call_tools, acall_tools, route_to_tools, run_blocking, OPENAI_MODEL
+from Pages.graph.events import Queued, StreamDone, StreamError, TokenDelta, emit, event_sink
 from Pages.data_models import InputData
+from Pages.utils.kernel_pool import kernel_pool, KernelCrashedError, KernelLimitError, KernelPoolFullError
+from Pages.utils.code_analysis import written_names, DATASET_NAME_PATTERN
+from Pages.utils.kernel import base_namespace
+from Pages.utils.async_handler import job_scheduler, JobQueueFullError
+from Pages.utils.response_cache import response_cache, cache_scope, cacheable_answer
+from Pages.utils.figure_store import figure_store
+from Pages.utils.session_store import session_store, get_checkpointer
 
 # Configure logging
 logging.basicConfig(
@@ -18,95 +32,219 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How often a queued query checks its position in the job queue (seconds)
+QUEUE_POLL_INTERVAL = 0.5
+# Session ids are uuid4 hex strings; anything else in a URL is ignored
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Libraries every session starts with
+BASE_MODULES = {name for name, value in base_namespace().items() if isinstance(value, types.ModuleType)}
+
+def state_changing_calls(messages: list) -> list:
+    """Tool calls of an answer that leave variables behind, in order (what a cached replay has to re-run)"""
+    calls = []
+    for message in messages:
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            args = tool_call.get("args", {})
+            if tool_call["name"] == "run_sql":
+                result_name = args.get("result_name", "sql_result")
+                if not result_name.isidentifier() or result_name.startswith("dataset_"):
+                    # Rejected by the tool without running
+                    continue
+                calls.append({'tool': "sql", 'code': args.get("query", ""), 'result_name': result_name})
+            elif tool_call["name"] == "complete_python_task":
+                written = written_names(args.get("python_code", ""), BASE_MODULES)
+                # Datasets are rebound from their files on every call, so calling methods on them changes nothing kept
+                if written is None or {name for name in written - {"plotly_figures"} if not DATASET_NAME_PATTERN.fullmatch(name)}:
+                    calls.append({'tool': "python", 'code': args.get("python_code", "")})
+    return calls
+
 class PythonChatbot:
-    def __init__(self):
+    def __init__(self, session_id: Optional[str] = None):
         super().__init__()
+        # Identifies this chat's execution worker, which holds its variables, and its stored record
+        self.session_id = uuid.uuid4().hex
+        self.current_job_id = None
+        # Set when the user stops the running turn, whose answer then isn't cached
+        self.cancel_requested = False
+        # Graph runs so far; each one is its own checkpointer thread
+        self.turn = 0
         self.reset_chat()
-        self.graph = self.create_graph()
-        self.response_cache = set()
-        
-    def create_graph(self):
+        self.checkpointer = get_checkpointer()
+        self.graph = self.create_graph(self.checkpointer)
+        # The SQLite checkpointer is synchronous, so the async path runs without step checkpoints
+        self.async_graph = self.create_graph()
+        self.response_cache = response_cache
+        if session_id and SESSION_ID_PATTERN.match(session_id):
+            self.restore_session(session_id)
+
+    def create_graph(self, checkpointer=None):
         workflow = StateGraph(AgentState)
-        workflow.add_node('agent', call_model)
-        workflow.add_node('tools', call_tools)
+        # Each node has a sync and an async implementation: invoke uses the first, ainvoke the second
+        workflow.add_node('agent', RunnableLambda(call_model, afunc=acall_model))
+        workflow.add_node('tools', RunnableLambda(call_tools, afunc=acall_tools))
 
         workflow.add_conditional_edges('agent', route_to_tools)
 
         workflow.add_edge('tools', 'agent')
         workflow.set_entry_point('agent')
         
-        # Configure graph with optimized settings
-        compiled_graph = workflow.compile()
+        # With a checkpointer every step is saved, so a turn cut off by a restart can be resumed
+        compiled_graph = workflow.compile(checkpointer=checkpointer)
         return compiled_graph
+
+    def _record(self) -> dict:
+        return {
+            'turn': self.turn,
+            'pending_turn': self.pending_turn,
+            'messages': messages_to_dict(self.chat_history),
+            'output_image_paths': self.output_image_paths,
+            'intermediate_outputs': self.intermediate_outputs,
+            'token_usage_history': self.token_usage_history
+        }
+
+    def persist(self):
+        """Save the conversation so the session can be reopened after a restart (best effort)"""
+        try:
+            session_store.save(self.session_id, self._record())
+        except Exception as e:
+            logger.warning(f"Could not save session {self.session_id}: {str(e)}")
+
+    def restore_session(self, session_id: str) -> bool:
+        """Continue a stored session; its variables come back with its next execution worker"""
+        try:
+            record = session_store.load(session_id)
+        except Exception as e:
+            logger.warning(f"Could not load session {session_id}: {str(e)}")
+            return False
+        if record is None:
+            return False
+        self.session_id = session_id
+        self.turn = record['turn']
+        self.pending_turn = record.get('pending_turn')
+        self.chat_history = messages_from_dict(record['messages'])
+        # JSON object keys are strings; the UI looks figures up by message index
+        self.output_image_paths = {int(k): v for k, v in record['output_image_paths'].items()}
+        self.intermediate_outputs = record['intermediate_outputs']
+        self.token_usage_history = record['token_usage_history']
+        logger.info(f"Restored session {session_id} with {len(self.chat_history)} messages")
+        return True
+
+    def _snapshot_variables(self):
+        # Runs after the current job, in the session's own queue slot, so the answer isn't delayed
+        try:
+            job_scheduler.submit(kernel_pool.snapshot, self.session_id, user_id=self.session_id, priority=1)
+        except JobQueueFullError:
+            # The worker is snapshotted again before it is shut down
+            pass
     
     def user_sent_message(self, user_query, input_data: List[InputData]):
+        turn = self._start_turn(user_query, input_data)
+        if turn['done']:
+            return turn['result']
+
+        logger.info("Invoking graph with input state")
+        try:
+            try:
+                result = self.graph.invoke(turn['input_state'], self._graph_config(turn['thread_id']))
+            except Exception as e:
+                if "recursion" not in str(e).lower():
+                    raise
+                return self._recursion_limit_response(user_query, turn['input_state'], e)
+        except Exception as e:
+            return self._graph_error_response(turn['input_state'], e)
+
+        self._finish_turn(user_query, turn, result)
+
+    async def user_sent_message_async(self, user_query, input_data: List[InputData]):
+        """Same as user_sent_message, but the graph runs with ainvoke on the event loop
+
+        Model calls are awaited instead of holding a thread for the whole
+        round-trip; code execution and other blocking work run on an executor.
+        """
+        turn = await run_blocking(self._start_turn, user_query, input_data)
+        if turn['done']:
+            return turn['result']
+
+        logger.info("Invoking graph with input state (async)")
+        try:
+            try:
+                result = await self.async_graph.ainvoke(turn['input_state'], self._graph_config(turn['thread_id']))
+            except Exception as e:
+                if "recursion" not in str(e).lower():
+                    raise
+                return self._recursion_limit_response(user_query, turn['input_state'], e)
+        except Exception as e:
+            return self._graph_error_response(turn['input_state'], e)
+
+        await run_blocking(self._finish_turn, user_query, turn, result)
+
+    def _start_turn(self, user_query, input_data: List[InputData]) -> dict:
+        """Validate the request and try the response cache; returns {'done': True, 'result': ...} when nothing needs to run"""
         logger.info(f"Starting processing for user query: {user_query}")
         start_time = time.time()
-        
+
+        # Validate input data
+        if not input_data or len(input_data) == 0:
+            return {'done': True, 'result': {
+                "messages": [HumanMessage(content="No data available. Please load data first.")],
+                "output_image_paths": [],
+                "intermediate_outputs": [],
+                "token_usage": None
+            }}
+
+        # Same question on the same data in the same conversation: replay the stored answer
+        previous_queries = [m.content for m in self.chat_history if isinstance(m, HumanMessage)]
         try:
-            # Validate input data
-            if not input_data or len(input_data) == 0:
-                return {
-                    "messages": [HumanMessage(content="No data available. Please load data first.")],
-                    "output_image_paths": [],
-                    "intermediate_outputs": [],
-                    "token_usage": None
-                }
-
-            starting_image_paths_set = set(sum(self.output_image_paths.values(), []))
-            input_state = {
+            cache_key_scope = cache_scope(input_data, OPENAI_MODEL, previous_queries)
+        except OSError:
+            # A dataset file is missing; let the tools report it
+            cache_key_scope = None
+        if cache_key_scope and self.replay_cached_response(user_query, cache_key_scope, input_data):
+            logger.info(f"Answered from response cache in {time.time() - start_time:.2f} seconds")
+            self.persist()
+            return {'done': True, 'result': None}
+
+        self.turn += 1
+        self.cancel_requested = False
+        self.pending_turn = {'thread_id': f"{self.session_id}:{self.turn}", 'query': user_query}
+        self.persist()
+        starting_image_paths_set = set(sum(self.output_image_paths.values(), []))
+        return {
+            'done': False,
+            'start_time': start_time,
+            'cache_key_scope': cache_key_scope,
+            'starting_image_paths': starting_image_paths_set,
+            'thread_id': self.pending_turn['thread_id'],
+            'input_state': {
                 "messages": self.chat_history + [HumanMessage(content=user_query)],
                 "output_image_paths": list(starting_image_paths_set),
                 "input_data": input_data,
+                "session_id": self.session_id,
                 "data_loaded": bool(input_data and len(input_data) > 0)
             }
+        }
 
-            logger.info("Invoking graph with input state")
-            try:
-                # Validate data loading
-                if not input_state["data_loaded"]:
-                    return {
-                        "messages": [HumanMessage(content="Data not loaded. Please load data first.")],
-                        "output_image_paths": [],
-                        "intermediate_outputs": [],
-                        "token_usage": None
-                    }
-
-                # Initialize token usage tracking
-                total_token_usage = {
-                    "total_tokens": 0,
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "estimated_cost": 0.0,
-                    "model": "",
-                    "requests": 0
-                }
-                
-                try:
-                    # Use higher recursion limit with proper error handling
-                    result = self.graph.invoke(input_state, {
-                        "recursion_limit": 25,  # Increased to handle complex analysis
-                        "configurable": {
-                            "thread_id": f"session_{int(time.time())}"
-                        }
-                    })
-                    
-                    # Accumulate token usage
-                    if "token_usage" in result and result["token_usage"]:
-                        token_info = result["token_usage"]
-                        total_token_usage["total_tokens"] = token_info.get("total_tokens", 0)
-                        total_token_usage["prompt_tokens"] = token_info.get("prompt_tokens", 0)
-                        total_token_usage["completion_tokens"] = token_info.get("completion_tokens", 0)
-                        total_token_usage["estimated_cost"] = token_info.get("estimated_cost", 0.0)
-                        total_token_usage["model"] = token_info.get("model", "")
-                        total_token_usage["requests"] = 1
-                        
-                except Exception as e:
-                    if "recursion" in str(e).lower():
-                        logger.warning(f"Recursion limit reached even with limit 25: {str(e)}")
-                        
-                        # Create a more helpful response when recursion limit is still hit
-                        simplified_response = f"""I understand you want to analyze your data, but the analysis is quite complex and requires many steps. 
+    def _graph_config(self, thread_id: str) -> dict:
+        return {
+            "recursion_limit": 25,  # Increased to handle complex analysis
+            "configurable": {
+                # One thread per turn: each run starts from the chat history, not from the previous run's state
+                "thread_id": thread_id
+            }
+        }
+
+    def _abandon_turn(self):
+        # A failed turn is not offered for resuming
+        self.pending_turn = None
+        self.persist()
+
+    def _recursion_limit_response(self, user_query, input_state: dict, e: Exception) -> dict:
+        logger.warning(f"Recursion limit reached even with limit 25: {str(e)}")
+        self._abandon_turn()
+
+        # Create a more helpful response when recursion limit is still hit
+        simplified_response = f"""I understand you want to analyze your data, but the analysis is quite complex and requires many steps. 
 
 **What happened**: The analysis needed more than 25 processing steps, which suggests a very complex query.
 
@@ -131,23 +269,18 @@ class PythonChatbot:
 
 Would you like to start with a basic data overview?"""
 
-                        return {
-                            "messages": input_state["messages"] + [HumanMessage(content=simplified_response)],
-                            "output_image_paths": [],
-                            "intermediate_outputs": [f"Recursion limit (25) reached: {str(e)}"],
-                            "token_usage": total_token_usage if total_token_usage["requests"] > 0 else None
-                        }
-                    else:
-                        raise
-
-                # Add token usage to result
-                if total_token_usage["requests"] > 0:
-                    result["token_usage"] = total_token_usage
-                
-            except Exception as e:
-                logger.error(f"Graph processing error: {str(e)}")
-                # Return user-friendly error message
-                error_response = f"""I encountered an error while analyzing your data: {str(e)}
+        return {
+            "messages": input_state["messages"] + [HumanMessage(content=simplified_response)],
+            "output_image_paths": [],
+            "intermediate_outputs": [f"Recursion limit (25) reached: {str(e)}"],
+            "token_usage": None
+        }
+
+    def _graph_error_response(self, input_state: dict, e: Exception) -> dict:
+        logger.error(f"Graph processing error: {str(e)}")
+        self._abandon_turn()
+        # Return user-friendly error message
+        error_response = f"""I encountered an error while analyzing your data: {str(e)}
 
 **Troubleshooting steps**:
 1. **Check your data**: Make sure your CSV files are properly formatted
@@ -162,36 +295,249 @@ Would you like to start with a basic data overview?"""
 
 You can also check the Debug tab for more technical details."""
 
-                return {
-                    "messages": input_state["messages"] + [HumanMessage(content=error_response)],
-                    "output_image_paths": [],
-                    "intermediate_outputs": [f"Error: {str(e)}"],
-                    "token_usage": None
-                }
-            
-            self.chat_history = result["messages"]
-            new_image_paths = set(result["output_image_paths"]) - starting_image_paths_set
-            self.output_image_paths[len(self.chat_history) - 1] = list(new_image_paths)
-            
-            if "intermediate_outputs" in result:
-                self.intermediate_outputs.extend(result["intermediate_outputs"])
-                logger.info(f"Added {len(result['intermediate_outputs'])} intermediate outputs")
-            
-            # Store token usage for this conversation turn
-            if "token_usage" in result and result["token_usage"]:
-                self.token_usage_history.append({
-                    "timestamp": time.time(),
-                    "query": user_query,
-                    "usage": result["token_usage"]
+        return {
+            "messages": input_state["messages"] + [HumanMessage(content=error_response)],
+            "output_image_paths": [],
+            "intermediate_outputs": [f"Error: {str(e)}"],
+            "token_usage": None
+        }
+
+    def _finish_turn(self, user_query, turn: dict, result: dict):
+        """Record a finished graph run in the chat, the response cache and the token usage history"""
+        if "token_usage" in result and result["token_usage"]:
+            token_info = result["token_usage"]
+            result["token_usage"] = {
+                "total_tokens": token_info.get("total_tokens", 0),
+                "prompt_tokens": token_info.get("prompt_tokens", 0),
+                "cached_tokens": token_info.get("cached_tokens", 0),
+                "completion_tokens": token_info.get("completion_tokens", 0),
+                "estimated_cost": token_info.get("estimated_cost", 0.0),
+                "model": token_info.get("model", ""),
+                "requests": 1
+            }
+
+        self.chat_history = result["messages"]
+        new_image_paths = set(result["output_image_paths"]) - turn['starting_image_paths']
+        self.output_image_paths[len(self.chat_history) - 1] = list(new_image_paths)
+        
+        if "intermediate_outputs" in result:
+            self.intermediate_outputs.extend(result["intermediate_outputs"])
+            logger.info(f"Added {len(result['intermediate_outputs'])} intermediate outputs")
+
+        new_messages = result["messages"][len(turn['input_state']["messages"]):]
+        try:
+            # Interrupted turns and ones whose executions were stopped or lost their worker aren't replayed
+            if turn['cache_key_scope'] and not self.cancel_requested and cacheable_answer(new_messages):
+                self.response_cache.put(user_query, turn['cache_key_scope'], {
+                    'messages': messages_to_dict(new_messages),
+                    'output_image_paths': list(new_image_paths),
+                    'intermediate_outputs': result.get("intermediate_outputs", []),
+                    'replay_calls': state_changing_calls(new_messages)
                 })
-                logger.info(f"Token usage: {result['token_usage']}")
-                
-            duration = time.time() - start_time
-            logger.info(f"Successfully processed query in {duration:.2f} seconds")
+        except Exception as e:
+            # The answer was already delivered; caching it is best effort
+            logger.warning(f"Could not store response in cache: {str(e)}")
+        
+        # Store token usage for this conversation turn
+        if "token_usage" in result and result["token_usage"]:
+            self.token_usage_history.append({
+                "timestamp": time.time(),
+                "query": user_query,
+                "usage": result["token_usage"]
+            })
+            logger.info(f"Token usage: {result['token_usage']}")
+
+        self.pending_turn = None
+        self.persist()
+        self._snapshot_variables()
             
+        duration = time.time() - turn['start_time']
+        logger.info(f"Successfully processed query in {duration:.2f} seconds")
+
+    def replay_cached_response(self, user_query, scope, input_data: List[InputData]) -> bool:
+        """Append a cached answer to the chat without calling the model
+
+        The answer's tool calls that left variables behind are run again
+        (quietly, without saving figures), so follow-up questions find them.
+        Returns False when there is no usable entry (including when one of its figures was deleted).
+        """
+        try:
+            cached = self.response_cache.get(user_query, scope)
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {str(e)}")
+            return False
+        if cached is None:
+            return False
+        image_paths = cached['output_image_paths']
+        # Entries stored before tool calls were recorded can't restore the answer's variables
+        if 'replay_calls' not in cached or not all(figure_store.exists(path) for path in image_paths):
+            return False
+        if not self._replay_calls(cached['replay_calls'], input_data):
+            return False
+        # Copies owned by this session, so the answer keeps its figures when the session that made them is deleted
+        image_paths = figure_store.copy_to_session(image_paths, self.session_id)
+        if image_paths is None:
+            return False
+
+        messages = messages_from_dict(cached['messages'])
+        self.chat_history = self.chat_history + [HumanMessage(content=user_query)] + messages
+        self.output_image_paths[len(self.chat_history) - 1] = image_paths
+        self.intermediate_outputs.extend(cached['intermediate_outputs'])
+        if messages and messages[-1].content:
+            emit(TokenDelta(text=messages[-1].content))
+        return True
+
+    def _replay_calls(self, calls: list, input_data: List[InputData]) -> bool:
+        """Run a cached answer's state-changing calls in the session's worker; False if the worker can't"""
+        for call in calls:
+            try:
+                if call['tool'] == "sql":
+                    kernel_pool.request(self.session_id, "sql", query=call['code'], input_data=input_data,
+                                        result_name=call['result_name'])
+                else:
+                    kernel_pool.request(self.session_id, "execute", python_code=call['code'], input_data=input_data,
+                                        save_figures=False)
+            except (KernelCrashedError, KernelLimitError, KernelPoolFullError) as e:
+                # Calls that failed in the original answer fail the same way here; only a lost worker matters
+                logger.warning(f"Could not restore variables of a cached answer, running the query instead: {str(e)}")
+                return False
+        return True
+
+    def interrupted_query(self) -> Optional[str]:
+        """Question of a turn that was cut off (e.g. by a server restart) and can resume from its last checkpoint"""
+        if self.pending_turn is None or self.checkpointer is None:
+            return None
+        try:
+            state = self.graph.get_state(self._graph_config(self.pending_turn['thread_id']))
+        except Exception as e:
+            logger.warning(f"Could not read checkpoint for session {self.session_id}: {str(e)}")
+            return None
+        return self.pending_turn['query'] if state.next else None
+
+    def resume_interrupted_turn(self):
+        """Finish an interrupted turn from its last checkpoint instead of asking again"""
+        user_query = self.pending_turn['query']
+        thread_id = self.pending_turn['thread_id']
+        logger.info(f"Resuming turn {thread_id}")
+        starting_image_paths_set = set(sum(self.output_image_paths.values(), []))
+        turn = {
+            'start_time': time.time(),
+            # The data may have changed since the turn started, so the answer isn't cached
+            'cache_key_scope': None,
+            'starting_image_paths': starting_image_paths_set,
+            'thread_id': thread_id,
+            'input_state': {"messages": self.chat_history + [HumanMessage(content=user_query)]}
+        }
+        try:
+            try:
+                # No new input: the graph carries on from the steps it had already saved
+                result = self.graph.invoke(None, self._graph_config(thread_id))
+            except Exception as e:
+                if "recursion" not in str(e).lower():
+                    raise
+                return self._recursion_limit_response(user_query, turn['input_state'], e)
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
-            raise
+            return self._graph_error_response(turn['input_state'], e)
+
+        self._finish_turn(user_query, turn, result)
+
+    def stream_user_message(self, user_query, input_data: List[InputData]):
+        """Process a user query, yielding events (token deltas, tool start/end, stdout, figures) as they happen
+
+        The last event is StreamDone (carrying any fallback response from user_sent_message) or StreamError.
+        """
+        return self._stream(lambda: self.user_sent_message(user_query, input_data))
+
+    def stream_resumed_turn(self):
+        """Resume an interrupted turn, yielding the same events as stream_user_message"""
+        return self._stream(self.resume_interrupted_turn)
+
+    def _stream(self, work: Callable):
+        events = queue.Queue()
+
+        def run():
+            # Pool threads are reused, so the sink must not outlive this query
+            token = event_sink.set(events.put)
+            try:
+                events.put(StreamDone(result=work()))
+            except Exception as e:
+                events.put(StreamError(error=str(e)))
+            finally:
+                event_sink.reset(token)
+
+        try:
+            # Runs on the shared job pool: under load queries wait their turn instead of oversubscribing the server
+            self.current_job_id = job_scheduler.submit(run, user_id=self.session_id, on_cancel=self.cancel_execution)
+        except JobQueueFullError as e:
+            yield StreamError(error=f"The server is busy: {str(e)}")
+            return
+
+        position = None
+        while True:
+            try:
+                event = events.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                status = job_scheduler.status(self.current_job_id)
+                if status['status'] == 'queued' and status['position'] != position:
+                    position = status['position']
+                    yield Queued(position=position)
+                elif status['status'] in ('cancelled', 'not_found'):
+                    # Cancelled before it started, so it will never report back
+                    yield StreamError(error="Analysis cancelled before it started")
+                    break
+                continue
+            yield event
+            if isinstance(event, (StreamDone, StreamError)):
+                break
+
+    async def astream_user_message(self, user_query, input_data: List[InputData]):
+        """Async counterpart of stream_user_message for hosts that run an event loop
+
+        The query runs as a task on the caller's loop (no thread per
+        conversation while it waits on the model); events from executor
+        threads are handed back to the loop.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        async def run():
+            token = event_sink.set(lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+            try:
+                events.put_nowait(StreamDone(result=await self.user_sent_message_async(user_query, input_data)))
+            except Exception as e:
+                events.put_nowait(StreamError(error=str(e)))
+            finally:
+                event_sink.reset(token)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                yield event
+                if isinstance(event, (StreamDone, StreamError)):
+                    break
+        finally:
+            if not task.done():
+                # The consumer went away: stop the model call and any running code
+                task.cancel()
+                self.cancel_execution()
+
+    def cancel(self):
+        """Stop this session's current query, whether it is still queued or already running
+
+        A queued query is dropped at once. A running one has its code interrupted
+        and ends (as cancelled) when the interrupted step returns; its stream reports that.
+        """
+        if self.current_job_id is None or job_scheduler.status(self.current_job_id)['status'] not in ('queued', 'running'):
+            self.cancel_execution()
+        else:
+            job_scheduler.cancel(self.current_job_id)
+
+    def cancel_execution(self):
+        """Stop the code this session is currently executing"""
+        logger.info(f"Cancelling execution for session {self.session_id}")
+        self.cancel_requested = True
+        kernel_pool.cancel(self.session_id)
 
     def get_total_token_usage(self):
         """Get cumulative token usage for the entire session"""
@@ -201,6 +547,7 @@ You can also check the Debug tab for more technical details."""
         total = {
             "total_tokens": 0,
             "prompt_tokens": 0,
+            "cached_tokens": 0,
             "completion_tokens": 0,
             "estimated_cost": 0.0,
             "total_requests": 0,
@@ -212,6 +559,7 @@ You can also check the Debug tab for more technical details."""
             usage = entry["usage"]
             total["total_tokens"] += usage.get("total_tokens", 0)
             total["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            total["cached_tokens"] += usage.get("cached_tokens", 0)
             total["completion_tokens"] += usage.get("completion_tokens", 0)
             total["estimated_cost"] += usage.get("estimated_cost", 0.0)
             total["total_requests"] += usage.get("requests", 1)
@@ -224,3 +572,5 @@ You can also check the Debug tab for more technical details."""
         self.intermediate_outputs = []
         self.output_image_paths = {}
         self.token_usage_history = []
+        # The turn being answered ({'thread_id', 'query'}), kept in the record until it finishes
+        self.pending_turn = None
@@ -5,3 +5,4 @@ class InputData:
     variable_name: str
     data_path: str
     data_description: str
+    engine: str = "pandas"
@@ -0,0 +1,67 @@
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+
+# Events streamed to the UI while the agent works on a query
+@dataclass
+class TokenDelta:
+    text: str
+
+
+@dataclass
+class ToolStart:
+    tool_call_id: str
+    name: str
+    args: dict = field(default_factory=dict)
+
+
+@dataclass
+class ToolEnd:
+    tool_call_id: str
+    name: str
+    output: str
+
+
+# tool_call_id tells apart output of tool calls that run in parallel
+@dataclass
+class StdoutChunk:
+    text: str
+    tool_call_id: str = ""
+
+
+@dataclass
+class FigureReady:
+    figure_path: str
+    tool_call_id: str = ""
+
+
+# The query is waiting for a free analysis worker (1 = next to start)
+@dataclass
+class Queued:
+    position: int
+
+
+@dataclass
+class StreamDone:
+    result: Any = None
+
+
+@dataclass
+class StreamError:
+    error: str
+
+
+# Receiver for events of the current run; None when nobody is streaming
+event_sink: ContextVar[Optional[Callable[[Any], None]]] = ContextVar("event_sink", default=None)
+
+
+def is_streaming() -> bool:
+    return event_sink.get() is not None
+
+
+def emit(event: Any):
+    """Send an event to the current run's stream, if any"""
+    sink = event_sink.get()
+    if sink is not None:
+        sink(event)
@@ -0,0 +1,106 @@
+import json
+import os
+from typing import List, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+try:
+    import tiktoken
+except ImportError:
+    # Without tiktoken token counts are estimated from the text length
+    tiktoken = None
+
+# Token budget for the conversation sent with each model call (system prompt excluded)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "24000"))
+# Tool outputs from earlier turns are cut down to this many characters
+OLD_TOOL_OUTPUT_CHARS = int(os.getenv("OLD_TOOL_OUTPUT_CHARS", "1500"))
+
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL", "gpt-4o"))
+        except KeyError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Approximate number of prompt tokens a message takes"""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(tool_call["name"]) + count_tokens(json.dumps(tool_call["args"]))
+    return tokens
+
+
+def truncate_tool_message(message: ToolMessage, max_chars: int) -> ToolMessage:
+    """Keep the head and tail of a long tool output and say how much was dropped"""
+    content = str(message.content)
+    if len(content) <= max_chars:
+        return message
+    half = max_chars // 2
+    dropped = len(content) - 2 * half
+    truncated = f"{content[:half]}\n...[{dropped:,} characters of earlier output omitted]...\n{content[-half:]}"
+    return ToolMessage(content=truncated, name=message.name, tool_call_id=message.tool_call_id)
+
+
+def group_messages(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """Split history into units that must be kept or dropped together
+
+    An AI message with tool calls is grouped with its tool results, since the
+    API rejects tool results without the call that produced them.
+    """
+    groups = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and groups and (
+                isinstance(groups[-1][0], AIMessage) and groups[-1][0].tool_calls):
+            groups[-1].append(message)
+        elif isinstance(message, ToolMessage):
+            # Orphaned tool result (its call was trimmed earlier); it can't be sent on its own
+            continue
+        else:
+            groups.append([message])
+    return groups
+
+
+def trim_history(messages: Sequence[BaseMessage], budget: int = HISTORY_TOKEN_BUDGET) -> List[BaseMessage]:
+    """Fit the conversation into a token budget, newest messages first
+
+    The current turn (from the latest user message on) is always kept in full.
+    Earlier tool outputs are truncated, and the oldest groups are dropped once
+    the budget is used up.
+    """
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    current_turn = list(messages[last_human:])
+    earlier = [truncate_tool_message(m, OLD_TOOL_OUTPUT_CHARS) if isinstance(m, ToolMessage) else m
+               for m in messages[:last_human]]
+
+    remaining = budget - sum(message_tokens(m) for m in current_turn)
+    kept = []
+    for group in reversed(group_messages(earlier)):
+        group_tokens = sum(message_tokens(m) for m in group)
+        if group_tokens > remaining:
+            break
+        kept = group + kept
+        remaining -= group_tokens
+
+    dropped = len(earlier) - len(kept)
+    if dropped > 0:
+        note = HumanMessage(content=f"[{dropped} earlier messages were omitted to fit the context window. "
+                                    f"Variables created in those steps still exist.]")
+        return [note] + kept + current_turn
+    return kept + current_turn
@@ -1,52 +1,92 @@
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, ToolMessage, HumanMessage
+from langchain_core.messages import AIMessage, ToolMessage, HumanMessage, SystemMessage, message_chunk_to_message
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.callbacks import BaseCallbackHandler
 from .state import AgentState
+from .events import TokenDelta, ToolStart, ToolEnd, emit, is_streaming
+from .history import trim_history, message_tokens, HISTORY_TOKEN_BUDGET
+from .tool_output import summarize_tool_output, save_full_output
+import asyncio
+import contextvars
+import functools
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal, Any, Dict
-from .tools import complete_python_task
+from .tools import complete_python_task, run_sql, run_python_calls
+from Pages.utils.profiler import read_profile, start_profiling, compact_profile, join_key_candidates
+from Pages.utils.kernel_pool import KERNEL_POOL_MAX_WORKERS
 from langgraph.prebuilt import ToolInvocation, ToolExecutor
 import os
 
+# Cached prompt tokens are billed at this fraction of the normal input price
+CACHED_INPUT_PRICE_RATIO = 0.5
+
 # Token usage tracking callback
 class TokenUsageCallback(BaseCallbackHandler):
     def __init__(self):
         self.total_tokens = 0
         self.prompt_tokens = 0
+        self.cached_tokens = 0
         self.completion_tokens = 0
         self.cost = 0.0
         
     def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        token_usage = {}
         if hasattr(response, 'llm_output') and response.llm_output:
             token_usage = response.llm_output.get('token_usage', {})
-            if token_usage:
-                self.total_tokens = token_usage.get('total_tokens', 0)
-                self.prompt_tokens = token_usage.get('prompt_tokens', 0)
-                self.completion_tokens = token_usage.get('completion_tokens', 0)
-                
-                # Calculate cost based on model (approximate pricing)
-                model_name = os.getenv("OPENAI_MODEL", "gpt-4o")
-                if "gpt-4o" in model_name:
-                    # GPT-4o pricing: $5/1M input, $15/1M output
-                    input_cost = (self.prompt_tokens / 1000000) * 5.0
-                    output_cost = (self.completion_tokens / 1000000) * 15.0
-                    self.cost = input_cost + output_cost
-                elif "gpt-4o-mini" in model_name:
-                    # GPT-4o-mini pricing: $0.15/1M input, $0.60/1M output
-                    input_cost = (self.prompt_tokens / 1000000) * 0.15
-                    output_cost = (self.completion_tokens / 1000000) * 0.60
-                    self.cost = input_cost + output_cost
-                elif "gpt-4-turbo" in model_name:
-                    # GPT-4-turbo pricing: $10/1M input, $30/1M output
-                    input_cost = (self.prompt_tokens / 1000000) * 10.0
-                    output_cost = (self.completion_tokens / 1000000) * 30.0
-                    self.cost = input_cost + output_cost
-                elif "gpt-3.5-turbo" in model_name:
-                    # GPT-3.5-turbo pricing: $0.50/1M input, $1.50/1M output
-                    input_cost = (self.prompt_tokens / 1000000) * 0.50
-                    output_cost = (self.completion_tokens / 1000000) * 1.50
-                    self.cost = input_cost + output_cost
+        if not token_usage:
+            # Streamed responses report usage on the message instead of llm_output
+            token_usage = self._usage_from_generations(response)
+        if token_usage:
+            self.total_tokens = token_usage.get('total_tokens', 0)
+            self.prompt_tokens = token_usage.get('prompt_tokens', 0)
+            self.completion_tokens = token_usage.get('completion_tokens', 0)
+            # Prompt tokens served from the provider's prefix cache
+            self.cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+            self.cost = self._estimate_cost()
+
+    def _usage_from_generations(self, response: Any) -> Dict[str, int]:
+        for generations in getattr(response, 'generations', []) or []:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    return {
+                        'total_tokens': usage.get('total_tokens', 0),
+                        'prompt_tokens': usage.get('input_tokens', 0),
+                        'completion_tokens': usage.get('output_tokens', 0),
+                        'prompt_tokens_details': {
+                            'cached_tokens': (usage.get('input_token_details') or {}).get('cache_read', 0)
+                        }
+                    }
+        return {}
+
+    def _billable_prompt_tokens(self) -> float:
+        return self.prompt_tokens - self.cached_tokens * (1 - CACHED_INPUT_PRICE_RATIO)
+
+    def _estimate_cost(self) -> float:
+        # Calculate cost based on model (approximate pricing)
+        model_name = os.getenv("OPENAI_MODEL", "gpt-4o")
+        if "gpt-4o" in model_name:
+            # GPT-4o pricing: $5/1M input, $15/1M output
+            input_cost = (self._billable_prompt_tokens() / 1000000) * 5.0
+            output_cost = (self.completion_tokens / 1000000) * 15.0
+            return input_cost + output_cost
+        elif "gpt-4o-mini" in model_name:
+            # GPT-4o-mini pricing: $0.15/1M input, $0.60/1M output
+            input_cost = (self._billable_prompt_tokens() / 1000000) * 0.15
+            output_cost = (self.completion_tokens / 1000000) * 0.60
+            return input_cost + output_cost
+        elif "gpt-4-turbo" in model_name:
+            # GPT-4-turbo pricing: $10/1M input, $30/1M output
+            input_cost = (self._billable_prompt_tokens() / 1000000) * 10.0
+            output_cost = (self.completion_tokens / 1000000) * 30.0
+            return input_cost + output_cost
+        elif "gpt-3.5-turbo" in model_name:
+            # GPT-3.5-turbo pricing: $0.50/1M input, $1.50/1M output
+            input_cost = (self._billable_prompt_tokens() / 1000000) * 0.50
+            output_cost = (self.completion_tokens / 1000000) * 1.50
+            return input_cost + output_cost
+        return self.cost
 
 # Load model configuration from environment variables
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
@@ -58,10 +98,11 @@ token_callback = TokenUsageCallback()
 llm = ChatOpenAI(
     model=OPENAI_MODEL, 
     temperature=OPENAI_TEMPERATURE,
-    callbacks=[token_callback]
+    callbacks=[token_callback],
+    stream_usage=True
 )
 
-tools = [complete_python_task]
+tools = [complete_python_task, run_sql]
 
 model = llm.bind_tools(tools)
 tool_executor = ToolExecutor(tools)
@@ -76,19 +117,32 @@ chat_template = ChatPromptTemplate.from_messages([
 model = chat_template | model
 
 def create_data_summary(state: AgentState) -> str:
+    """Describe the selected datasets; stable across agent steps so it can sit in the cached prompt prefix"""
     summary = ""
-    variables = []
-    for d in state["input_data"]:
-        variables.append(d.variable_name)
+    profiles = {}
+    names = {f"dataset_{i}": d.variable_name for i, d in enumerate(state["input_data"])}
+    descriptions = {f"dataset_{i}": d.data_description for i, d in enumerate(state["input_data"])}
+    for i, d in enumerate(state["input_data"]):
         summary += f"\n\nVariable: {d.variable_name}\n"
+        summary += f"Loaded as: dataset_{i} (engine: {d.engine})\n"
         summary += f"Description: {d.data_description}"
-    
-    if "current_variables" in state:
-        remaining_variables = [v for v in state["current_variables"] if v not in variables]
-        for v in remaining_variables:
-            summary += f"\n\nVariable: {v}"
+        profile = read_profile(d.data_path)
+        if profile is not None:
+            profiles[f"dataset_{i}"] = profile
+            summary += f"\nProfile:\n{compact_profile(profile)}"
+        else:
+            # Not profiled yet (or the file changed); it will be available on a later call
+            start_profiling(d.data_path)
+    join_keys = join_key_candidates(profiles, names, descriptions)
+    if join_keys:
+        summary += "\n\nLikely join keys: " + ", ".join(join_keys)
     return summary
 
+def create_variables_summary(state: AgentState) -> str:
+    """List the session's variables; changes between steps, so it goes at the end of the prompt"""
+    variables = state.get("current_variables") or {}
+    return ", ".join(f"{name} ({type_name})" for name, type_name in variables.items())
+
 def route_to_tools(
     state: AgentState,
 ) -> Literal["tools", "__end__"]:
@@ -108,15 +162,26 @@ def route_to_tools(
 
 MAX_TOOL_CALLS = 128
 
-def call_model(state: AgentState):
+# Threads for blocking work (code execution, file access) on the async path
+ASYNC_BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", str(KERNEL_POOL_MAX_WORKERS)))
+_blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="agent-blocking")
+
+def _model_input(state: AgentState):
+    """The data message and the trimmed state sent to the model for this step"""
     # Create data summary
     current_data_template  = """The following data is available:\n{data_summary}"""
     current_data_message = HumanMessage(content=current_data_template.format(data_summary=create_data_summary(state)))
     
-    # Prepare messages ensuring we don't exceed context limits
-    messages = [current_data_message] + state["messages"]
-    if len(messages) > 10:  # Keep last 10 messages
-        messages = messages[:10]
+    # Stable prefix (system prompt, then datasets) first so the provider's prompt cache can reuse it;
+    # everything that changes between steps comes after
+    tail_messages = []
+    variables_summary = create_variables_summary(state)
+    if variables_summary:
+        tail_messages.append(SystemMessage(content=f"Variables currently defined in the python session: {variables_summary}"))
+    
+    # Prepare messages ensuring we don't exceed context limits: newest turns first, old tool outputs shortened
+    history_budget = HISTORY_TOKEN_BUDGET - sum(message_tokens(m) for m in [current_data_message] + tail_messages)
+    messages = [current_data_message] + trim_history(state["messages"], history_budget) + tail_messages
     
     # Create limited state
     limited_state = {
@@ -124,14 +189,9 @@ def call_model(state: AgentState):
         "input_data": state.get("input_data", []),
         "current_variables": state.get("current_variables", [])
     }
-    
-    # Reset token callback before each call
-    global token_callback
-    token_callback = TokenUsageCallback()
-    
-    # Invoke model with limited state and token tracking
-    llm_outputs = model.invoke(limited_state, config={"callbacks": [token_callback]})
-    
+    return current_data_message, limited_state
+
+def _model_output(llm_outputs, usage: TokenUsageCallback, current_data_message: HumanMessage) -> dict:
     # Validate tool calls length
     if hasattr(llm_outputs, "tool_calls") and len(llm_outputs.tool_calls) > MAX_TOOL_CALLS:
         raise ValueError(
@@ -141,10 +201,11 @@ def call_model(state: AgentState):
     
     # Add token usage information to the response
     token_info = {
-        "total_tokens": token_callback.total_tokens,
-        "prompt_tokens": token_callback.prompt_tokens,
-        "completion_tokens": token_callback.completion_tokens,
-        "estimated_cost": round(token_callback.cost, 6),
+        "total_tokens": usage.total_tokens,
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_tokens": usage.cached_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "estimated_cost": round(usage.cost, 6),
         "model": OPENAI_MODEL
     }
     
@@ -154,34 +215,107 @@ def call_model(state: AgentState):
         "token_usage": token_info
     }
 
+def call_model(state: AgentState):
+    current_data_message, limited_state = _model_input(state)
+    
+    # Reset token callback before each call
+    global token_callback
+    token_callback = TokenUsageCallback()
+    
+    # Invoke model with limited state and token tracking
+    if is_streaming():
+        # Forward token deltas to the UI as they arrive
+        llm_outputs = None
+        for chunk in model.stream(limited_state, config={"callbacks": [token_callback]}):
+            if chunk.content:
+                emit(TokenDelta(text=chunk.content))
+            llm_outputs = chunk if llm_outputs is None else llm_outputs + chunk
+        llm_outputs = message_chunk_to_message(llm_outputs)
+    else:
+        llm_outputs = model.invoke(limited_state, config={"callbacks": [token_callback]})
+    
+    return _model_output(llm_outputs, token_callback, current_data_message)
+
+async def acall_model(state: AgentState):
+    """call_model for graph.ainvoke: the model round-trip is awaited instead of blocking a thread"""
+    current_data_message, limited_state = _model_input(state)
+    
+    # Per call, since many conversations share the event loop
+    usage = TokenUsageCallback()
+    if is_streaming():
+        llm_outputs = None
+        async for chunk in model.astream(limited_state, config={"callbacks": [usage]}):
+            if chunk.content:
+                emit(TokenDelta(text=chunk.content))
+            llm_outputs = chunk if llm_outputs is None else llm_outputs + chunk
+        llm_outputs = message_chunk_to_message(llm_outputs)
+    else:
+        llm_outputs = await model.ainvoke(limited_state, config={"callbacks": [usage]})
+    
+    return _model_output(llm_outputs, usage, current_data_message)
+
 def call_tools(state: AgentState):
     last_message = state["messages"][-1]
-    tool_invocations = []
+    tool_calls = []
     if isinstance(last_message, AIMessage) and hasattr(last_message, 'tool_calls'):
-        tool_invocations = [
-            ToolInvocation(
-                tool=tool_call["name"],
-                tool_input={**tool_call["args"], "graph_state": state}
-            ) for tool_call in last_message.tool_calls
-        ]
-
-    responses = tool_executor.batch(tool_invocations, return_exceptions=True)
+        tool_calls = last_message.tool_calls
+        for tool_call in tool_calls:
+            emit(ToolStart(tool_call_id=tool_call["id"], name=tool_call["name"], args=tool_call["args"]))
+
+    if len(tool_calls) > 1 and all(tc["name"] == complete_python_task.name for tc in tool_calls):
+        # One request for the whole step, so independent calls can run in parallel in the session's worker
+        responses = run_python_calls(state, tool_calls)
+    else:
+        # Calls share the session's variables, so run them one at a time in the order the model gave
+        responses = []
+        for tool_call in tool_calls:
+            try:
+                responses.append(tool_executor.invoke(ToolInvocation(
+                    tool=tool_call["name"],
+                    tool_input={**tool_call["args"], "graph_state": state}
+                )))
+            except Exception as e:
+                responses.append(e)
+
     tool_messages = []
     state_updates = {}
 
-    for tc, response in zip(last_message.tool_calls, responses):
+    for tc, response in zip(tool_calls, responses):
         if isinstance(response, Exception):
             raise response
         message, updates = response
+        # Executions that were stopped or lost their worker (not errors in the code itself)
+        status = updates.pop("tool_status", "success")
+        emit(ToolEnd(tool_call_id=tc["id"], name=tc["name"], output=str(message)))
+        # The model gets a budgeted version; the full output is kept on disk for the Debug tab
+        content, shortened = summarize_tool_output(str(message))
+        if shortened:
+            full_output_path = save_full_output(str(message), state.get("session_id", "default"), tc["id"])
+            for entry in updates.get("intermediate_outputs", []):
+                if isinstance(entry, dict) and full_output_path:
+                    entry["full_output_path"] = full_output_path
+                    entry["output"] = content
         tool_messages.append(ToolMessage(
-            content=str(message),
+            content=content,
             name=tc["name"],
-            tool_call_id=tc["id"]
+            tool_call_id=tc["id"],
+            status=status
         ))
-        state_updates.update(updates)
-
-    if 'messages' not in state_updates:
-        state_updates["messages"] = []
+        # Accumulated fields (debug outputs, figures) are combined in call order; the rest take the latest value
+        for key, value in updates.items():
+            if isinstance(value, list):
+                state_updates.setdefault(key, []).extend(value)
+            else:
+                state_updates[key] = value
 
-    state_updates["messages"] = tool_messages 
+    state_updates["messages"] = tool_messages
     return state_updates
+
+async def acall_tools(state: AgentState):
+    """call_tools for graph.ainvoke: code execution blocks on the session's worker, so it runs on an executor"""
+    return await run_blocking(call_tools, state)
+
+async def run_blocking(func, *args):
+    """Run a blocking function on the executor, keeping the caller's context (e.g. the event sink)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, functools.partial(context.run, func, *args))
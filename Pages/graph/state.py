@@ -11,4 +11,5 @@ class AgentState(TypedDict):
     intermediate_outputs: Annotated[List[dict], operator.add]
     current_variables: dict
     output_image_paths: Annotated[List[str], operator.add]
+    session_id: str
 
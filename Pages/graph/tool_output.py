@@ -0,0 +1,154 @@
+import os
+import re
+import time
+from typing import List, Optional, Tuple
+
+from .history import count_tokens
+
+# Token budget for one tool result sent back to the model
+TOOL_OUTPUT_TOKEN_BUDGET = int(os.getenv("TOOL_OUTPUT_TOKEN_BUDGET", "2000"))
+# Full outputs of shortened results are kept here for the Debug tab
+TOOL_OUTPUT_DIR = os.getenv("TOOL_OUTPUT_DIR", os.path.join("cache", "tool_outputs"))
+# Saved full outputs older than this are deleted (seconds)
+TOOL_OUTPUT_RETENTION = int(os.getenv("TOOL_OUTPUT_RETENTION", str(7 * 24 * 3600)))
+
+# Tables longer than this are cut to their first and last rows
+TABLE_MAX_ROWS = 10
+# Table lines are cut to this many characters (wide frames)
+TABLE_MAX_LINE_CHARS = 160
+# Share of the budget given to the start of the output when head and tail are kept
+HEAD_SHARE = 0.6
+
+_TABLE_FOOTER = re.compile(r"^\[\d+ rows x \d+ columns\]$")
+_SAFE_NAME = re.compile(r"[^\w-]")
+_last_cleanup = 0.0
+
+
+def _is_table_line(line: str) -> bool:
+    # pandas frames/series print as whitespace-aligned columns
+    return len(line.split()) >= 2 and "  " in line.strip()
+
+
+def _table_blocks(lines: List[str]) -> List[Tuple[int, int]]:
+    """(start, end) line ranges of printed tables: runs of aligned, multi-column lines"""
+    blocks = []
+    start = None
+    for i, line in enumerate(lines + [""]):
+        if i < len(lines) and (_is_table_line(line) or (start is not None and _TABLE_FOOTER.match(line.strip()))):
+            if start is None:
+                start = i
+        else:
+            if start is not None and i - start >= 3:
+                blocks.append((start, i))
+            start = None
+    return blocks
+
+
+def compact_tables(output: str) -> Tuple[str, List[str]]:
+    """Shorten long or wide printed tables, returning the new text and notes on what was cut"""
+    lines = output.split("\n")
+    notes = []
+    for start, end in reversed(_table_blocks(lines)):
+        block = lines[start:end]
+        footer = [block.pop()] if _TABLE_FOOTER.match(block[-1].strip()) else []
+        header, rows = block[:1], block[1:]
+        wide = any(len(line) > TABLE_MAX_LINE_CHARS for line in block)
+        if len(rows) <= TABLE_MAX_ROWS and not wide:
+            continue
+        if len(rows) > TABLE_MAX_ROWS:
+            half = TABLE_MAX_ROWS // 2
+            omitted = len(rows) - 2 * half
+            rows = rows[:half] + [f"... ({omitted:,} rows omitted)"] + rows[-half:]
+            notes.append(f"{omitted:,} table rows")
+        if wide:
+            cut = lambda line: line if len(line) <= TABLE_MAX_LINE_CHARS else line[:TABLE_MAX_LINE_CHARS] + " …"
+            header, rows = [cut(line) for line in header], [cut(line) for line in rows]
+            notes.append(f"table columns beyond {TABLE_MAX_LINE_CHARS} characters")
+        lines[start:end] = header + rows + footer
+    return "\n".join(lines), notes
+
+
+def _cut_to_tokens(text: str, budget: int, from_end: bool = False) -> str:
+    """Longest prefix (or suffix) of whole lines that fits the token budget"""
+    lines = text.split("\n")
+    if from_end:
+        lines.reverse()
+    kept, used = [], 0
+    for line in lines:
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            if not kept:
+                # A single huge line (e.g. a printed list): keep part of it
+                kept.append(_cut_line(line, budget, from_end))
+            break
+        kept.append(line)
+        used += tokens
+    if from_end:
+        kept.reverse()
+    return "\n".join(kept)
+
+
+def _cut_line(line: str, budget: int, from_end: bool) -> str:
+    chars = budget * 4
+    while chars > 0:
+        part = line[-chars:] if from_end else line[:chars]
+        if count_tokens(part) <= budget:
+            return part
+        chars = int(chars * 0.8)
+    return ""
+
+
+def save_full_output(output: str, session_id: str, tool_call_id: str) -> Optional[str]:
+    """Write an output to disk for the Debug tab, returning its path (None if it couldn't be written)"""
+    directory = os.path.join(TOOL_OUTPUT_DIR, _SAFE_NAME.sub("_", session_id))
+    path = os.path.join(directory, _SAFE_NAME.sub("_", tool_call_id) + ".txt")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(output)
+        os.replace(tmp_path, path)
+    except OSError:
+        return None
+    _cleanup_old_outputs()
+    return path
+
+
+def _cleanup_old_outputs():
+    global _last_cleanup
+    now = time.time()
+    # At most once an hour
+    if now - _last_cleanup < 3600:
+        return
+    _last_cleanup = now
+    for root, _, files in os.walk(TOOL_OUTPUT_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if now - os.path.getmtime(path) > TOOL_OUTPUT_RETENTION:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def summarize_tool_output(output: str, budget: int = TOOL_OUTPUT_TOKEN_BUDGET) -> Tuple[str, bool]:
+    """Fit a tool result into the token budget, returning (text for the model, whether it was shortened)
+
+    Long or wide tables are compacted first; if that isn't enough the start and
+    end of the output are kept. A note at the end says what was dropped.
+    """
+    total_tokens = count_tokens(output)
+    if total_tokens <= budget:
+        return output, False
+
+    text, notes = compact_tables(output)
+    if count_tokens(text) > budget:
+        head = _cut_to_tokens(text, int(budget * HEAD_SHARE))
+        tail = _cut_to_tokens(text[len(head):], budget - count_tokens(head), from_end=True)
+        omitted_lines = text.count("\n") - head.count("\n") - tail.count("\n")
+        notes.append(f"{omitted_lines:,} lines from the middle" if omitted_lines > 0 else "the middle of a long line")
+        text = f"{head}\n...\n{tail}"
+
+    note = (f"[Output shortened from ~{total_tokens:,} tokens: omitted {', '.join(notes)}. "
+            f"Print narrower results (e.g. .head(), selected columns, aggregates) to see specific parts.]")
+    return f"{text}\n{note}", True
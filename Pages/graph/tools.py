@@ -2,48 +2,12 @@ from langchain_core.tools import tool
 from langchain_core.messages import AIMessage
 from typing import Annotated, Tuple
 from langgraph.prebuilt import InjectedState
-import sys
-from io import StringIO
-import os
-import plotly.graph_objects as go
-import plotly.io as pio
-import plotly.express as px
-import pandas as pd
-import sklearn
-import traceback
-
-persistent_vars = {}
-plotly_saving_code = """import pickle
-import json
-import uuid
-import plotly
-import pandas as pd
-import plotly.io as pio
-
-def convert_periods(obj):
-    if isinstance(obj, pd.Period):
-        return str(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_periods(v) for k, v in obj.items()}
-    elif isinstance(obj, (list, tuple)):
-        return [convert_periods(x) for x in obj]
-    return obj
-
-for figure in plotly_figures:
-    # Try JSON serialization first
-    try:
-        # Convert figure to JSON using plotly's built-in function
-        figure_json = pio.to_json(figure)
-        json_filename = f"images/plotly_figures/pickle/{uuid.uuid4()}.json"
-        with open(json_filename, 'w') as f:
-            f.write(figure_json)
-    except Exception as json_error:
-        # Fall back to pickle if JSON fails
-        figure = convert_periods(figure)
-        pickle_filename = f"images/plotly_figures/pickle/{uuid.uuid4()}.pickle"
-        with open(pickle_filename, 'wb') as f:
-            pickle.dump(figure, f)
-"""
+from Pages.graph.events import emit
+from Pages.utils.kernel_pool import (
+    kernel_pool, KernelCrashedError, KernelPoolFullError, KernelLimitError,
+    EXECUTION_TIMEOUT, EXECUTION_MEMORY_LIMIT_MB
+)
+from Pages.utils.sql_engine import SQL_RESULT_MAX_ROWS
 
 def get_user_friendly_error(error_str, code):
     """Convert technical errors to user-friendly messages"""
@@ -76,150 +40,89 @@ def get_user_friendly_error(error_str, code):
     elif "syntaxerror" in error_lower:
         return "🔧 Code syntax error. The AI generated invalid Python code - please try rephrasing your question."
     
+    elif "catalog error" in error_lower or "binder error" in error_lower or "parser error" in error_lower:
+        return "🗃️ SQL error. The query references a table or column that doesn't exist, or is not valid SQL."
+    
     elif "importerror" in error_lower or "modulenotfounderror" in error_lower:
         return "📦 Missing required library. Some advanced features may not be available."
     
     else:
         return f"❌ Analysis error: {error_str[:100]}{'...' if len(error_str) > 100 else ''}"
 
-@tool(parse_docstring=True)
-def complete_python_task(
-        graph_state: Annotated[dict, InjectedState], thought: str, python_code: str
-) -> Tuple[str, dict]:
-    """Completes a python task
+def worker_unavailable_response(e: Exception, thought: str, code: str) -> Tuple[str, dict]:
+    """Response when the session's execution worker can't run the request"""
+    if isinstance(e, KernelPoolFullError):
+        error_msg = "⏳ The server is busy with other analyses. Please try again in a moment."
+    else:
+        error_msg = "💥 The analysis crashed its execution worker (often due to running out of memory). Variables from earlier steps were lost and datasets will be reloaded."
+    return error_msg, {
+        # The same call may well work next time, so the answer isn't stored for replay
+        "tool_status": "error",
+        "intermediate_outputs": [{
+            "thought": thought,
+            "code": code,
+            "output": error_msg,
+            "error_details": str(e)
+        }]
+    }
 
-    Args:
-        thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
-        python_code: Python code to be executed to perform analyses, create a new dataset or create a visualization.
-    """
-    current_variables = graph_state["current_variables"] if "current_variables" in graph_state else {}
-    
-    # Load all datasets with automatic naming
-    datasets = []
-    for input_dataset in graph_state["input_data"]:
-        try:
-            df = pd.read_csv(input_dataset.data_path)
-            var_name = f"dataset_{len(datasets)}"
-            current_variables[var_name] = df
-            datasets.append({
-                'name': var_name,
-                'data': df,
-                'size': len(df),
-                'types': df.dtypes.to_dict(),
-                'sample': df.head(1).to_dict(orient='records')[0] if len(df) > 0 else {}
-            })
-        except Exception as e:
-            error_msg = get_user_friendly_error(str(e), "")
+def resource_limit_response(e: KernelLimitError, thought: str, code: str) -> Tuple[str, dict]:
+    """Structured tool error for executions stopped by a limit or by the user"""
+    if e.reason == "timeout":
+        error_msg = f"⏱️ ResourceLimitError(timeout): execution exceeded the {EXECUTION_TIMEOUT:.0f}s time limit and was stopped."
+    elif e.reason == "memory":
+        error_msg = f"💾 ResourceLimitError(memory): execution exceeded the {EXECUTION_MEMORY_LIMIT_MB} MB memory limit and was stopped."
+    else:
+        error_msg = "⏹️ ExecutionCancelled: the user stopped this execution. Do not retry it unless the user asks."
+
+    if e.reason in ("timeout", "memory"):
+        error_msg += (" Retry with a cheaper approach: aggregate with run_sql, select only the columns you need, "
+                      "work on a sample (df.sample), and avoid row-wise apply, loops over rows and many-to-many merges.")
+    if e.worker_lost:
+        error_msg += " The execution worker was restarted, so variables from earlier steps were lost."
+
+    return error_msg, {
+        "tool_status": "error",
+        "intermediate_outputs": [{
+            "thought": thought,
+            "code": code,
+            "output": error_msg,
+            "error_type": e.reason,
+            "worker_lost": e.worker_lost
+        }]
+    }
+
+def execution_response(result: dict, thought: str, python_code: str) -> Tuple[str, dict]:
+    """Turn a kernel execution result into the tool's (output, state updates)"""
+    if result['status'] == 'load_error':
+        error_msg = get_user_friendly_error(result['error'], "")
+        if result['stage'] == 'load':
             return f"Error loading dataset: {error_msg}", {
                 "intermediate_outputs": [{
-                    "error": f"Failed to load dataset {input_dataset.data_path}",
-                    "details": str(e),
+                    "error": f"Failed to load dataset {result['path']}",
+                    "details": result['error'],
                     "user_friendly": error_msg
                 }]
             }
-    
-    # Create generic relationships between datasets
-    if len(datasets) > 1:
-        try:
-            # Create combined views based on data patterns
-            numeric_cols = {}
-            date_cols = {}
-            
-            for ds in datasets:
-                for col, dtype in ds['types'].items():
-                    if 'float' in str(dtype) or 'int' in str(dtype):
-                        numeric_cols.setdefault('numeric', []).append(f"{ds['name']}.{col}")
-                    if 'datetime' in str(dtype) or 'date' in str(dtype):
-                        date_cols.setdefault('date', []).append(f"{ds['name']}.{col}")
-            
-            # Store relationship metadata
-            current_variables["_metadata"] = {
-                'datasets': datasets,
-                'relationships': {
-                    'numeric_columns': numeric_cols,
-                    'date_columns': date_cols
-                }
-            }
-            
-        except Exception as e:
-            error_msg = get_user_friendly_error(str(e), "")
-            return f"Error creating dataset relationships: {error_msg}", {
-                "intermediate_outputs": [{
-                    "error": "Failed to create dataset relationships",
-                    "details": str(e),
-                    "user_friendly": error_msg
-                }]
-            }
-    
-    if not os.path.exists("images/plotly_figures/pickle"):
-        os.makedirs("images/plotly_figures/pickle")
-
-    current_image_pickle_files = os.listdir("images/plotly_figures/pickle")
-    old_stdout = None
-    
-    try:
-        # Capture stdout
-        old_stdout = sys.stdout
-        sys.stdout = StringIO()
-
-        # Execute the code and capture the result
-        exec_globals = globals().copy()
-        exec_globals.update(persistent_vars)
-        exec_globals.update(current_variables)
-        exec_globals.update({"plotly_figures": []})
-
-        # Add safety checks for common issues
-        if "dataset_" not in python_code and len(datasets) > 0:
-            # If no dataset is referenced, add a helpful comment
-            python_code = f"# Available datasets: {', '.join([ds['name'] for ds in datasets])}\n" + python_code
-
-        exec(python_code, exec_globals)
-        persistent_vars.update({k: v for k, v in exec_globals.items() if k not in globals()})
-
-        # Get the captured stdout
-        output = sys.stdout.getvalue()
-
-        # Restore stdout
-        sys.stdout = old_stdout
-
-        updated_state = {
-            "intermediate_outputs": [{"thought": thought, "code": python_code, "output": output}],
-            "current_variables": persistent_vars
+        return f"Error creating dataset relationships: {error_msg}", {
+            "intermediate_outputs": [{
+                "error": "Failed to create dataset relationships",
+                "details": result['error'],
+                "user_friendly": error_msg
+            }]
         }
 
-        if 'plotly_figures' in exec_globals and exec_globals['plotly_figures']:
-            try:
-                exec(plotly_saving_code, exec_globals)
-                # Check if any images were created
-                new_image_folder_contents = os.listdir("images/plotly_figures/pickle")
-                new_image_files = [file for file in new_image_folder_contents if file not in current_image_pickle_files]
-                if new_image_files:
-                    updated_state["output_image_paths"] = new_image_files
-                
-                persistent_vars["plotly_figures"] = []
-            except Exception as plot_error:
-                # Don't fail the entire operation if plotting fails
-                output += f"\n⚠️ Warning: Could not save visualization: {str(plot_error)}"
-                updated_state["intermediate_outputs"][0]["output"] = output
-
-        return output, updated_state
-        
-    except Exception as e:
-        # Restore stdout if it was captured
-        if old_stdout:
-            sys.stdout = old_stdout
-        
-        # Get detailed error information
-        error_details = traceback.format_exc()
-        error_msg = get_user_friendly_error(str(e), python_code)
+    python_code = result.get('python_code', python_code)
+    if result['status'] == 'error':
+        error_msg = get_user_friendly_error(result['error'], python_code)
         
         # Provide helpful suggestions based on error type
         suggestions = []
-        if "NameError" in str(e):
+        if "NameError" in result['error']:
             suggestions.append("💡 Try describing your data first with: 'Show me a summary of my data'")
-        elif "KeyError" in str(e):
+        elif "KeyError" in result['error']:
             suggestions.append("💡 Check available columns with: 'What columns are in my dataset?'")
-        elif "ValueError" in str(e) and "empty" in str(e).lower():
+        elif "ValueError" in result['error'] and "empty" in result['error'].lower():
             suggestions.append("💡 Your dataset might be empty. Try uploading data first.")
         
         suggestion_text = "\n".join(suggestions) if suggestions else ""
@@ -229,7 +132,117 @@ def complete_python_task(
                 "thought": thought, 
                 "code": python_code, 
                 "output": error_msg,
-                "error_details": error_details,
+                "error_details": result.get('error_details', ''),
                 "suggestions": suggestions
             }]
         }
+
+    output = result['output']
+    updated_state = {
+        "intermediate_outputs": [{"thought": thought, "code": python_code, "output": output}],
+        "current_variables": result['variables']
+    }
+    if result['image_files']:
+        updated_state["output_image_paths"] = result['image_files']
+    if result.get('cached'):
+        # Identical read-only code on unchanged data: output replayed, not re-executed
+        updated_state["intermediate_outputs"][0]["cached"] = True
+
+    return output, updated_state
+
+
+@tool(parse_docstring=True)
+def complete_python_task(
+        graph_state: Annotated[dict, InjectedState], thought: str, python_code: str
+) -> Tuple[str, dict]:
+    """Completes a python task
+
+    Args:
+        thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
+        python_code: Python code to be executed to perform analyses, create a new dataset or create a visualization.
+    """
+    # Runs in the session's own worker process, which holds the session's variables
+    try:
+        result = kernel_pool.request(
+            graph_state.get("session_id", "default"), "execute",
+            on_event=emit, python_code=python_code, input_data=graph_state["input_data"]
+        )
+    except KernelLimitError as e:
+        return resource_limit_response(e, thought, python_code)
+    except (KernelCrashedError, KernelPoolFullError) as e:
+        return worker_unavailable_response(e, thought, python_code)
+
+    return execution_response(result, thought, python_code)
+
+
+def run_python_calls(graph_state: dict, tool_calls: list) -> list:
+    """Run several complete_python_task calls from one agent step as a single kernel request
+
+    Independent calls execute in parallel inside the session's worker; the
+    responses come back in call order, as if each had been run on its own.
+    """
+    calls = [{'python_code': tc["args"]["python_code"], 'tool_call_id': tc["id"]} for tc in tool_calls]
+    try:
+        batch = kernel_pool.request(
+            graph_state.get("session_id", "default"), "execute_batch",
+            on_event=emit, calls=calls, input_data=graph_state["input_data"]
+        )
+    except KernelLimitError as e:
+        return [resource_limit_response(e, tc["args"].get("thought", ""), tc["args"]["python_code"]) for tc in tool_calls]
+    except (KernelCrashedError, KernelPoolFullError) as e:
+        return [worker_unavailable_response(e, tc["args"].get("thought", ""), tc["args"]["python_code"]) for tc in tool_calls]
+
+    return [execution_response(result, tc["args"].get("thought", ""), tc["args"]["python_code"])
+            for tc, result in zip(tool_calls, batch['results'])]
+
+
+@tool(parse_docstring=True)
+def run_sql(
+        graph_state: Annotated[dict, InjectedState], thought: str, query: str, result_name: str = "sql_result"
+) -> Tuple[str, dict]:
+    """Runs a SQL query directly on the selected datasets
+
+    Args:
+        thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
+        query: DuckDB SQL query. Each dataset is a table named dataset_0, dataset_1, etc. Use it for joins, filters and aggregations.
+        result_name: Name of the python variable the result DataFrame is stored in, so later python steps can use it.
+    """
+    if not result_name.isidentifier() or result_name.startswith("dataset_"):
+        return f"❌ Invalid result_name '{result_name}'. Use a python identifier that doesn't start with 'dataset_'.", {
+            "intermediate_outputs": [{"thought": thought, "code": query, "output": "Invalid result_name"}]
+        }
+
+    try:
+        result = kernel_pool.request(
+            graph_state.get("session_id", "default"), "sql",
+            query=query, input_data=graph_state["input_data"], result_name=result_name
+        )
+    except KernelLimitError as e:
+        return resource_limit_response(e, thought, query)
+    except (KernelCrashedError, KernelPoolFullError) as e:
+        return worker_unavailable_response(e, thought, query)
+
+    if result['status'] == 'error':
+        error_msg = get_user_friendly_error(result['error'], query)
+        # The model needs the engine's message to fix the query
+        return f"{error_msg}\n{result['error']}", {
+            "intermediate_outputs": [{
+                "thought": thought,
+                "code": query,
+                "output": error_msg,
+                "error_details": result.get('error_details', '')
+            }]
+        }
+
+    if result['shape'] is None:
+        output = "Statement executed successfully (no result set)."
+    else:
+        output = f"Result stored in `{result_name}` with shape {result['shape']}"
+        if result['truncated']:
+            output += f" (truncated to the first {SQL_RESULT_MAX_ROWS:,} rows - aggregate further in SQL)"
+        output += f":\n{result['preview']}"
+
+    return output, {
+        "intermediate_outputs": [{"thought": thought, "code": query, "output": output}],
+        "current_variables": result['variables']
+    }
@@ -4,16 +4,37 @@ import os
 import json
 from langchain_core.messages import HumanMessage, AIMessage
 from Pages.backend import PythonChatbot, InputData
-import pickle
-import plotly.io as pio
+from Pages.graph.events import TokenDelta, ToolStart, ToolEnd, StdoutChunk, FigureReady, Queued, StreamDone, StreamError
+from Pages.utils.uploads import save_upload, start_ingest
+from Pages.utils.preview import dataset_preview
+from Pages.utils.figure_store import figure_store
+from Pages.utils.async_handler import job_scheduler
+from Pages.utils.sql_engine import ENGINES, default_engine, out_of_core_available
 from datetime import datetime
 
 # Create uploads directory if it doesn't exist
 if not os.path.exists("uploads"):
     os.makedirs("uploads")
 
+# Decoded figures kept in memory for redrawing the chat (shared by all sessions)
+FIGURE_CACHE_ENTRIES = int(os.getenv("FIGURE_CACHE_ENTRIES", "64"))
+# Charts of older answers are only drawn when opened
+EAGER_FIGURE_TURNS = 3
+
 st.title("Data Analysis Dashboard")
 
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, show_spinner=False)
+def load_figure(figure_id):
+    """Decode a saved figure once; ids never change content, so it is reused across reruns and sessions"""
+    return figure_store.load(figure_id)
+
+def render_figures(image_paths):
+    for image_path in image_paths:
+        try:
+            st.plotly_chart(load_figure(image_path), use_container_width=True)
+        except Exception as e:
+            st.error(f"Error displaying chart: {str(e)}")
+
 # Load data dictionary
 with open('data_dictionary.json', 'r') as f:
     data_dictionary = json.load(f)
@@ -25,10 +46,21 @@ with tab1:
     uploaded_files = st.file_uploader("Upload CSV files", type="csv", accept_multiple_files=True)
 
     if uploaded_files:
-        # Save uploaded files
+        if 'ingested_uploads' not in st.session_state:
+            st.session_state.ingested_uploads = set()
+
+        # Save uploaded files once per upload; identical files already on disk are not rewritten
         for file in uploaded_files:
-            with open(os.path.join("uploads", file.name), "wb") as f:
-                f.write(file.getbuffer())
+            upload_key = (file.name, file.size)
+            if upload_key in st.session_state.ingested_uploads:
+                continue
+            with st.spinner(f"Saving {file.name}..."):
+                file_path, changed = save_upload(file)
+            if not changed:
+                st.info(f"{file.name} is identical to the copy already uploaded; reusing it.")
+            # Columnar conversion and column statistics for the agent run in the background
+            start_ingest(file_path)
+            st.session_state.ingested_uploads.add(upload_key)
         st.success("Files uploaded successfully!")
 
     # Get list of available CSV files
@@ -53,9 +85,23 @@ with tab1:
             for tab, filename in zip(file_tabs, selected_files):
                 with tab:
                     try:
-                        df = pd.read_csv(os.path.join("uploads", filename))
-                        st.write(f"Preview of {filename}:")
-                        st.dataframe(df.head())
+                        file_path = os.path.join("uploads", filename)
+                        engine_options = list(ENGINES) if out_of_core_available() else ["pandas"]
+                        engine = st.selectbox(
+                            "Execution engine",
+                            engine_options,
+                            index=engine_options.index(default_engine(file_path)),
+                            key=f"engine_{filename}",
+                            help="pandas loads the whole file into memory; duckdb streams queries over the file for datasets larger than RAM"
+                        )
+
+                        # First rows only, cached per file version: no full parse on reruns
+                        preview = dataset_preview(file_path)
+                        if preview['rows'] is not None:
+                            st.write(f"Preview of {filename} ({preview['rows']:,} rows × {preview['columns']} columns):")
+                        else:
+                            st.write(f"Preview of {filename} ({preview['columns']} columns):")
+                        st.dataframe(preview['data'])
                         
                         # Display/edit data dictionary information
                         st.subheader("Dataset Information")
@@ -115,8 +161,8 @@ with tab1:
         st.info("No CSV files available. Please upload some files first.")
 
 with tab2:
-    def process_user_query(user_query):
-        """Process user query with progress indicators and error handling"""
+    def process_user_query(user_query, resume=False):
+        """Process user query with progress indicators and error handling (resume finishes an interrupted one)"""
         if 'selected_files' not in st.session_state or not st.session_state['selected_files']:
             st.error("Please select files to analyze in the Data Management tab first.")
             return
@@ -125,44 +171,76 @@ with tab2:
             InputData(
                 variable_name=f"{file.split('.')[0]}", 
                 data_path=os.path.abspath(os.path.join("uploads", file)), 
-                data_description=data_dictionary.get(file, {}).get('description', '')
+                data_description=data_dictionary.get(file, {}).get('description', ''),
+                engine=st.session_state.get(f"engine_{file}", "pandas")
             ) 
             for file in st.session_state['selected_files']
         ]
         
-        # Show progress indicator
-        with st.spinner("🤖 Analyzing your data..."):
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+        # Clicking stops the running code; the callback runs even though the rerun interrupts this loop
+        st.button("⏹️ Stop analysis", key="stop_analysis", on_click=st.session_state.visualisation_chatbot.cancel)
+        
+        # Stream the agent's work into the chat as it happens
+        with st.chat_message("AI"):
+            status = st.status("🧠 AI is thinking...", expanded=False)
+            text_placeholder = st.empty()
+            streamed_text = ""
+            # Per tool call, since parallel calls stream their output interleaved
+            stdout_texts = {}
+            stdout_placeholders = {}
+            last_tool_call_id = None
             
             try:
-                status_text.text("🔍 Processing your query...")
-                progress_bar.progress(25)
-                
-                status_text.text("🧠 AI is thinking...")
-                progress_bar.progress(50)
-                
-                status_text.text("📊 Generating analysis...")
-                progress_bar.progress(75)
-                
-                st.session_state.visualisation_chatbot.user_sent_message(user_query, input_data=input_data_list)
-                
-                progress_bar.progress(100)
-                status_text.text("✅ Analysis complete!")
-                
-                # Clear progress indicators after a brief moment
-                import time
-                time.sleep(0.5)
-                progress_bar.empty()
-                status_text.empty()
+                chatbot = st.session_state.visualisation_chatbot
+                events = chatbot.stream_resumed_turn() if resume else chatbot.stream_user_message(user_query, input_data=input_data_list)
+                for event in events:
+                    if isinstance(event, TokenDelta):
+                        streamed_text += event.text
+                        text_placeholder.markdown(streamed_text + "▌")
+                    elif isinstance(event, ToolStart):
+                        status.update(label=f"📊 Running {event.name}...", state="running")
+                        with status:
+                            if event.args.get('thought'):
+                                st.markdown(event.args['thought'])
+                            st.code(event.args.get('python_code') or event.args.get('query', ''),
+                                    language="python" if 'python_code' in event.args else "sql")
+                            stdout_placeholders[event.tool_call_id] = st.empty()
+                        stdout_texts[event.tool_call_id] = ""
+                        last_tool_call_id = event.tool_call_id
+                        # Text streamed before a tool call belongs to that step, not the final answer
+                        streamed_text = ""
+                        text_placeholder.empty()
+                    elif isinstance(event, StdoutChunk):
+                        call_id = event.tool_call_id or last_tool_call_id
+                        if call_id in stdout_placeholders:
+                            stdout_texts[call_id] += event.text
+                            # Only repaint the tail so huge outputs don't slow down the page
+                            stdout_placeholders[call_id].text(stdout_texts[call_id][-5000:])
+                    elif isinstance(event, ToolEnd):
+                        status.update(label="🧠 AI is thinking...", state="running")
+                        if event.tool_call_id in stdout_placeholders and not stdout_texts.get(event.tool_call_id):
+                            stdout_placeholders[event.tool_call_id].text(event.output[-5000:])
+                    elif isinstance(event, FigureReady):
+                        with status:
+                            st.plotly_chart(load_figure(event.figure_path), use_container_width=True)
+                    elif isinstance(event, Queued):
+                        status.update(label=f"⏳ Waiting for a free analysis slot ({event.position} in queue)...", state="running")
+                    elif isinstance(event, StreamError):
+                        raise RuntimeError(event.error)
+                    elif isinstance(event, StreamDone):
+                        status.update(label="✅ Analysis complete!", state="complete")
+                        text_placeholder.markdown(streamed_text)
                 
             except Exception as e:
-                progress_bar.empty()
-                status_text.empty()
+                status.update(label="❌ Analysis failed", state="error")
                 
                 # User-friendly error handling
                 error_message = str(e)
-                if "recursion" in error_message.lower():
+                if "server is busy" in error_message.lower():
+                    st.error("⏳ The server is busy with other analyses. Please try again in a moment.")
+                elif "cancelled" in error_message.lower():
+                    st.info("⏹️ The analysis was cancelled.")
+                elif "recursion" in error_message.lower():
                     st.error("🔄 The analysis became too complex. Try asking a simpler question or breaking it into smaller parts.")
                 elif "openai" in error_message.lower() or "api" in error_message.lower():
                     st.error("🔑 There's an issue with the AI service. Please check your API key configuration.")
@@ -223,7 +301,16 @@ with tab2:
 
     if 'selected_files' in st.session_state and st.session_state['selected_files']:
         if 'visualisation_chatbot' not in st.session_state:
-            st.session_state.visualisation_chatbot = PythonChatbot()
+            # The session id in the URL reopens a stored conversation, e.g. after a server restart
+            st.session_state.visualisation_chatbot = PythonChatbot(session_id=st.query_params.get("session"))
+        st.query_params["session"] = st.session_state.visualisation_chatbot.session_id
+        
+        interrupted_query = st.session_state.visualisation_chatbot.interrupted_query()
+        if interrupted_query:
+            st.warning(f"⚠️ The analysis of \"{interrupted_query}\" was interrupted before it finished.")
+            if st.button("▶️ Resume analysis", key="resume_analysis"):
+                process_user_query(interrupted_query, resume=True)
+                st.rerun()
         
         # Smart Query Suggestions
         if len(st.session_state.visualisation_chatbot.chat_history) == 0:
@@ -245,6 +332,10 @@ with tab2:
         
         chat_container = st.container(height=500)
         with chat_container:
+            # Only the latest answers draw their charts on every rerun, so repaint time stays flat
+            output_image_paths = st.session_state.visualisation_chatbot.output_image_paths
+            eager_figure_turns = set(sorted(output_image_paths)[-EAGER_FIGURE_TURNS:])
+            
             # Display chat history with associated images
             for msg_index, msg in enumerate(st.session_state.visualisation_chatbot.chat_history):
                 msg_col, img_col = st.columns([2, 1])
@@ -256,20 +347,12 @@ with tab2:
                         with st.chat_message("AI"):
                             st.markdown(msg.content)
 
-                    if isinstance(msg, AIMessage) and msg_index in st.session_state.visualisation_chatbot.output_image_paths:
-                        image_paths = st.session_state.visualisation_chatbot.output_image_paths[msg_index]
-                        for image_path in image_paths:
-                            try:
-                                if image_path.endswith('.json'):
-                                    with open(os.path.join("images/plotly_figures/pickle", image_path), "r") as f:
-                                        fig_json = f.read()
-                                        fig = pio.from_json(fig_json)
-                                else:
-                                    with open(os.path.join("images/plotly_figures/pickle", image_path), "rb") as f:
-                                        fig = pickle.load(f)
-                                st.plotly_chart(fig, use_container_width=True)
-                            except Exception as e:
-                                st.error(f"Error displaying chart: {str(e)}")
+                    if isinstance(msg, AIMessage) and msg_index in output_image_paths:
+                        image_paths = output_image_paths[msg_index]
+                        if msg_index in eager_figure_turns:
+                            render_figures(image_paths)
+                        elif st.toggle(f"📊 Show {len(image_paths)} chart(s)", key=f"show_figures_{msg_index}"):
+                            render_figures(image_paths)
         
         # Chat input - using callback function instead of session state assignment
         user_input = st.chat_input(placeholder="Ask me anything about your data")
@@ -281,6 +364,10 @@ with tab2:
         st.info("Please select files to analyze in the Data Management tab first.")
 
 with tab3:
+    queue_metrics = job_scheduler.metrics()
+    st.caption(f"Analysis queue: {queue_metrics['running']}/{queue_metrics['workers']} running, "
+               f"{queue_metrics['queue_depth']} waiting · avg wait {queue_metrics['avg_wait_time']:.1f}s, "
+               f"avg run {queue_metrics['avg_run_time']:.1f}s")
     if 'visualisation_chatbot' in st.session_state:
         st.subheader("Intermediate Outputs")
         for i, output in enumerate(st.session_state.visualisation_chatbot.intermediate_outputs):
@@ -295,6 +382,14 @@ with tab3:
                     if 'output' in output:
                         st.markdown("### Output")
                         st.text(output['output'])
+                    if output.get('full_output_path'):
+                        # The model saw the shortened output above; the complete one is read from disk on demand
+                        if os.path.exists(output['full_output_path']):
+                            if st.checkbox("Show full output", key=f"full_output_{i}"):
+                                with open(output['full_output_path'], "r") as f:
+                                    st.text(f.read())
+                        else:
+                            st.caption("The full output is no longer available.")
                 else:
                     st.markdown("### Output")
                     st.text(str(output))
@@ -346,6 +441,8 @@ with tab4:
             col1, col2 = st.columns(2)
             with col1:
                 st.write(f"**Total Requests:** {total_usage['total_requests']}")
+                cached_share = total_usage['cached_tokens'] / total_usage['prompt_tokens'] if total_usage['prompt_tokens'] else 0
+                st.write(f"**Cached Input Tokens:** {total_usage['cached_tokens']:,} ({cached_share:.0%})")
                 session_duration = total_usage['last_request'] - total_usage['session_start']
                 st.write(f"**Session Duration:** {session_duration/60:.1f} minutes")
             
@@ -366,6 +463,7 @@ with tab4:
                         "Query": entry['query'][:50] + "..." if len(entry['query']) > 50 else entry['query'],
                         "Total Tokens": entry['usage']['total_tokens'],
                         "Input Tokens": entry['usage']['prompt_tokens'],
+                        "Cached Tokens": entry['usage'].get('cached_tokens', 0),
                         "Output Tokens": entry['usage']['completion_tokens'],
                         "Cost ($)": f"{entry['usage']['estimated_cost']:.4f}",
                         "Time": datetime.fromtimestamp(entry['timestamp']).strftime("%H:%M:%S")
@@ -423,6 +521,7 @@ with tab4:
         if st.button("🔄 Reset Token Usage History", type="secondary"):
             if hasattr(st.session_state.visualisation_chatbot, 'token_usage_history'):
                 st.session_state.visualisation_chatbot.token_usage_history = []
+                st.session_state.visualisation_chatbot.persist()
                 st.success("Token usage history reset!")
                 st.rerun()
                 
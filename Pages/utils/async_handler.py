@@ -1,103 +1,246 @@
-import asyncio
+import bisect
+import itertools
+import logging
+import os
 import threading
 import time
-from typing import Callable, Any, Optional
-import streamlit as st
-
-class AsyncTaskManager:
-    """Manages asynchronous task execution for Streamlit apps"""
-    
-    def __init__(self):
-        self.tasks = {}
-        self.results = {}
-        
-    def submit_task(self, task_id: str, func: Callable, *args, **kwargs) -> str:
-        """Submit a task for background execution"""
-        def run_task():
-            try:
-                result = func(*args, **kwargs)
-                self.results[task_id] = {
-                    'status': 'completed',
-                    'result': result,
-                    'error': None,
-                    'timestamp': time.time()
-                }
-            except Exception as e:
-                self.results[task_id] = {
-                    'status': 'failed',
-                    'result': None,
-                    'error': str(e),
-                    'timestamp': time.time()
-                }
-        
-        # Initialize task status
-        self.results[task_id] = {
-            'status': 'running',
-            'result': None,
-            'error': None,
-            'timestamp': time.time()
-        }
-        
-        # Start background thread
-        thread = threading.Thread(target=run_task)
-        thread.daemon = True
-        thread.start()
-        self.tasks[task_id] = thread
-        
-        return task_id
-    
-    def get_task_status(self, task_id: str) -> dict:
-        """Get the status of a task"""
-        return self.results.get(task_id, {'status': 'not_found'})
-    
-    def is_task_complete(self, task_id: str) -> bool:
-        """Check if a task is complete"""
-        status = self.get_task_status(task_id)
-        return status['status'] in ['completed', 'failed']
-    
-    def get_task_result(self, task_id: str) -> Any:
-        """Get the result of a completed task"""
-        status = self.get_task_status(task_id)
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Analyses running at the same time across all sessions. They mostly wait on the model API rather than
+# use a CPU, so this doesn't follow the core count (a one-CPU host would otherwise serve one session at a time)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Analyses one session can run at the same time; further ones wait in the queue
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))
+# Jobs allowed to wait before new submissions are refused (0 = unbounded)
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+# Finished jobs and their results are dropped after this long (seconds)
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+
+# Finished jobs kept for the wait/run time metrics
+METRICS_WINDOW = 200
+
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+
+class JobQueueFullError(RuntimeError):
+    """Too many jobs are already waiting; the caller should try again later"""
+
+
+@dataclass
+class Job:
+    id: str
+    user_id: str
+    priority: int
+    func: Callable
+    on_cancel: Optional[Callable] = None
+    status: str = "queued"
+    result: Any = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_requested: threading.Event = field(default_factory=threading.Event)
+
+
+class JobScheduler:
+    """Fixed pool of worker threads serving a priority queue of jobs
+
+    Jobs run in (priority, submission) order, lower priority values first,
+    skipping jobs whose user already has JOB_MAX_PER_USER jobs running.
+    Finished jobs keep their result until it expires.
+    """
+
+    def __init__(self, workers: int, max_per_user: int, queue_max: int, result_ttl: float):
+        self.max_per_user = max_per_user
+        self.queue_max = queue_max
+        self.result_ttl = result_ttl
+        self.jobs: Dict[str, Job] = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running_per_user: Dict[str, int] = {}
+        self._finished = deque(maxlen=METRICS_WINDOW)
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f"job-worker-{i}")
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func: Callable, *args, user_id: str = "default", priority: int = 0,
+               job_id: Optional[str] = None, on_cancel: Optional[Callable] = None, **kwargs) -> str:
+        """Queue func(*args, **kwargs) and return the job id
+
+        on_cancel is called (from the cancelling thread) when a running job is
+        cancelled, to stop whatever the job is waiting on.
+        Raises JobQueueFullError when the queue is full.
+        """
+        job = Job(id=job_id or uuid.uuid4().hex, user_id=user_id, priority=priority,
+                  func=lambda: func(*args, **kwargs), on_cancel=on_cancel)
+        with self._condition:
+            self._expire()
+            if self.queue_max and len(self._queue) >= self.queue_max:
+                raise JobQueueFullError(f"{len(self._queue)} analyses are already waiting. Please try again in a moment.")
+            self.jobs[job.id] = job
+            # Kept sorted by (priority, submission order)
+            bisect.insort(self._queue, (priority, next(self._sequence), job))
+            self._condition.notify_all()
+        return job.id
+
+    def status(self, job_id: str) -> dict:
+        """Status of a job, with its queue position (1 = next to run) while it waits"""
+        with self._condition:
+            self._expire()
+            job = self.jobs.get(job_id)
+            if job is None:
+                return {'status': 'not_found'}
+            status = {
+                'status': job.status,
+                'result': job.result,
+                'error': job.error,
+                'timestamp': job.finished_at or job.started_at or job.submitted_at,
+                'wait_time': (job.started_at or time.time()) - job.submitted_at
+            }
+            if job.status == "queued":
+                status['position'] = self._position(job)
+            if job.status == "running":
+                # Cancelled, but the job hasn't returned yet
+                status['cancel_requested'] = job.cancel_requested.is_set()
+            if job.started_at is not None:
+                status['run_time'] = (job.finished_at or time.time()) - job.started_at
+            return status
+
+    def result(self, job_id: str) -> Any:
+        """Result of a completed job; raises for failed or cancelled jobs, None while it is pending"""
+        status = self.status(job_id)
         if status['status'] == 'completed':
             return status['result']
-        elif status['status'] == 'failed':
+        if status['status'] in ('failed', 'cancelled'):
             raise Exception(status['error'])
-        else:
-            return None
-    
-    def cleanup_old_tasks(self, max_age_seconds: int = 3600):
-        """Clean up old completed tasks"""
-        current_time = time.time()
-        to_remove = []
-        
-        for task_id, result in self.results.items():
-            if current_time - result['timestamp'] > max_age_seconds:
-                to_remove.append(task_id)
-        
-        for task_id in to_remove:
-            self.results.pop(task_id, None)
-            self.tasks.pop(task_id, None)
-
-# Global task manager instance
-if 'async_task_manager' not in st.session_state:
-    st.session_state.async_task_manager = AsyncTaskManager()
+        return None
+
+    def cancel(self, job_id: str, wait: float = 0) -> bool:
+        """Cancel a job, returning True once it is cancelled
+
+        A queued job is removed and never runs. A running job has its on_cancel
+        hook called to interrupt what it is waiting on, but only stops when its
+        function returns: cancel waits up to `wait` seconds for that and returns
+        False if it is still running (status() reports cancel_requested meanwhile,
+        and 'cancelled' once it has stopped).
+        """
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            job.cancel_requested.set()
+            if job.status == "queued":
+                self._queue = [entry for entry in self._queue if entry[2] is not job]
+                self._finish(job, "cancelled", error="Cancelled before it started")
+                return True
+        if job.on_cancel is not None:
+            try:
+                job.on_cancel()
+            except Exception as e:
+                logger.warning(f"Error cancelling job {job_id}: {str(e)}")
+        with self._condition:
+            self._condition.wait_for(lambda: job.status in FINISHED_STATES, timeout=wait)
+            return job.status == "cancelled"
+
+    def metrics(self) -> dict:
+        """Queue depth, running jobs, and wait/run time statistics of recently finished jobs"""
+        with self._condition:
+            waits = sorted(wait for wait, _ in self._finished)
+            runs = sorted(run for _, run in self._finished if run is not None)
+            running = sum(self._running_per_user.values())
+            now = time.time()
+            return {
+                'queue_depth': len(self._queue),
+                'running': running,
+                'workers': len(self._workers),
+                'oldest_wait': now - min((job.submitted_at for _, _, job in self._queue), default=now),
+                'avg_wait_time': sum(waits) / len(waits) if waits else 0.0,
+                'p95_wait_time': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'avg_run_time': sum(runs) / len(runs) if runs else 0.0,
+                'p95_run_time': runs[int(len(runs) * 0.95)] if runs else 0.0
+            }
+
+    def _position(self, job: Job) -> int:
+        # Dispatch order, ignoring per-user limits (which can only push a job back)
+        for position, (_, _, queued) in enumerate(self._queue, start=1):
+            if queued is job:
+                return position
+        return 0
+
+    def _next_job(self) -> Optional[Job]:
+        for index, (_, _, job) in enumerate(self._queue):
+            if self._running_per_user.get(job.user_id, 0) < self.max_per_user:
+                del self._queue[index]
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                job.status = "running"
+                job.started_at = time.time()
+                self._running_per_user[job.user_id] = self._running_per_user.get(job.user_id, 0) + 1
+
+            try:
+                result = job.func()
+                outcome = ("cancelled", None, "Cancelled by the user") if job.cancel_requested.is_set() else ("completed", result, None)
+            except Exception as e:
+                outcome = ("cancelled" if job.cancel_requested.is_set() else "failed", None, str(e))
+
+            with self._condition:
+                self._running_per_user[job.user_id] -= 1
+                if not self._running_per_user[job.user_id]:
+                    del self._running_per_user[job.user_id]
+                self._finish(job, outcome[0], result=outcome[1], error=outcome[2])
+                # A slot for this user is free again
+                self._condition.notify_all()
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self._finished.append((
+            (job.started_at or job.finished_at) - job.submitted_at,
+            job.finished_at - job.started_at if job.started_at is not None else None
+        ))
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.status in FINISHED_STATES and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+# Process-wide scheduler shared by all Streamlit sessions
+job_scheduler = JobScheduler(JOB_WORKERS, JOB_MAX_PER_USER, JOB_QUEUE_MAX, JOB_RESULT_TTL)
+
 
 def submit_analysis_task(chatbot, user_query, input_data_list):
     """Submit an analysis task for background processing"""
-    task_manager = st.session_state.async_task_manager
-    task_id = f"analysis_{int(time.time() * 1000)}"
-    
-    def analysis_task():
-        return chatbot.user_sent_message(user_query, input_data=input_data_list)
-    
-    return task_manager.submit_task(task_id, analysis_task)
+    return job_scheduler.submit(chatbot.user_sent_message, user_query, input_data=input_data_list,
+                                user_id=chatbot.session_id, on_cancel=chatbot.cancel)
 
 def check_analysis_progress(task_id):
     """Check the progress of an analysis task"""
-    task_manager = st.session_state.async_task_manager
-    return task_manager.get_task_status(task_id)
+    return job_scheduler.status(task_id)
 
 def get_analysis_result(task_id):
     """Get the result of a completed analysis task"""
-    task_manager = st.session_state.async_task_manager
-    return task_manager.get_task_result(task_id)
+    return job_scheduler.result(task_id)
+
+def cancel_analysis_task(task_id):
+    """Cancel a queued or running analysis task"""
+    return job_scheduler.cancel(task_id)
@@ -0,0 +1,328 @@
+import ast
+import re
+import types
+from typing import Dict, List, Optional, Set
+
+DATASET_NAME_PATTERN = re.compile(r"\bdataset_\d+\b")
+
+# Calls that can reach any variable by name, so every dataset has to be bound
+DYNAMIC_NAMESPACE_CALLS = {"locals", "globals", "vars", "dir", "eval", "exec"}
+
+
+def referenced_datasets(python_code: str, dataset_names: List[str]) -> List[str]:
+    """Return the dataset variables the code may read, in their original order
+
+    Falls back to all datasets when the code looks variables up dynamically
+    (e.g. the `locals()` discovery pattern) or builds dataset names at runtime.
+    """
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        # exec will report the syntax error, no need to load anything
+        return []
+
+    referenced = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            referenced.add(node.id)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            if node.func.id in DYNAMIC_NAMESPACE_CALLS:
+                return list(dataset_names)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and "dataset_" in node.value:
+            # Names inside strings (e.g. SQL over dataset_0); partial names mean a runtime lookup
+            matches = DATASET_NAME_PATTERN.findall(node.value)
+            if not matches or node.value.count("dataset_") > len(matches):
+                return list(dataset_names)
+            referenced.update(matches)
+
+    return [name for name in dataset_names if name in referenced]
+
+
+def code_object_names(code: types.CodeType) -> Optional[Set[str]]:
+    """Names a compiled function (and the functions nested in it) may look up, or None if it builds them at runtime
+
+    The names used as globals and attributes are included, as are dataset names
+    inside string constants; callers keep the ones that exist in the namespace.
+    """
+    names = set(code.co_names)
+    if names & DYNAMIC_NAMESPACE_CALLS:
+        return None
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            nested = code_object_names(const)
+            if nested is None:
+                return None
+            names |= nested
+        elif isinstance(const, str) and "dataset_" in const:
+            matches = DATASET_NAME_PATTERN.findall(const)
+            if not matches or const.count("dataset_") > len(matches):
+                return None
+            names.update(matches)
+    return names
+
+
+def assigned_names(python_code: str) -> Optional[Set[str]]:
+    """Return the names the code may bind at top level, or None if that can't be known statically
+
+    Over-approximates (names bound inside functions are included too), which is
+    fine for finding changed variables: callers check the names against the namespace.
+    """
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        # Nothing runs, so nothing is assigned
+        return set()
+
+    assigned = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            assigned.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            assigned.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    return None
+                assigned.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            assigned.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            assigned.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            assigned.add(node.rest)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            # globals()[...] = ..., exec(...) and friends can bind anything
+            if node.func.id in DYNAMIC_NAMESPACE_CALLS - {"dir"}:
+                return None
+    return assigned
+
+
+
+def _root_name(node) -> Optional[str]:
+    """Variable at the start of an attribute, subscript or method chain (None if it starts with a new object)"""
+    while isinstance(node, (ast.Attribute, ast.Subscript)) or (
+            isinstance(node, ast.Call) and not isinstance(node.func, ast.Name)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def written_names(python_code: str, modules: Set[str] = frozenset()) -> Optional[Set[str]]:
+    """Names the code may bind or mutate in place, or None if that can't be known statically
+
+    Any method call may change the object it's called on (model.fit, fig.update_layout,
+    df.drop(inplace=True)), so its variable counts as written. Calls on modules
+    (`modules`, e.g. pd.concat, and the code's own imports) don't.
+    """
+    names = assigned_names(python_code)
+    if names is None:
+        return None
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return names
+    not_objects = set(modules) | set(imported_names(python_code))
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Attribute, ast.Subscript)) and not isinstance(node.ctx, ast.Load):
+            root = _root_name(node)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            root = _root_name(node.func.value)
+            if root in not_objects:
+                continue
+        else:
+            continue
+        if root is not None:
+            names.add(root)
+    return names
+
+
+def read_names(python_code: str) -> Set[str]:
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return set()
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+
+
+def defines_callables(python_code: str) -> bool:
+    """Whether the code defines top-level functions or classes (bound to the namespace copy of a parallel call)"""
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return False
+    return any(isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) for node in tree.body)
+
+
+def imported_names(python_code: str) -> Dict[str, str]:
+    """Map of names bound by imports to what they import (e.g. {'np': 'numpy'})"""
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return {}
+    imported = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.asname or alias.name.split(".")[0]
+                imported[name] = alias.name if alias.asname else name
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                imported[alias.asname or alias.name] = f"{'.' * node.level}{node.module or ''}.{alias.name}"
+    return imported
+
+
+def are_independent(codes: List[str], ignored: Set[str] = frozenset(), modules: Set[str] = frozenset()) -> bool:
+    """Whether the snippets can run in any order: none reads or writes a name another one writes
+
+    Names in `ignored` (e.g. per-call bindings like datasets) don't count as conflicts,
+    and neither does importing the same module under the same name in several snippets.
+    Method calls count as writes to their object, except on `modules` (see written_names).
+    """
+    writes, reads, imports = [], [], []
+    for code in codes:
+        written = written_names(code, modules)
+        if written is None:
+            return False
+        writes.append(written - ignored)
+        reads.append(read_names(code))
+        imports.append(imported_names(code))
+    for i, written in enumerate(writes):
+        for j in range(len(codes)):
+            if i == j:
+                continue
+            conflicts = {name for name in written & (reads[j] | writes[j])
+                         if name not in imports[i] or imports[i][name] != imports[j].get(name)}
+            if conflicts:
+                return False
+    return True
+
+# Names whose use makes results vary between runs (e.g. unseeded estimators)
+NONDETERMINISTIC_NAMES = {"sklearn"}
+
+# Calls with side effects or run-to-run varying output (getattr can reach any of them by name)
+IMPURE_CALLS = {"open", "input", "breakpoint", "getattr", "setattr", "delattr", "__import__", "compile",
+                "exit", "quit", "help", "id", "hash"}
+
+# Methods that read or write files, change global settings or are random
+IMPURE_METHODS = {
+    "to_csv", "to_excel", "to_parquet", "to_pickle", "to_json", "to_feather", "to_hdf", "to_sql", "to_html",
+    "to_stata", "to_orc", "to_xml", "to_clipboard", "savefig", "show", "set_option", "reset_option",
+    "open", "urlopen", "sample", "shuffle", "random", "rand", "randn", "randint", "choice",
+    "now", "today", "utcnow"
+}
+# Method families doing file or network I/O (pd.read_csv, pio.write_image, sklearn's fetch_openml)
+IMPURE_METHOD_PREFIXES = ("read_", "write_", "fetch_")
+
+# String arguments that make a constructor return the current time (pd.Timestamp("now"), pd.to_datetime("today"))
+CURRENT_TIME_STRINGS = {"now", "today"}
+
+
+def normalize_code(python_code: str) -> str:
+    """Canonical form of the code that ignores comments and formatting"""
+    return ast.dump(ast.parse(python_code))
+
+
+class _PurityChecker(ast.NodeVisitor):
+    """Decides whether code only reads allowed names and binds nothing at top level"""
+
+    def __init__(self):
+        self.depth = 0
+        self.pure = True
+        self.loaded_top = set()
+        self.loaded_nested = set()
+        self.local_names = set()
+
+    def _nested(self, node, arguments=None):
+        if arguments is not None:
+            self.local_names.update(a.arg for a in arguments.posonlyargs + arguments.args + arguments.kwonlyargs)
+            self.local_names.update(a.arg for a in (arguments.vararg, arguments.kwarg) if a is not None)
+        self.depth += 1
+        self.generic_visit(node)
+        self.depth -= 1
+
+    def visit_FunctionDef(self, node):
+        # A top-level def binds a session variable; nested ones are local
+        if self.depth == 0:
+            self.pure = False
+        self.local_names.add(node.name)
+        self._nested(node, node.args)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._nested(node, node.args)
+
+    def visit_ListComp(self, node):
+        self._nested(node)
+
+    visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_Name(self, node):
+        if node.id.startswith("__"):
+            # Dunder names (__builtins__, __loader__) reach the interpreter's internals
+            self.pure = False
+        if isinstance(node.ctx, ast.Load):
+            (self.loaded_nested if self.depth else self.loaded_top).add(node.id)
+        elif self.depth == 0:
+            self.pure = False
+        else:
+            self.local_names.add(node.id)
+
+    def _impure(self, node):
+        self.pure = False
+
+    visit_ClassDef = visit_Import = visit_ImportFrom = visit_Global = visit_Nonlocal = visit_NamedExpr = _impure
+    visit_MatchAs = visit_MatchStar = visit_MatchMapping = _impure
+
+    def visit_ExceptHandler(self, node):
+        if node.name and self.depth == 0:
+            self.pure = False
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        # Stores into objects (pd.options..., dataset_0.x = ...) mutate shared state
+        if not isinstance(node.ctx, ast.Load) and not self._rooted_in_local(node):
+            self.pure = False
+        if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
+            self.pure = False
+        self.generic_visit(node)
+
+    visit_Subscript = visit_Attribute
+
+    def _rooted_in_local(self, node) -> bool:
+        while isinstance(node, (ast.Attribute, ast.Subscript)):
+            node = node.value
+        return isinstance(node, ast.Name) and self.depth > 0 and node.id in self.local_names
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id in IMPURE_CALLS | DYNAMIC_NAMESPACE_CALLS:
+            self.pure = False
+        elif isinstance(node.func, ast.Attribute) and (
+                node.func.attr in IMPURE_METHODS or node.func.attr.startswith(IMPURE_METHOD_PREFIXES)):
+            self.pure = False
+        if any(isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+               and arg.value.strip().lower() in CURRENT_TIME_STRINGS
+               for arg in node.args + [keyword.value for keyword in node.keywords]):
+            self.pure = False
+        if any(k.arg == "inplace" for k in node.keywords):
+            self.pure = False
+        self.generic_visit(node)
+
+
+def is_memoizable(python_code: str, readable_names: Set[str]) -> bool:
+    """Whether the code's output depends only on its text and the datasets it reads
+
+    True when the code binds no top-level names (so skipping it leaves the
+    session unchanged), reads nothing but `readable_names` (datasets, the
+    preloaded libraries and builtins) and makes no writing or random calls.
+    """
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return False
+    checker = _PurityChecker()
+    checker.visit(tree)
+    if not checker.pure:
+        return False
+    # Top-level code can't see names local to functions and comprehensions
+    free_names = checker.loaded_top | (checker.loaded_nested - checker.local_names)
+    return free_names <= set(readable_names) - NONDETERMINISTIC_NAMES
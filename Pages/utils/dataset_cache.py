@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import pandas as pd
+
+from Pages.utils.ingest import load_dataset
+
+# Memory budget for cached dataframes in each worker process (in MB)
+DATASET_CACHE_MAX_MB = int(os.getenv("DATASET_CACHE_MAX_MB", "4096"))
+# Hash file contents as part of the cache key (slower, but survives mtime-preserving rewrites)
+DATASET_CACHE_CONTENT_HASH = os.getenv("DATASET_CACHE_CONTENT_HASH", "false").lower() == "true"
+# Largest share of a worker's memory limit the cache may take; the rest is left to the code it runs
+DATASET_CACHE_MEMORY_SHARE = 0.5
+
+
+def file_fingerprint(path: str, content_hash: bool = False) -> tuple:
+    """Build a cache key for a file from its path, mtime and size (and optionally content hash)"""
+    stat = os.stat(path)
+    fingerprint = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if content_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        fingerprint += (digest.hexdigest(),)
+    return fingerprint
+
+
+def dataset_metadata(df: pd.DataFrame) -> dict:
+    """Metadata exposed to the agent for a loaded dataset"""
+    return {
+        'size': len(df),
+        'types': df.dtypes.to_dict(),
+        'sample': df.head(1).to_dict(orient='records')[0] if len(df) > 0 else {}
+    }
+
+
+class DatasetCache:
+    """LRU cache of parsed datasets keyed by file fingerprint, bounded by a memory budget"""
+
+    def __init__(self, max_bytes: int, content_hash: bool = False):
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, loader: Callable[[str], pd.DataFrame] = load_dataset) -> dict:
+        """Return {'data', 'size', 'types', 'sample'} for a file, parsing it only if it changed"""
+        key = file_fingerprint(path, self.content_hash)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self._view(entry)
+            self.misses += 1
+
+        # Parse outside the lock so other files can be served meanwhile
+        df = loader(path)
+        entry = {'data': df, 'nbytes': int(df.memory_usage(deep=True).sum()), **dataset_metadata(df)}
+
+        with self._lock:
+            self._drop_stale(key)
+            self.entries[key] = entry
+            self.current_bytes += entry['nbytes']
+            self._evict()
+        return self._view(entry)
+
+    def limit_to(self, max_bytes: int):
+        """Lower the memory budget (e.g. to fit under the worker's memory limit), evicting as needed"""
+        with self._lock:
+            self.max_bytes = min(self.max_bytes, max_bytes)
+            self._evict()
+
+    def invalidate(self, path: Optional[str] = None):
+        """Drop cached entries for a path, or everything if no path is given"""
+        with self._lock:
+            if path is None:
+                self.entries.clear()
+                self.current_bytes = 0
+                return
+            self._drop_stale((os.path.abspath(path),))
+
+    def stats(self) -> dict:
+        """Get hit/miss counters and memory usage"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self.entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _view(self, entry: dict) -> dict:
+        # Shallow copy: with copy-on-write, any change generated code makes copies the data it touches
+        view = {k: v for k, v in entry.items() if k != 'nbytes'}
+        view['data'] = entry['data'].copy(deep=False)
+        return view
+
+    def _drop_stale(self, key: tuple):
+        # Remove older versions of the same file
+        for stale_key in [k for k in self.entries if k[0] == key[0]]:
+            self.current_bytes -= self.entries.pop(stale_key)['nbytes']
+
+    def _evict(self):
+        # Always keep the most recent entry, even if it alone exceeds the budget
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.current_bytes -= entry['nbytes']
+            self.evictions += 1
+
+
+# One cache per process: every session worker has its own, so together they can hold up to
+# DATASET_CACHE_MAX_MB x KERNEL_POOL_MAX_WORKERS (each worker caps its share with limit_to)
+dataset_cache = DatasetCache(DATASET_CACHE_MAX_MB * 1024 * 1024, DATASET_CACHE_CONTENT_HASH)
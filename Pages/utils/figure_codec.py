@@ -0,0 +1,214 @@
+"""Compact storage format for Plotly figures, and downsampling of very large traces
+
+A stored figure is a compressed .npz archive: the figure's JSON with every
+large numeric array replaced by a reference, and the arrays themselves as
+typed binary buffers next to it. Loading it skips JSON-parsing millions of
+numbers, and the file is a fraction of the size of `pio.to_json` output.
+"""
+import base64
+import datetime
+import io
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+# Scatter traces with more points than this are reduced before saving (0 disables)
+FIGURE_MAX_POINTS = int(os.getenv("FIGURE_MAX_POINTS", "100000"))
+# Arrays shorter than this stay inline in the JSON
+SIDECAR_MIN_LENGTH = 64
+
+_ARRAY_REF = "__array__"
+_BINARY_KINDS = "biufM"
+_DOWNSAMPLED_TYPES = ("scatter", "scattergl")
+
+
+def _typed_array(value: dict) -> np.ndarray:
+    """Decode a Plotly typed array ({'dtype': 'f8', 'bdata': <base64>, 'shape': '2, 3'})"""
+    array = np.frombuffer(base64.b64decode(value['bdata']), dtype=np.dtype(value['dtype']))
+    if value.get('shape'):
+        array = array.reshape([int(dim) for dim in str(value['shape']).split(",")])
+    return array
+
+
+def _is_typed_array(value) -> bool:
+    return isinstance(value, dict) and 'bdata' in value and 'dtype' in value
+
+
+def _as_array(value) -> Optional[np.ndarray]:
+    """Numeric or datetime array for a trace attribute, or None if it isn't one"""
+    if _is_typed_array(value):
+        return _typed_array(value)
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)):
+        array = np.asarray(value)
+        if array.dtype.kind == "O" and len(array) and isinstance(array[0], (datetime.date, pd.Timestamp)):
+            try:
+                array = array.astype("datetime64[ns]")
+            except (TypeError, ValueError):
+                return None
+        return array if array.ndim == 1 and array.dtype.kind in _BINARY_KINDS else None
+    return None
+
+
+def _decode_arrays(value):
+    # Plotly 6+ hands out arrays base64-encoded; decode each once up front
+    if _is_typed_array(value):
+        return _typed_array(value)
+    if isinstance(value, dict):
+        return {k: _decode_arrays(v) for k, v in value.items()}
+    return value
+
+
+def _point_count(trace: dict) -> int:
+    for key in ("y", "x"):
+        value = trace.get(key)
+        if value is not None and not isinstance(value, (str, int, float)):
+            return len(_typed_array(value)) if _is_typed_array(value) else len(value)
+    return 0
+
+
+def _take(value, indices: np.ndarray, n: int):
+    """Subset a per-point attribute; anything that isn't one (scalars, colorscales) is left as is"""
+    if _is_typed_array(value):
+        array = _typed_array(value)
+        return array[indices] if array.ndim == 1 and len(array) == n else value
+    if isinstance(value, dict):
+        return {k: _take(v, indices, n) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)) and len(value) == n:
+        return np.asarray(value, dtype=object if isinstance(value, (list, tuple)) else None)[indices]
+    return value
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """Indices keeping the first and last point and the minimum and maximum of each bucket
+
+    Equal-count buckets over x-sorted data, so peaks and dips survive the
+    reduction (a vectorized relative of LTTB).
+    """
+    n = len(y)
+    bucket = (np.arange(n) * buckets) // n
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets))
+    ends = np.append(starts[1:], n)
+    keep = np.concatenate([order[starts], order[ends - 1], [0, n - 1]])
+    return np.unique(keep)
+
+
+def grid_indices(x: np.ndarray, y: np.ndarray, cells: int) -> np.ndarray:
+    """Indices keeping one point per occupied cell of a cells x cells grid over the data's extent"""
+    def cell(values):
+        values = values.astype("int64") if values.dtype.kind == "M" else values.astype("float64")
+        low, high = np.nanmin(values), np.nanmax(values)
+        span = (high - low) or 1
+        return np.clip(((values - low) / span * cells).astype("int64"), 0, cells - 1)
+
+    valid = ~(pd.isna(x) | pd.isna(y))
+    positions = np.flatnonzero(valid)
+    # First point of each cell, without sorting millions of cell ids
+    first = np.full(cells * cells, len(x))
+    np.minimum.at(first, cell(x[valid]) * cells + cell(y[valid]), positions)
+    return np.sort(first[first < len(x)])
+
+
+def _is_sorted(x: np.ndarray) -> bool:
+    values = x.astype("int64") if x.dtype.kind == "M" else x
+    return bool(np.all(values[1:] >= values[:-1]))
+
+
+def _sample_indices(n: int, size: int) -> np.ndarray:
+    # Fixed seed: saving the same figure twice gives the same file
+    return np.sort(np.random.default_rng(0).choice(n, size, replace=False))
+
+
+def downsample_trace(trace: dict, max_points: int) -> Tuple[dict, Optional[str]]:
+    """Reduce a scatter trace to at most max_points, returning it and the method used (None if unchanged)"""
+    n = _point_count(trace)
+    if trace.get("type", "scatter") not in _DOWNSAMPLED_TYPES or n <= max_points:
+        return trace, None
+
+    trace = _decode_arrays(trace)
+    if trace.get("x") is None:
+        # Implicit x positions must survive the reduction
+        trace["x"] = trace.get("x0", 0) + trace.get("dx", 1) * np.arange(n)
+        trace.pop("x0", None)
+        trace.pop("dx", None)
+    x, y = _as_array(trace.get("x")), _as_array(trace.get("y"))
+    mode = trace.get("mode", "lines")
+
+    paired = x is not None and y is not None and len(x) == len(y) == n
+    if "lines" in mode and paired and y.dtype.kind in "biuf" and _is_sorted(x):
+        indices, method = minmax_indices(y, (max_points - 2) // 2), "min/max per bucket"
+    elif "lines" not in mode and paired:
+        # A grid of at most max_points cells, so one point per cell always fits
+        indices, method = grid_indices(x, y, int(np.sqrt(max_points))), "one point per plot cell"
+    else:
+        indices, method = np.arange(n), "random sample"
+    if len(indices) > max_points:
+        indices = indices[_sample_indices(len(indices), max_points)]
+        method = "random sample" if method == "random sample" else f"{method}, then a random sample"
+
+    reduced = {k: (v if k in ("type", "name", "mode") else _take(v, indices, n)) for k, v in trace.items()}
+    return reduced, f"{n:,} points reduced to {len(indices):,} ({method})"
+
+
+def downsample_figure(figure, max_points: int = FIGURE_MAX_POINTS) -> Tuple[go.Figure, List[str]]:
+    """Return the figure with oversized scatter traces reduced, and a note per reduced trace"""
+    if max_points <= 0:
+        return figure, []
+    spec = figure.to_plotly_json() if hasattr(figure, "to_plotly_json") else dict(figure)
+    notes = []
+    data = []
+    for i, trace in enumerate(spec.get("data", [])):
+        trace, method = downsample_trace(trace, max_points)
+        if method is not None:
+            notes.append(f"trace {trace.get('name') or i}: {method}")
+        data.append(trace)
+    if not notes:
+        return figure, []
+    return go.Figure({**spec, "data": data}), notes
+
+
+def encode_figure(figure) -> bytes:
+    """Serialize a figure to a compressed archive of its JSON plus binary arrays"""
+    spec = figure.to_plotly_json() if hasattr(figure, "to_plotly_json") else figure
+    arrays = {}
+
+    def extract(value):
+        if _is_typed_array(value):
+            value = _typed_array(value)
+        if isinstance(value, (pd.Series, pd.Index)):
+            value = value.to_numpy()
+        if isinstance(value, np.ndarray) and value.dtype.kind in _BINARY_KINDS and value.size >= SIDECAR_MIN_LENGTH:
+            name = f"a{len(arrays)}"
+            arrays[name] = np.ascontiguousarray(value)
+            return {_ARRAY_REF: name}
+        if isinstance(value, dict):
+            return {k: extract(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [extract(v) for v in value]
+        return value
+
+    skeleton = json.dumps(extract(spec), cls=PlotlyJSONEncoder).encode("utf-8")
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, figure=np.frombuffer(skeleton, dtype=np.uint8), **arrays)
+    return buffer.getvalue()
+
+
+def decode_figure(data) -> go.Figure:
+    """Rebuild a figure from encode_figure output (bytes or a binary file object)"""
+    with np.load(io.BytesIO(data) if isinstance(data, bytes) else data, allow_pickle=False) as archive:
+        def restore(value):
+            if isinstance(value, dict):
+                if set(value) == {_ARRAY_REF}:
+                    return archive[value[_ARRAY_REF]]
+                return {k: restore(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [restore(v) for v in value]
+            return value
+
+        spec = restore(json.loads(archive["figure"].tobytes().decode("utf-8")))
+    return go.Figure(spec)
@@ -0,0 +1,214 @@
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import pandas as pd
+import plotly.io as pio
+
+from Pages.utils.figure_codec import encode_figure, decode_figure
+
+logger = logging.getLogger(__name__)
+
+FIGURE_STORE_DIR = os.getenv("FIGURE_STORE_DIR", os.path.join("images", "plotly_figures", "pickle"))
+# Figures older than this are deleted (days, 0 keeps them forever)
+FIGURE_RETENTION_DAYS = float(os.getenv("FIGURE_RETENTION_DAYS", "30"))
+# Disk budget for figures; the oldest are deleted beyond it (MB, 0 disables)
+FIGURE_STORE_MAX_MB = int(os.getenv("FIGURE_STORE_MAX_MB", "2048"))
+# Garbage collection runs at most this often (seconds)
+FIGURE_GC_INTERVAL = 3600
+
+
+def convert_periods(obj):
+    if isinstance(obj, pd.Period):
+        return str(obj)
+    elif isinstance(obj, dict):
+        return {k: convert_periods(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [convert_periods(x) for x in obj]
+    return obj
+
+
+class FigureStore:
+    """Saved Plotly figures: one file per figure plus an SQLite index of who made it and when
+
+    Figure ids are the file names: `<uuid>.npz` in the compact binary format
+    (see figure_codec), `.pickle` for figures it can't represent, and `.json`
+    for figures saved before that format existed. Files are written atomically, so readers never see a
+    partial figure, and old figures are garbage collected by age and total size.
+    """
+
+    def __init__(self, directory: str, retention_days: float, max_bytes: int):
+        self.directory = directory
+        self.index_path = os.path.join(os.path.dirname(os.path.abspath(directory)), "figure_index.sqlite")
+        self.retention = retention_days * 24 * 3600
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._pid = None
+        self._last_gc = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Forked workers must not reuse their parent's connection
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS figures (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS figures_session ON figures (session_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS figures_created ON figures (created_at)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def path(self, figure_id: str) -> str:
+        return os.path.join(self.directory, figure_id)
+
+    def exists(self, figure_id: str) -> bool:
+        return os.path.exists(self.path(figure_id))
+
+    def _write(self, figure_id: str, data, mode: str) -> int:
+        path = self.path(figure_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def save(self, figure, session_id: str) -> str:
+        """Store a figure and return its id"""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            figure_id = f"{uuid.uuid4()}.npz"
+            size = self._write(figure_id, encode_figure(figure), "wb")
+        except Exception:
+            # Fall back to pickle if the figure can't be encoded
+            figure_id = f"{uuid.uuid4()}.pickle"
+            size = self._write(figure_id, pickle.dumps(convert_periods(figure)), "wb")
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT INTO figures VALUES (?, ?, ?, ?)", (figure_id, session_id, size, time.time()))
+            conn.commit()
+        return figure_id
+
+    def save_all(self, figures: list, session_id: str) -> List[str]:
+        figure_ids = [self.save(figure, session_id) for figure in figures]
+        self.maybe_gc()
+        return figure_ids
+
+    def copy_to_session(self, figure_ids: List[str], session_id: str) -> Optional[List[str]]:
+        """Give a session its own copies of figures made by another one (e.g. for a replayed cached answer)
+
+        The copies outlive the original session's figures, which are deleted with it
+        or by garbage collection. Returns the new ids, or None if a figure no longer exists.
+        """
+        copies = []
+        try:
+            for figure_id in figure_ids:
+                copy_id = f"{uuid.uuid4()}{os.path.splitext(figure_id)[1]}"
+                try:
+                    # Figures are never modified, so a hard link is as good as a copy
+                    os.link(self.path(figure_id), self.path(copy_id))
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    shutil.copyfile(self.path(figure_id), self.path(copy_id))
+                copies.append((copy_id, session_id, os.path.getsize(self.path(copy_id)), time.time()))
+        except FileNotFoundError:
+            self._delete([copy[0] for copy in copies])
+            return None
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT INTO figures VALUES (?, ?, ?, ?)", copies)
+            conn.commit()
+        return [copy[0] for copy in copies]
+
+    def load(self, figure_id: str):
+        if figure_id.endswith('.npz'):
+            with open(self.path(figure_id), "rb") as f:
+                return decode_figure(f.read())
+        if figure_id.endswith('.json'):
+            with open(self.path(figure_id), "r") as f:
+                return pio.from_json(f.read())
+        with open(self.path(figure_id), "rb") as f:
+            return pickle.load(f)
+
+    def session_figures(self, session_id: str) -> List[str]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM figures WHERE session_id = ? ORDER BY created_at", (session_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_session(self, session_id: str):
+        self._delete(self.session_figures(session_id))
+
+    def _delete(self, figure_ids: List[str]):
+        for figure_id in figure_ids:
+            try:
+                os.remove(self.path(figure_id))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM figures WHERE id = ?", [(figure_id,) for figure_id in figure_ids])
+            conn.commit()
+
+    def maybe_gc(self):
+        if time.time() - self._last_gc >= FIGURE_GC_INTERVAL:
+            try:
+                self.gc()
+            except Exception as e:
+                logger.warning(f"Figure garbage collection failed: {str(e)}")
+
+    def gc(self) -> int:
+        """Delete expired figures, then the oldest ones beyond the size budget; returns how many were removed"""
+        self._last_gc = time.time()
+        now = time.time()
+        expired = []
+        if self.retention > 0:
+            with self._lock:
+                expired = [row[0] for row in self._connect().execute(
+                    "SELECT id FROM figures WHERE created_at < ?", (now - self.retention,))]
+            # Files from before the index existed are only known by their modification time
+            indexed = set(self._all_ids())
+            for entry in os.scandir(self.directory):
+                if (entry.name.endswith(('.npz', '.json', '.pickle')) and entry.name not in indexed
+                        and now - entry.stat().st_mtime > self.retention):
+                    expired.append(entry.name)
+        self._delete(expired)
+
+        over_budget = []
+        if self.max_bytes > 0:
+            with self._lock:
+                rows = self._connect().execute("SELECT id, size FROM figures ORDER BY created_at DESC").fetchall()
+            total = 0
+            for figure_id, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    over_budget.append(figure_id)
+            self._delete(over_budget)
+        return len(expired) + len(over_budget)
+
+    def _all_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connect().execute("SELECT id FROM figures")]
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._connect().execute("SELECT count(*), coalesce(sum(size), 0) FROM figures").fetchone()
+        return {'figures': count, 'bytes': size}
+
+
+# Shared by the app and the execution workers (each process opens its own index connection)
+figure_store = FigureStore(FIGURE_STORE_DIR, FIGURE_RETENTION_DAYS, FIGURE_STORE_MAX_MB * 1024 * 1024)
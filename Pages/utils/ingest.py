@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import uuid
+from typing import Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as feather
+except ImportError:
+    # Columnar storage is optional; without pyarrow datasets are read from CSV
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+# Converted files live next to the uploads in a hidden folder so the CSV listing is unaffected
+COLUMNAR_DIR = ".columnar"
+SCHEMA_VERSION = 1
+# CSVs are converted in blocks of this size, so ingest memory doesn't grow with the file
+INGEST_BLOCK_BYTES = 8 * 1024 * 1024
+# Columns whose type guess (made from the first block) can be widened before giving up on Arrow
+INGEST_MAX_RETYPES = 16
+
+_CONVERSION_ERROR = re.compile(r"column #(\d+):.*?CSV conversion error to (\w+)")
+
+
+def columnar_paths(csv_path: str) -> Tuple[str, str]:
+    """Get the (arrow data, schema sidecar) paths for a source CSV"""
+    directory, filename = os.path.split(os.path.abspath(csv_path))
+    stem = os.path.splitext(filename)[0]
+    base = os.path.join(directory, COLUMNAR_DIR, stem)
+    return f"{base}.arrow", f"{base}.schema.json"
+
+
+def source_info(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {'path': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_schema(csv_path: str) -> Optional[dict]:
+    """Return the stored schema for a CSV, or None if it was never ingested or has changed since"""
+    _, schema_path = columnar_paths(csv_path)
+    try:
+        with open(schema_path, 'r') as f:
+            schema = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    source = schema.get('source', {})
+    current = source_info(csv_path)
+    if (schema.get('version') != SCHEMA_VERSION
+            or source.get('size') != current['size']
+            or source.get('mtime_ns') != current['mtime_ns']):
+        return None
+    return schema
+
+
+def write_atomic(path: str, write):
+    """Write a file through a temporary file of its own, then move it into place
+
+    Concurrent writers (the background ingest and a worker's on-demand one)
+    each get their own temporary file, so neither can tear or remove the other's.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _first_row(df: pd.DataFrame) -> dict:
+    return df.head(1).to_dict(orient='records')[0] if len(df) > 0 else {}
+
+
+def _stream_to_arrow(csv_path: str, path: str, column_types: dict) -> dict:
+    """Convert a CSV to an Arrow IPC file one block at a time, returning its row count, dtypes and first row"""
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=INGEST_BLOCK_BYTES),
+        # Empty fields are missing values, as in pd.read_csv
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True))
+    rows = 0
+    sample = {}
+    with_nulls = set()
+    # Uncompressed Arrow IPC so later reads can memory-map the file
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, reader.schema) as writer:
+        for batch in reader:
+            if not rows and batch.num_rows:
+                sample = _first_row(batch.slice(0, 1).to_pandas())
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            with_nulls.update(name for name, column in zip(batch.schema.names, batch.columns) if column.null_count)
+    # Pandas dtypes, as the data will have once loaded (integer and boolean columns with gaps can't keep their type)
+    dtypes = reader.schema.empty_table().to_pandas().dtypes
+    columns = []
+    for col, dtype in dtypes.items():
+        if col in with_nulls and dtype.kind in "iub":
+            dtype = "float64" if dtype.kind in "iu" else "object"
+        columns.append({'name': str(col), 'dtype': str(dtype)})
+    return {'rows': rows, 'columns': columns, 'sample': sample}
+
+
+def _widened_type(error: Exception, names: list) -> Optional[tuple]:
+    """Column and wider type for a value that didn't match the type guessed from the first block"""
+    match = _CONVERSION_ERROR.search(str(error))
+    if match is None:
+        return None
+    index, guessed = int(match.group(1)), match.group(2)
+    # Integers become floats (as pandas would read them) before falling back to text
+    return names[index], pa.float64() if guessed.startswith(("int", "uint")) else pa.string()
+
+
+def _convert_to_arrow(csv_path: str, data_path: str) -> dict:
+    schema = pa_csv.open_csv(csv_path, read_options=pa_csv.ReadOptions(block_size=INGEST_BLOCK_BYTES)).schema
+    # Dates and timestamps stay text, as pd.read_csv (the fallback) reads them, so both paths give the same dtypes
+    column_types = {field.name: pa.string() for field in schema if pa.types.is_temporal(field.type)}
+    retypes = 0
+    while True:
+        try:
+            info = {}
+            write_atomic(data_path, lambda p: info.update(_stream_to_arrow(csv_path, p, column_types)))
+            return info
+        except pa.ArrowInvalid as e:
+            widened = _widened_type(e, schema.names)
+            if widened is None or retypes >= INGEST_MAX_RETYPES or column_types.get(widened[0]) == widened[1]:
+                raise
+            column_types[widened[0]] = widened[1]
+            retypes += 1
+
+
+def _scan_csv(csv_path: str) -> dict:
+    """Row count, dtypes and first row of a CSV, read in chunks"""
+    rows = 0
+    first = None
+    for chunk in pd.read_csv(csv_path, chunksize=100_000):
+        if first is None:
+            first = chunk
+        rows += len(chunk)
+    first = first if first is not None else pd.read_csv(csv_path, nrows=0)
+    return {'rows': rows, 'columns': [{'name': str(col), 'dtype': str(dtype)} for col, dtype in first.dtypes.items()],
+            'sample': _first_row(first)}
+
+
+def _ingest(csv_path: str) -> dict:
+    data_path, schema_path = columnar_paths(csv_path)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+    source = source_info(csv_path)
+    info = None
+    data_format = None
+    if feather is not None:
+        try:
+            info = _convert_to_arrow(csv_path, data_path)
+            data_format = "arrow"
+        except Exception as e:
+            # e.g. columns whose values don't fit one type; keep reading the CSV
+            logger.warning(f"Could not convert {csv_path} to Arrow: {str(e)}")
+    if info is None:
+        info = _scan_csv(csv_path)
+
+    schema = {'version': SCHEMA_VERSION, 'source': source, 'format': data_format, **info}
+    # Schema is written last: its presence marks the ingest as complete
+    write_atomic(schema_path, lambda p: dump_json(schema, p))
+    return schema
+
+
+def dump_json(obj: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2, default=str)
+
+
+def ingest_csv(csv_path: str, force: bool = False) -> dict:
+    """Convert a CSV into a typed columnar file once, returning its schema"""
+    if not force:
+        schema = read_schema(csv_path)
+        if schema is not None:
+            return schema
+    return _ingest(csv_path)
+
+
+def load_dataset(csv_path: str) -> pd.DataFrame:
+    """Load a dataset from its columnar copy, ingesting the CSV first if needed"""
+    schema = ingest_csv(csv_path)
+    data_path, _ = columnar_paths(csv_path)
+    if schema.get('format') == "arrow" and feather is not None and os.path.exists(data_path):
+        table = feather.read_table(data_path, memory_map=True)
+        # A converted (writable) frame: zero-copy columns would point into the read-only mapping,
+        # and generated code edits datasets in place (df.loc[...] = ..., fillna(inplace=True))
+        return table.to_pandas()
+    return pd.read_csv(csv_path)
+
+
+def schema_metadata(schema: dict) -> dict:
+    """Dataset metadata ('size', 'types', 'sample') taken from a stored schema, without loading the data"""
+    return {
+        'size': schema.get('rows', 0),
+        'types': {col['name']: col['dtype'] for col in schema.get('columns', [])},
+        'sample': schema.get('sample', {})
+    }
@@ -0,0 +1,533 @@
+"""Execution kernel that runs inside a per-session worker process
+
+The parent process talks to it over a multiprocessing pipe: it sends
+("execute" | "execute_batch" | "sql" | "variables" | "snapshot" | "restore" | "shutdown", args)
+requests and receives ("event", event) messages while code runs, followed by one ("result", dict).
+The session's variables live in this process, and in its snapshot on disk once one is taken.
+"""
+import builtins
+import ctypes
+import signal
+import threading
+import types
+import os
+import plotly.graph_objects as go
+import plotly.io as pio
+import plotly.express as px
+import pandas as pd
+import sklearn
+import traceback
+from Pages.utils.dataset_cache import dataset_cache, DATASET_CACHE_MEMORY_SHARE
+from Pages.utils.ingest import ingest_csv, schema_metadata
+from Pages.utils.code_analysis import referenced_datasets, assigned_names, is_memoizable, written_names, are_independent, defines_callables, read_names, code_object_names
+from Pages.utils.result_cache import result_cache, result_key
+from Pages.utils.profiler import read_profile, join_key_candidates
+from Pages.utils.figure_store import figure_store
+from Pages.utils.figure_codec import downsample_figure, FIGURE_MAX_POINTS
+from Pages.utils.session_store import write_snapshot, read_snapshot
+from Pages.graph.events import StdoutChunk, FigureReady
+from Pages.utils.stdout_capture import capture_stdout, install_stdout_router
+from Pages.utils.sql_engine import open_relation, relation_metadata, out_of_core_available, run_query
+
+# Most tool calls from one agent step run at the same time (each on its own thread; they overlap where
+# pandas, NumPy, Arrow and DuckDB release the GIL, while pure-Python code still takes turns)
+PARALLEL_TOOL_CALLS = int(os.getenv("PARALLEL_TOOL_CALLS", str(os.cpu_count() or 4)))
+
+
+class ExecutionInterrupted(BaseException):
+    """Raised inside running code when the parent interrupts it (timeout, memory limit or cancel)"""
+
+
+def bind_dataset(var_name: str, input_dataset, used: bool, current_variables: dict, notes: list) -> dict:
+    """Bind a dataset into the execution namespace (if the code uses it) and return its metadata"""
+    data_path = input_dataset.data_path
+    engine = input_dataset.engine
+
+    if not used:
+        # Describe unused datasets from their stored schema
+        if engine == "duckdb":
+            return {'name': var_name, 'engine': engine, **relation_metadata(open_relation(data_path), data_path)}
+        return {'name': var_name, 'engine': engine, **schema_metadata(ingest_csv(data_path))}
+
+    if engine == "pandas":
+        try:
+            # Parsed once per file version; later calls reuse the cached dataframe
+            cached = dataset_cache.get(data_path)
+            current_variables[var_name] = cached.pop('data')
+            return {'name': var_name, 'engine': engine, **cached}
+        except MemoryError:
+            if not out_of_core_available():
+                raise
+            engine = "duckdb"
+            notes.append(f"⚠️ {var_name} is too large for memory and was loaded as a DuckDB relation "
+                         f"instead of a pandas DataFrame. Use relational operations and call .df() on small results.")
+
+    # Out-of-core: a lazy relation that streams aggregations, filters and group-bys over the file
+    relation = open_relation(data_path)
+    current_variables[var_name] = relation
+    return {'name': var_name, 'engine': engine, **relation_metadata(relation, data_path)}
+
+
+def session_code(value) -> list:
+    """Code objects of a function defined in the session, or of the methods of a session-defined class or its instances"""
+    if isinstance(value, types.FunctionType):
+        return [value.__code__] if value.__module__ == "__main__" else []
+    cls = value if isinstance(value, type) else type(value)
+    codes = []
+    for klass in cls.__mro__:
+        if klass.__module__ != "__main__":
+            continue
+        for member in vars(klass).values():
+            # Static and class methods wrap the function; properties hold up to three
+            functions = [member.fget, member.fset, member.fdel] if isinstance(member, property) else [getattr(member, "__func__", member)]
+            codes.extend(f.__code__ for f in functions if isinstance(f, types.FunctionType))
+    return codes
+
+
+def base_namespace() -> dict:
+    """Names every session starts with: the libraries the prompt says are already imported"""
+    return {
+        '__builtins__': builtins,
+        '__name__': '__main__',
+        'go': go,
+        'pio': pio,
+        'px': px,
+        'pd': pd,
+        'sklearn': sklearn
+    }
+
+
+class SessionKernel:
+    """Holds one session's variables and executes code against them
+
+    The namespace dict is reused as the globals of every execution, so nothing
+    is copied per call; changed variables are found from the names the code assigns.
+    """
+
+    def __init__(self, send_event, session_id: str = "default"):
+        self.session_id = session_id
+        self.namespace = base_namespace()
+        self.base_names = set(self.namespace)
+        self.variable_types = {}
+        # Variables changed since the last snapshot (None = all of them)
+        self.unsaved = set()
+        self.send_event = send_event
+
+    def variables(self) -> dict:
+        """Names and types of the session's variables"""
+        return dict(self.variable_types)
+
+    def _mark_unsaved(self, names):
+        if names is None:
+            self.unsaved = None
+        elif self.unsaved is not None:
+            self.unsaved.update(names)
+
+    def _track_changes(self, names):
+        """Refresh variable types for the given names, or for everything if names is None"""
+        self._mark_unsaved(names)
+        if names is None:
+            self.variable_types = {k: type(v).__name__ for k, v in self.namespace.items()
+                                   if k not in self.base_names and not k.startswith('__')}
+            return
+        for name in names:
+            if name in self.namespace and name not in self.base_names and not name.startswith('__'):
+                self.variable_types[name] = type(self.namespace[name]).__name__
+            else:
+                self.variable_types.pop(name, None)
+
+    def execute(self, python_code: str, input_data: list, tool_call_id: str = "", namespace: dict = None,
+                save_figures: bool = True) -> dict:
+        """Run code against the session namespace, or against the given copy of it (parallel calls merge it back)
+
+        save_figures=False discards the figures the code creates (when only its variables are wanted).
+        """
+        own_namespace = namespace is None
+        namespace = self.namespace if own_namespace else namespace
+        current_variables = {}
+
+        # Name datasets automatically, but only load the ones the code actually uses
+        dataset_names = [f"dataset_{i}" for i in range(len(input_data))]
+        used_datasets = set(referenced_datasets(python_code, dataset_names))
+        # Functions defined by earlier calls look datasets up when they run, so what they read is bound too
+        called_names = self._session_code_names(python_code, namespace)
+        used_datasets |= set(dataset_names) if called_names is None else called_names & set(dataset_names)
+
+        memo_key = self._memo_key(python_code, dataset_names, used_datasets, input_data)
+        if memo_key is not None:
+            cached = self._replay(memo_key, python_code, tool_call_id)
+            if cached is not None:
+                return cached
+
+        datasets = []
+        engine_notes = []
+        for var_name, input_dataset in zip(dataset_names, input_data):
+            try:
+                datasets.append(bind_dataset(var_name, input_dataset, var_name in used_datasets, current_variables, engine_notes))
+            except Exception as e:
+                return {'status': 'load_error', 'stage': 'load', 'path': input_dataset.data_path,
+                        'error': str(e), 'error_type': type(e).__name__}
+
+        # Create generic relationships between datasets
+        if len(datasets) > 1:
+            try:
+                # Create combined views based on data patterns
+                numeric_cols = {}
+                date_cols = {}
+
+                for ds in datasets:
+                    for col, dtype in ds['types'].items():
+                        if 'float' in str(dtype) or 'int' in str(dtype):
+                            numeric_cols.setdefault('numeric', []).append(f"{ds['name']}.{col}")
+                        if 'datetime' in str(dtype) or 'date' in str(dtype):
+                            date_cols.setdefault('date', []).append(f"{ds['name']}.{col}")
+
+                # Join keys come from the precomputed profiles, when they are ready
+                profiles = {}
+                for ds, input_dataset in zip(datasets, input_data):
+                    profile = read_profile(input_dataset.data_path)
+                    if profile is not None:
+                        profiles[ds['name']] = profile
+
+                # Store relationship metadata
+                current_variables["_metadata"] = {
+                    'datasets': datasets,
+                    'relationships': {
+                        'numeric_columns': numeric_cols,
+                        'date_columns': date_cols,
+                        'join_keys': join_key_candidates(
+                            profiles,
+                            {ds['name']: d.variable_name for ds, d in zip(datasets, input_data)},
+                            {ds['name']: d.data_description for ds, d in zip(datasets, input_data)})
+                    }
+                }
+
+            except Exception as e:
+                return {'status': 'load_error', 'stage': 'relationships', 'path': None,
+                        'error': str(e), 'error_type': type(e).__name__}
+
+        # Add safety checks for common issues
+        if "dataset_" not in python_code and len(datasets) > 0:
+            # If no dataset is referenced, add a helpful comment
+            python_code = f"# Available datasets: {', '.join([ds['name'] for ds in datasets])}\n" + python_code
+
+        changed_names = assigned_names(python_code)
+        try:
+            # Output is captured for this execution only (and streamed as it's printed); sys.stdout is never swapped
+            with capture_stdout(self.send_event, tool_call_id) as captured:
+                # Execute the code directly in the session namespace
+                namespace.update(current_variables)
+                namespace["plotly_figures"] = []
+
+                exec(python_code, namespace)
+
+            # Get the captured stdout
+            output = "\n".join(engine_notes + [captured.getvalue()]) if engine_notes else captured.getvalue()
+        except Exception as e:
+            return {'status': 'error', 'python_code': python_code, 'error': str(e),
+                    'error_type': type(e).__name__, 'error_details': traceback.format_exc()}
+        finally:
+            # Datasets are rebound on every call, so don't keep them alive between calls
+            for var_name in dataset_names:
+                namespace.pop(var_name, None)
+            if own_namespace:
+                self._track_changes(None if changed_names is None else changed_names | set(current_variables) | {"plotly_figures"})
+                # In-place changes (df.loc[...] = ..., model.fit(...)) need a new snapshot too
+                self._mark_unsaved(written_names(python_code, self._module_names()))
+
+        result = {'status': 'ok', 'python_code': python_code, 'output': output, 'image_files': []}
+        figures_saved = True
+
+        plotly_figures = namespace.get("plotly_figures")
+        if plotly_figures and not save_figures:
+            namespace["plotly_figures"] = []
+        elif plotly_figures:
+            try:
+                # Huge scatter traces are reduced so the chat doesn't ship millions of points to the browser
+                reduced = []
+                for figure in plotly_figures:
+                    figure, notes = downsample_figure(figure)
+                    reduced.append(figure)
+                    if notes:
+                        result['output'] += (f"\nℹ️ A figure was downsampled for display (over {FIGURE_MAX_POINTS:,} points "
+                                             f"per trace): {'; '.join(notes)}. Aggregate the data first for exact plots.")
+                # The store returns the ids it wrote, so concurrent runs don't pick up each other's figures
+                saved_files = figure_store.save_all(reduced, self.session_id)
+                result['image_files'] = saved_files
+                for image_file in saved_files:
+                    self.send_event(FigureReady(figure_path=image_file, tool_call_id=tool_call_id))
+
+                namespace["plotly_figures"] = []
+            except Exception as plot_error:
+                # Don't fail the entire operation if plotting fails
+                figures_saved = False
+                result['output'] += f"\n⚠️ Warning: Could not save visualization: {str(plot_error)}"
+
+        result['variables'] = self.variables()
+        if memo_key is not None and not engine_notes and figures_saved:
+            result_cache.put(memo_key, {'output': result['output'], 'image_files': result['image_files']})
+        return result
+
+    def _session_code_names(self, python_code: str, namespace: dict):
+        """Names used by the session-defined functions and classes the code refers to (following the ones they call)
+
+        None if one of them looks names up at runtime (globals(), eval, dataset names built from strings).
+        """
+        names = set()
+        pending = list(read_names(python_code))
+        seen = set()
+        while pending:
+            name = pending.pop()
+            if name in seen or name in self.base_names or name not in namespace:
+                continue
+            seen.add(name)
+            for code in session_code(namespace[name]):
+                used = code_object_names(code)
+                if used is None:
+                    return None
+                names |= used
+                pending.extend(used)
+        return names
+
+    def _memo_key(self, python_code: str, dataset_names: list, used_datasets: set, input_data: list):
+        """Cache key for code whose output depends only on the datasets it reads, else None"""
+        if not result_cache.enabled:
+            return None
+        # Session variables may shadow library names or builtins, so they are never readable
+        readable = (self.base_names | set(dir(builtins)) | set(dataset_names) | {"plotly_figures"}) - set(self.variable_types)
+        if not is_memoizable(python_code, readable):
+            return None
+        try:
+            return result_key(python_code, [(name, d.data_path, d.engine)
+                                            for name, d in zip(dataset_names, input_data) if name in used_datasets])
+        except OSError:
+            # Missing dataset file; the normal path reports it
+            return None
+
+    def _replay(self, memo_key: str, python_code: str, tool_call_id: str):
+        """Return a memoized result as if the code had just run, or None if it's unusable"""
+        cached = result_cache.get(memo_key)
+        if cached is None:
+            return None
+        # The session that first ran the code may be deleted, taking its figures with it
+        image_files = figure_store.copy_to_session(cached['image_files'], self.session_id)
+        if image_files is None:
+            return None
+        if cached['output']:
+            self.send_event(StdoutChunk(text=cached['output'], tool_call_id=tool_call_id))
+        for image_file in image_files:
+            self.send_event(FigureReady(figure_path=image_file, tool_call_id=tool_call_id))
+        return {'status': 'ok', 'python_code': python_code, 'output': cached['output'],
+                'image_files': image_files, 'variables': self.variables(), 'cached': True}
+
+    def execute_batch(self, calls: list, input_data: list) -> dict:
+        """Execute several tool calls from one agent step, returning their results in call order
+
+        Calls that don't touch each other's variables run concurrently, each on
+        a thread with its own copy of the namespace (sharing the values); the
+        variables they set are merged back in call order. Anything else runs one
+        after another, including calls to functions and classes defined by
+        earlier calls: their globals are the session namespace, so they would
+        miss the copy's datasets and figure list.
+        """
+        dataset_names = [f"dataset_{i}" for i in range(len(input_data))]
+        codes = [call['python_code'] for call in calls]
+        parallel = (len(calls) > 1 and PARALLEL_TOOL_CALLS > 1
+                    and not any(defines_callables(code) or self._calls_session_code(code) for code in codes)
+                    and are_independent(codes, set(dataset_names) | {"plotly_figures"}, self._module_names()))
+        if not parallel:
+            results = [self.execute(call['python_code'], input_data, call['tool_call_id']) for call in calls]
+            return {'status': 'ok', 'results': results, 'variables': self.variables()}
+
+        self._warm_datasets(codes, dataset_names, input_data)
+        outcomes = self._run_threaded(calls, input_data)
+
+        results = []
+        for outcome in outcomes:
+            result = outcome['result']
+            if result['status'] == 'ok':
+                for name in outcome['deleted']:
+                    self.namespace.pop(name, None)
+                self.namespace.update(outcome['updates'])
+                self._track_changes(set(outcome['updates']) | set(outcome['deleted']))
+            results.append(result)
+        self.namespace["plotly_figures"] = []
+        variables = self.variables()
+        for result in results:
+            result['variables'] = variables
+        return {'status': 'ok', 'results': results, 'variables': variables}
+
+    def _module_names(self) -> set:
+        """Names bound to modules (pd, px and the session's imports): calling into them changes no variable"""
+        return {name for name, value in self.namespace.items() if isinstance(value, types.ModuleType)}
+
+    def _calls_session_code(self, python_code: str) -> bool:
+        """Whether the code refers to functions, classes or instances of classes defined by earlier calls"""
+        return any(name in self.namespace and name not in self.base_names and session_code(self.namespace[name])
+                   for name in read_names(python_code))
+
+    def _warm_datasets(self, codes: list, dataset_names: list, input_data: list):
+        # Load shared datasets once up front so concurrent calls don't each parse them
+        used = set()
+        for code in codes:
+            used.update(referenced_datasets(code, dataset_names))
+        for name, input_dataset in zip(dataset_names, input_data):
+            if name in used and input_dataset.engine == "pandas":
+                try:
+                    dataset_cache.get(input_dataset.data_path)
+                except Exception:
+                    # Reported by the call that uses it
+                    pass
+
+    def _run_call(self, call: dict, input_data: list) -> dict:
+        """Run one call against a shallow copy of the namespace and collect the variables it wrote"""
+        namespace = dict(self.namespace)
+        before = set(namespace)
+        result = self.execute(call['python_code'], input_data, call['tool_call_id'], namespace=namespace)
+        outcome = {'result': result, 'updates': {}, 'deleted': []}
+        if result['status'] == 'ok':
+            written = written_names(call['python_code'], self._module_names()) or set()
+            for name in written - self.base_names - {"plotly_figures"}:
+                if name in namespace:
+                    outcome['updates'][name] = namespace[name]
+                elif name in before:
+                    outcome['deleted'].append(name)
+        return outcome
+
+    def _run_threaded(self, calls: list, input_data: list) -> list:
+        """Run each call on its own thread, at most PARALLEL_TOOL_CALLS at a time
+
+        Threads rather than forked processes: the worker already runs Arrow and
+        DuckDB thread pools, which a forked child could deadlock on. The calls
+        share the GIL, so they only use several cores while in library code that
+        releases it (most pandas, NumPy, Arrow and DuckDB operations).
+        """
+        outcomes = [None] * len(calls)
+        pending = list(enumerate(calls))
+        running = {}
+
+        def run(index, call):
+            try:
+                outcomes[index] = self._run_call(call, input_data)
+            except BaseException as e:
+                outcomes[index] = {'result': {'status': 'error', 'error': str(e) or type(e).__name__,
+                                              'error_type': type(e).__name__}, 'updates': {}, 'deleted': []}
+
+        try:
+            while pending or running:
+                while pending and len(running) < PARALLEL_TOOL_CALLS:
+                    index, call = pending.pop(0)
+                    thread = threading.Thread(target=run, args=(index, call), daemon=True, name=f"tool-call-{index}")
+                    thread.start()
+                    running[index] = thread
+                for index, thread in list(running.items()):
+                    # Short joins, so the interrupt signal reaches this (main) thread promptly
+                    thread.join(0.05)
+                    if not thread.is_alive():
+                        del running[index]
+        except ExecutionInterrupted:
+            # Stop the other calls too; code stuck in a C extension is killed with the worker after the grace period
+            for thread in running.values():
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident), ctypes.py_object(ExecutionInterrupted))
+            for thread in running.values():
+                thread.join()
+            raise
+        return outcomes
+
+    def sql(self, query: str, input_data: list, result_name: str) -> dict:
+        try:
+            df, truncated = run_query(query, input_data)
+        except Exception as e:
+            return {'status': 'error', 'error': str(e), 'error_type': type(e).__name__,
+                    'error_details': traceback.format_exc()}
+
+        if df is None:
+            return {'status': 'ok', 'shape': None, 'variables': self.variables()}
+        self.namespace[result_name] = df
+        self._track_changes([result_name])
+        return {'status': 'ok', 'shape': df.shape, 'truncated': truncated,
+                'preview': df.head(20).to_string(), 'variables': self.variables()}
+
+    def _stored_variables(self) -> dict:
+        # Datasets are rebound from their files on every call, so only the session's own variables are kept
+        return {k: v for k, v in self.namespace.items()
+                if k not in self.base_names and not k.startswith('_') and k != "plotly_figures"}
+
+    def snapshot(self, directory: str) -> dict:
+        """Write variables changed since the last snapshot to disk, returning the ones that couldn't be stored"""
+        variables = self._stored_variables()
+        changed = set(variables) if self.unsaved is None else self.unsaved & set(variables)
+        lost = write_snapshot(variables, changed, directory)
+        self.unsaved = set()
+        return {'status': 'ok', 'saved': len(changed) - len(lost), 'lost': lost}
+
+    def restore(self, directory: str) -> dict:
+        """Load a snapshot taken by a previous worker for this session"""
+        values = read_snapshot(directory)
+        self.namespace.update(values)
+        self._track_changes(values)
+        # What was just read is already on disk
+        self.unsaved = set()
+        return {'status': 'ok', 'variables': self.variables()}
+
+
+def kernel_main(conn, session_id: str = "default", memory_limit_mb: int = 0):
+    """Worker process entry point: serve requests until told to shut down"""
+    install_stdout_router()
+    # Cached datasets are handed out as shallow copies. Copy-on-write (always on from pandas 3) makes
+    # in-place edits in generated code (df.loc[...] = ..., inplace=True) copy the data instead of writing
+    # through to the cached frame. It is set for the whole worker, so session code gets pandas 3 semantics
+    # (chained assignment never writes through) under pandas 2 as well.
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+    if memory_limit_mb > 0:
+        # The cache counts towards the worker's memory limit, so it must leave room for the code's own work
+        dataset_cache.limit_to(int(memory_limit_mb * DATASET_CACHE_MEMORY_SHARE) * 1024 * 1024)
+    # Events come from the executing code, parallel tool calls and output flush timers at once
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    kernel = SessionKernel(lambda event: send(("event", event)), session_id)
+    running = False
+
+    def interrupt(signum, frame):
+        # Only interrupt user requests; a stray signal while idle is ignored
+        if running:
+            raise ExecutionInterrupted()
+
+    signal.signal(signal.SIGINT, interrupt)
+
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            break
+        if op == "shutdown":
+            break
+        try:
+            running = True
+            if op == "execute":
+                result = kernel.execute(**args)
+            elif op == "execute_batch":
+                result = kernel.execute_batch(**args)
+            elif op == "sql":
+                result = kernel.sql(**args)
+            elif op == "variables":
+                result = kernel.variables()
+            elif op == "snapshot":
+                result = kernel.snapshot(**args)
+            elif op == "restore":
+                result = kernel.restore(**args)
+            else:
+                result = {'status': 'error', 'error': f"Unknown kernel operation: {op}", 'error_type': 'ValueError'}
+        except ExecutionInterrupted:
+            result = {'status': 'interrupted'}
+        except Exception as e:
+            result = {'status': 'error', 'error': str(e), 'error_type': type(e).__name__,
+                      'error_details': traceback.format_exc()}
+        finally:
+            running = False
+        send(("result", result))
@@ -0,0 +1,350 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Callable, Optional
+
+from Pages.utils.kernel import kernel_main
+from Pages.utils.session_store import SESSION_SNAPSHOTS, has_snapshot, snapshot_dir
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of live session workers (one per chat session)
+KERNEL_POOL_MAX_WORKERS = int(os.getenv("KERNEL_POOL_MAX_WORKERS", str(os.cpu_count() or 4)))
+# Workers idle for longer than this are shut down, their variables kept only in the session snapshot (seconds)
+KERNEL_IDLE_TIMEOUT = int(os.getenv("KERNEL_IDLE_TIMEOUT", "1800"))
+# "spawn" is safe to use from Streamlit's multi-threaded server
+KERNEL_START_METHOD = os.getenv("KERNEL_START_METHOD", "spawn")
+# Wall-clock limit for a single code execution or SQL query (seconds, 0 disables)
+EXECUTION_TIMEOUT = float(os.getenv("EXECUTION_TIMEOUT", "300"))
+# Resident memory ceiling for a worker process (MB, 0 disables)
+EXECUTION_MEMORY_LIMIT_MB = int(os.getenv("EXECUTION_MEMORY_LIMIT_MB", "8192"))
+# How long interrupted code gets to stop cleanly before the worker is killed (seconds)
+INTERRUPT_GRACE_PERIOD = float(os.getenv("INTERRUPT_GRACE_PERIOD", "5"))
+
+POLL_INTERVAL = 0.25
+
+
+class KernelCrashedError(RuntimeError):
+    """The worker process died while handling a request"""
+
+
+class KernelPoolFullError(RuntimeError):
+    """Every worker slot is taken by a session that is currently running code"""
+
+
+class KernelLimitError(RuntimeError):
+    """A request was stopped because of a timeout, the memory limit or a user cancel"""
+
+    def __init__(self, reason: str, worker_lost: bool):
+        self.reason = reason
+        self.worker_lost = worker_lost
+        super().__init__(f"Execution stopped ({reason})" + (", worker restarted" if worker_lost else ""))
+
+
+def process_rss(pid: int):
+    """Resident memory of a process in bytes, or None where /proc isn't available"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_tree_rss(pid: int):
+    """Resident memory of a process plus its direct children (e.g. subprocesses started by the code)"""
+    rss = process_rss(pid)
+    if rss is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        children = []
+    return rss + sum(process_rss(child) or 0 for child in children)
+
+
+class KernelHandle:
+    """Parent-side handle on one session's worker process"""
+
+    def __init__(self, session_id: str, context):
+        self.session_id = session_id
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=kernel_main, args=(child_conn, session_id, EXECUTION_MEMORY_LIMIT_MB), daemon=True,
+                                       name=f"kernel-{session_id}")
+        self.process.start()
+        child_conn.close()
+        self.last_used = time.time()
+        self.busy = False
+        # Requests that have taken this handle from the pool and not finished yet; leased workers are never evicted
+        self.leases = 0
+        self.stop_reason = None
+        self.stop_deadline = None
+        # A previous worker for this session left a snapshot; it's loaded before the first request
+        self.restore_pending = SESSION_SNAPSHOTS and has_snapshot(session_id)
+        self._lock = threading.Lock()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def request(self, op: str, on_event: Optional[Callable] = None, **args) -> dict:
+        """Send a request and wait for its result, passing streamed events to on_event
+
+        Raises KernelLimitError if the request exceeds the time or memory limit or is cancelled.
+        """
+        with self._lock:
+            self.busy = True
+            self.stop_reason = None
+            deadline = time.time() + EXECUTION_TIMEOUT if EXECUTION_TIMEOUT > 0 else None
+            try:
+                self.conn.send((op, args))
+                while True:
+                    if self.conn.poll(POLL_INTERVAL):
+                        kind, payload = self.conn.recv()
+                        if kind == "event":
+                            if on_event is not None:
+                                on_event(payload)
+                            continue
+                        if payload.get('status') == 'interrupted':
+                            raise KernelLimitError(self.stop_reason or "cancelled", worker_lost=False)
+                        return payload
+                    self._enforce_limits(deadline)
+            except (EOFError, OSError) as e:
+                if self.stop_reason is not None:
+                    raise KernelLimitError(self.stop_reason, worker_lost=True) from e
+                raise KernelCrashedError(
+                    f"Execution worker for session {self.session_id} stopped unexpectedly "
+                    f"(exit code {self.process.exitcode})") from e
+            finally:
+                self.busy = False
+                self.last_used = time.time()
+
+    def cancel(self):
+        """Stop the running request, if any (callable from any thread)"""
+        if self.busy and self.stop_reason is None:
+            self._interrupt("cancelled")
+
+    def _enforce_limits(self, deadline: Optional[float]):
+        if self.stop_reason is not None:
+            # Code that ignores the interrupt (e.g. stuck in a C extension) is killed
+            if time.time() > self.stop_deadline:
+                logger.warning(f"Killing worker for session {self.session_id} ({self.stop_reason})")
+                self.process.kill()
+                self.process.join()
+            return
+        if deadline is not None and time.time() > deadline:
+            self._interrupt("timeout")
+            return
+        if EXECUTION_MEMORY_LIMIT_MB > 0:
+            rss = process_tree_rss(self.process.pid)
+            if rss is not None and rss > EXECUTION_MEMORY_LIMIT_MB * 1024 * 1024:
+                self._interrupt("memory")
+
+    def _interrupt(self, reason: str):
+        self.stop_reason = reason
+        self.stop_deadline = time.time() + INTERRUPT_GRACE_PERIOD
+        try:
+            os.kill(self.process.pid, signal.SIGINT)
+        except (OSError, AttributeError):
+            # No signals available: the worker is killed once the grace period ends
+            pass
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stop the worker once its current request (if any) has finished"""
+        with self._lock:
+            try:
+                self.conn.send(("shutdown", {}))
+            except (OSError, BrokenPipeError):
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.conn.close()
+
+
+class KernelPool:
+    """One worker process per session, capped in size, with idle reaping"""
+
+    def __init__(self, max_workers: int, idle_timeout: float, start_method: str = "spawn"):
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self.context = multiprocessing.get_context(start_method)
+        self.workers = {}
+        # Sessions whose evicted or idle worker is still writing its snapshot, set once it's done
+        self.paging_out = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def get(self, session_id: str) -> KernelHandle:
+        """Get the session's worker, starting one if needed"""
+        with self._lock:
+            return self._get(session_id)
+
+    def _get(self, session_id: str) -> KernelHandle:
+        # Called with the pool lock held
+        handle = self.workers.get(session_id)
+        if handle is not None and handle.is_alive():
+            return handle
+        if handle is not None:
+            logger.warning(f"Worker for session {session_id} died, starting a new one")
+            self.workers.pop(session_id)
+
+        if len(self.workers) >= self.max_workers:
+            self._evict_one()
+        handle = KernelHandle(session_id, self.context)
+        if SESSION_SNAPSHOTS and session_id in self.paging_out:
+            # The previous worker's snapshot isn't written yet; it's loaded once it is
+            handle.restore_pending = True
+        self.workers[session_id] = handle
+        self._start_reaper()
+        return handle
+
+    def _release(self, handle: KernelHandle):
+        with self._lock:
+            handle.leases -= 1
+
+    def request(self, session_id: str, op: str, on_event: Optional[Callable] = None, **args) -> dict:
+        # Leased under the pool lock, so another session can't evict the worker before the request reaches it
+        with self._lock:
+            handle = self._get(session_id)
+            handle.leases += 1
+        try:
+            if handle.restore_pending:
+                handle.restore_pending = False
+                self._restore(handle)
+            return handle.request(op, on_event=on_event, **args)
+        except (KernelCrashedError, KernelLimitError) as e:
+            if isinstance(e, KernelCrashedError) or e.worker_lost:
+                with self._lock:
+                    if self.workers.get(session_id) is handle:
+                        self.workers.pop(session_id)
+            raise
+        finally:
+            self._release(handle)
+
+    def cancel(self, session_id: str):
+        """Cancel the session's running request, if any"""
+        with self._lock:
+            handle = self.workers.get(session_id)
+        if handle is not None:
+            handle.cancel()
+
+    def snapshot(self, session_id: str) -> Optional[dict]:
+        """Write the session's changed variables to its snapshot (None if it has no live worker)"""
+        with self._lock:
+            handle = self.workers.get(session_id)
+            if not SESSION_SNAPSHOTS or handle is None or not handle.is_alive() or handle.restore_pending:
+                return None
+            handle.leases += 1
+        try:
+            return handle.request("snapshot", directory=snapshot_dir(session_id))
+        finally:
+            self._release(handle)
+
+    def _restore(self, handle: KernelHandle):
+        paged_out = self.paging_out.get(handle.session_id)
+        if paged_out is not None:
+            # Restoring before the previous worker has finished writing would load a partial snapshot
+            paged_out.wait()
+        if not has_snapshot(handle.session_id):
+            return
+        try:
+            result = handle.request("restore", directory=snapshot_dir(handle.session_id))
+            logger.info(f"Restored {len(result.get('variables', {}))} variables for session {handle.session_id}")
+        except (KernelCrashedError, KernelLimitError):
+            raise
+        except Exception as e:
+            # The session carries on without its old variables
+            logger.warning(f"Could not restore variables for session {handle.session_id}: {str(e)}")
+
+    def _start_page_out(self, handle: KernelHandle) -> threading.Event:
+        # Called with the pool lock held, after the handle was removed from the pool
+        done = threading.Event()
+        self.paging_out[handle.session_id] = done
+        return done
+
+    def _page_out(self, handle: KernelHandle, done: threading.Event):
+        """Snapshot a worker's variables, then shut it down"""
+        try:
+            if SESSION_SNAPSHOTS and handle.is_alive() and not handle.restore_pending:
+                try:
+                    handle.request("snapshot", directory=snapshot_dir(handle.session_id))
+                except Exception as e:
+                    logger.warning(f"Could not snapshot session {handle.session_id} before shutdown: {str(e)}")
+            handle.shutdown()
+        finally:
+            with self._lock:
+                if self.paging_out.get(handle.session_id) is done:
+                    self.paging_out.pop(handle.session_id)
+            done.set()
+
+    def shutdown_session(self, session_id: str):
+        with self._lock:
+            handle = self.workers.pop(session_id, None)
+        if handle is not None:
+            handle.shutdown()
+
+    def reap_idle(self):
+        """Shut down workers that have been idle longer than the timeout"""
+        now = time.time()
+        with self._lock:
+            idle = [sid for sid, h in self.workers.items()
+                    if not h.busy and not h.leases and now - h.last_used > self.idle_timeout]
+            handles = []
+            for sid in idle:
+                handle = self.workers.pop(sid)
+                handles.append((handle, self._start_page_out(handle)))
+        for handle, done in handles:
+            logger.info(f"Reaping idle worker for session {handle.session_id}")
+            self._page_out(handle, done)
+
+    def shutdown(self):
+        with self._lock:
+            handles = list(self.workers.values())
+            self.workers.clear()
+        for handle in handles:
+            handle.shutdown()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': len(self.workers),
+                'busy': sum(1 for h in self.workers.values() if h.busy),
+                'max_workers': self.max_workers
+            }
+
+    def _evict_one(self):
+        # Make room by dropping the least recently used idle worker
+        idle = [h for h in self.workers.values() if not h.busy and not h.leases]
+        if not idle:
+            raise KernelPoolFullError(
+                f"All {self.max_workers} execution workers are busy. Please try again in a moment.")
+        victim = min(idle, key=lambda h: h.last_used)
+        logger.info(f"Worker pool full, evicting session {victim.session_id}")
+        self.workers.pop(victim.session_id)
+        done = self._start_page_out(victim)
+        threading.Thread(target=self._page_out, args=(victim, done), daemon=True).start()
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+
+        def reap_loop():
+            while True:
+                time.sleep(min(60, self.idle_timeout))
+                try:
+                    self.reap_idle()
+                except Exception as e:
+                    logger.error(f"Error reaping idle workers: {str(e)}")
+
+        self._reaper = threading.Thread(target=reap_loop, daemon=True, name="kernel-reaper")
+        self._reaper.start()
+
+
+# Process-wide pool shared by all Streamlit sessions
+kernel_pool = KernelPool(KERNEL_POOL_MAX_WORKERS, KERNEL_IDLE_TIMEOUT, KERNEL_START_METHOD)
+atexit.register(kernel_pool.shutdown)
@@ -0,0 +1,56 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+from Pages.utils.dataset_cache import file_fingerprint
+from Pages.utils.ingest import columnar_paths, read_schema, feather
+
+# Rows shown in the Data Management tab
+PREVIEW_ROWS = 5
+# Previews kept in memory (they are small: a few rows per file version)
+PREVIEW_CACHE_ENTRIES = 128
+
+
+def _read_head(csv_path: str, schema: Optional[dict], rows: int) -> pd.DataFrame:
+    """First rows of a dataset, read from the start of its columnar copy or CSV only"""
+    arrow_path, _ = columnar_paths(csv_path)
+    if schema and schema.get('format') == "arrow" and feather is not None and os.path.exists(arrow_path):
+        import pyarrow as pa
+        with pa.memory_map(arrow_path) as source:
+            reader = pa.ipc.open_file(source)
+            batches, count = [], 0
+            for i in range(reader.num_record_batches):
+                if count >= rows:
+                    break
+                batch = reader.get_batch(i)
+                batches.append(batch)
+                count += batch.num_rows
+            table = pa.Table.from_batches(batches, schema=reader.schema).slice(0, rows)
+            return table.to_pandas()
+    return pd.read_csv(csv_path, nrows=rows)
+
+
+@lru_cache(maxsize=PREVIEW_CACHE_ENTRIES)
+def _cached_preview(fingerprint: tuple, ingested: bool, rows: int) -> dict:
+    csv_path = fingerprint[0]
+    schema = read_schema(csv_path) if ingested else None
+    data = _read_head(csv_path, schema, rows)
+    return {
+        'data': data,
+        # Counts come from the ingest schema; without one the row count is unknown until ingest finishes
+        'rows': schema.get('rows') if schema else None,
+        'columns': len(schema['columns']) if schema else len(data.columns)
+    }
+
+
+def dataset_preview(csv_path: str, rows: int = PREVIEW_ROWS) -> dict:
+    """Preview of a dataset: {'data': first rows, 'rows': total row count or None, 'columns': column count}
+
+    Cached by file fingerprint, so reruns only stat the file; a changed file
+    gets a new fingerprint and is read again, and so does one whose ingest
+    finished since (for the columnar read and the row count).
+    """
+    _, schema_path = columnar_paths(csv_path)
+    return _cached_preview(file_fingerprint(csv_path), os.path.exists(schema_path), rows)
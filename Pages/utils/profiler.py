@@ -0,0 +1,320 @@
+import decimal
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from Pages.utils.ingest import COLUMNAR_DIR, source_info, write_atomic, dump_json, load_dataset, ingest_csv
+from Pages.utils.sql_engine import open_relation, out_of_core_available
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 2
+# Most frequent values kept per low-cardinality column
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "5"))
+# Columns described in the prompt per dataset (the sidecar keeps all of them)
+PROFILE_PROMPT_MAX_COLUMNS = int(os.getenv("PROFILE_PROMPT_MAX_COLUMNS", "40"))
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# Columns with more distinct values than this are treated as free text/identifiers (no top-k)
+TOP_K_MAX_CARDINALITY = 1000
+KEY_NAME_SUFFIXES = ("_id", "_key")
+# Distinct counts are exact up to this many values, and for columns this close to unique (key detection)
+EXACT_DISTINCT_MAX = 100_000
+EXACT_DISTINCT_MARGIN = 0.05
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT",
+                  "UINTEGER", "UBIGINT", "UHUGEINT", "FLOAT", "DOUBLE", "DECIMAL")
+_TEMPORAL_TYPES = ("DATE", "TIMESTAMP")
+
+
+def profile_path(csv_path: str) -> str:
+    directory, filename = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(directory, COLUMNAR_DIR, f"{os.path.splitext(filename)[0]}.profile.json")
+
+
+def _is_key_name(column: str) -> bool:
+    name = column.lower()
+    return name in ("id", "key") or name.endswith(KEY_NAME_SUFFIXES)
+
+
+def _scalar(value):
+    # numpy scalars to plain Python so the sidecar stays readable JSON (timestamps become strings)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value.item() if hasattr(value, 'item') and not isinstance(value, pd.Timestamp) else value
+
+
+def build_profile(df: pd.DataFrame) -> dict:
+    """Column statistics for a dataframe, computed with whole-frame operations where possible"""
+    rows = len(df)
+    nulls = df.isna().sum()
+    distinct = df.nunique(dropna=True)
+
+    numeric = df.select_dtypes(include="number")
+    numeric = numeric.loc[:, [not pd.api.types.is_bool_dtype(t) for t in numeric.dtypes]]
+    temporal = df.select_dtypes(include=["datetime", "datetimetz"])
+    mins = pd.concat([numeric.min(), temporal.min()]) if len(numeric.columns) + len(temporal.columns) else pd.Series(dtype=object)
+    maxs = pd.concat([numeric.max(), temporal.max()]) if len(numeric.columns) + len(temporal.columns) else pd.Series(dtype=object)
+    quantiles = numeric.quantile(QUANTILES) if len(numeric.columns) and rows else pd.DataFrame()
+    means = numeric.mean() if len(numeric.columns) else pd.Series(dtype=float)
+
+    columns = []
+    for column, dtype in df.dtypes.items():
+        info = {
+            'name': str(column),
+            'dtype': str(dtype),
+            'nulls': int(nulls[column]),
+            'distinct': int(distinct[column]),
+        }
+        if column in mins.index:
+            info['min'] = _scalar(mins[column])
+            info['max'] = _scalar(maxs[column])
+        if column in quantiles.columns:
+            info['mean'] = _scalar(means[column])
+            info['quantiles'] = {str(q): _scalar(quantiles.at[q, column]) for q in QUANTILES}
+        elif column not in mins.index and 0 < info['distinct'] <= TOP_K_MAX_CARDINALITY:
+            top = df[column].value_counts(dropna=True).head(PROFILE_TOP_K)
+            info['top_values'] = [[str(value), int(count)] for value, count in top.items()]
+        info['key_candidate'] = _key_candidate(info, rows)
+        columns.append(info)
+
+    return {'rows': rows, 'columns': columns}
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _key_candidate(info: dict, rows: int) -> bool:
+    # Unique, complete integer/text columns and id-like names are join candidates
+    unique = rows > 0 and info['distinct'] == rows and info['nulls'] == 0
+    return bool((unique and _dtype_kind(info['dtype']) in ("integer", "text")) or _is_key_name(info['name']))
+
+
+def build_relation_profile(relation, dtypes: Optional[dict] = None) -> dict:
+    """Column statistics computed by DuckDB while streaming over the file, same layout as build_profile
+
+    Distinct counts are approximate (HyperLogLog) only for high-cardinality
+    columns that aren't nearly unique; the rest are counted exactly, so top
+    values and key detection stay reliable.
+    dtypes maps columns to the pandas dtype names shown in the prompt.
+    """
+    names = list(relation.columns)
+    types = [str(t).upper() for t in relation.types]
+    numeric = [t.startswith(_NUMERIC_TYPES) for t in types]
+    temporal = [t.startswith(_TEMPORAL_TYPES) for t in types]
+
+    expressions = ["count(*)"]
+    for name, is_numeric, is_temporal in zip(names, numeric, temporal):
+        column = _quote(name)
+        expressions += [f"count({column})", f"approx_count_distinct({column})"]
+        if is_numeric:
+            expressions += [f"min({column})", f"max({column})", f"avg({column})",
+                            f"approx_quantile({column}, {QUANTILES})"]
+        elif is_temporal:
+            expressions += [f"min({column})", f"max({column})"]
+    values = iter(relation.query("profiled", f"SELECT {', '.join(expressions)} FROM profiled").fetchone())
+
+    rows = next(values)
+    columns = []
+    for name, type_name, is_numeric, is_temporal in zip(names, types, numeric, temporal):
+        count = next(values)
+        info = {
+            'name': name,
+            'dtype': (dtypes or {}).get(name, type_name.lower()),
+            'nulls': rows - count,
+            'distinct': min(next(values), count),
+        }
+        if is_numeric or is_temporal:
+            info['min'] = _scalar(next(values))
+            info['max'] = _scalar(next(values))
+        if is_numeric:
+            info['mean'] = _scalar(next(values))
+            quantiles = next(values) or [None] * len(QUANTILES)
+            info['quantiles'] = {str(q): _scalar(v) for q, v in zip(QUANTILES, quantiles)}
+        columns.append(info)
+
+    recount = [info for info in columns if info['distinct'] and (
+        info['distinct'] <= EXACT_DISTINCT_MAX
+        or info['distinct'] >= (1 - EXACT_DISTINCT_MARGIN) * (rows - info['nulls']))]
+    if recount:
+        exact = relation.query("profiled", "SELECT " + ", ".join(
+            f"count(DISTINCT {_quote(info['name'])})" for info in recount) + " FROM profiled").fetchone()
+        for info, distinct in zip(recount, exact):
+            info['distinct'] = distinct
+
+    for info, is_numeric, is_temporal in zip(columns, numeric, temporal):
+        if not is_numeric and not is_temporal and 0 < info['distinct'] <= TOP_K_MAX_CARDINALITY:
+            column = _quote(info['name'])
+            top = relation.query("profiled", f"SELECT {column}, count(*) AS n FROM profiled WHERE {column} IS NOT NULL "
+                                             f"GROUP BY 1 ORDER BY n DESC, 1 LIMIT {PROFILE_TOP_K}").fetchall()
+            info['top_values'] = [[str(value), int(count)] for value, count in top]
+        info['key_candidate'] = _key_candidate(info, rows)
+
+    return {'rows': rows, 'columns': columns}
+
+
+def read_profile(csv_path: str) -> Optional[dict]:
+    """Return the stored profile for a CSV, or None if it's missing or the file changed since"""
+    try:
+        with open(profile_path(csv_path), 'r') as f:
+            profile = json.load(f)
+        current = source_info(csv_path)
+    except (OSError, ValueError):
+        return None
+    source = profile.get('source', {})
+    if (profile.get('version') != PROFILE_VERSION
+            or source.get('size') != current['size']
+            or source.get('mtime_ns') != current['mtime_ns']):
+        return None
+    return profile
+
+
+def profile_dataset(csv_path: str, force: bool = False) -> dict:
+    """Profile a CSV once per file version and store the result in a sidecar next to its columnar copy"""
+    if not force:
+        profile = read_profile(csv_path)
+        if profile is not None:
+            return profile
+    source = source_info(csv_path)
+    if out_of_core_available():
+        # Streams over the columnar copy (or the CSV), so profiling never loads the file into the server's memory
+        schema = ingest_csv(csv_path)
+        dtypes = {column['name']: column['dtype'] for column in schema.get('columns', [])}
+        stats = build_relation_profile(open_relation(csv_path), dtypes)
+    else:
+        stats = build_profile(load_dataset(csv_path))
+    profile = {'version': PROFILE_VERSION, 'source': source, **stats}
+    path = profile_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda p: dump_json(profile, p))
+    return profile
+
+
+# Profiling is CPU bound; one background thread keeps it from competing with analyses
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiler")
+_pending: Dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def start_profiling(csv_path: str, force: bool = False) -> Future:
+    """Profile a dataset in the background; repeated calls while it runs return the same future"""
+    key = os.path.abspath(csv_path)
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None and not future.done():
+            return future
+
+        def run():
+            try:
+                return profile_dataset(csv_path, force=force)
+            except Exception as e:
+                logger.warning(f"Could not profile {csv_path}: {str(e)}")
+                raise
+
+        future = _executor.submit(run)
+        _pending[key] = future
+        return future
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def compact_profile(profile: dict, max_columns: int = PROFILE_PROMPT_MAX_COLUMNS) -> str:
+    """One line per column, short enough to include in the prompt"""
+    lines = [f"Rows: {profile['rows']:,}"]
+    for column in profile['columns'][:max_columns]:
+        parts = [f"{column['dtype']}"]
+        if column['nulls']:
+            parts.append(f"{column['nulls']:,} nulls")
+        parts.append(f"{column['distinct']:,} distinct")
+        if 'quantiles' in column:
+            q = column['quantiles']
+            parts.append(f"min {_format_value(column['min'])}, p25 {_format_value(q['0.25'])}, "
+                         f"median {_format_value(q['0.5'])}, p75 {_format_value(q['0.75'])}, "
+                         f"max {_format_value(column['max'])}")
+        elif 'min' in column:
+            parts.append(f"{column['min']} to {column['max']}")
+        if column.get('top_values'):
+            parts.append("top: " + ", ".join(f"{value} ({count:,})" for value, count in column['top_values']))
+        if column['key_candidate']:
+            parts.append("key candidate")
+        lines.append(f"- {column['name']}: " + "; ".join(parts))
+    hidden = len(profile['columns']) - max_columns
+    if hidden > 0:
+        lines.append(f"- ... {hidden} more columns")
+    return "\n".join(lines)
+
+
+def _entity_words(text: str) -> set:
+    # "cards_data" -> {"card", "data"}: words of a dataset's name, singular
+    return {word[:-1] if word.endswith("s") and len(word) > 3 else word
+            for word in re.findall(r"[a-z0-9]+", text.lower())}
+
+
+def join_key_candidates(profiles: Dict[str, dict], names: Optional[Dict[str, str]] = None,
+                        descriptions: Optional[Dict[str, str]] = None) -> List[str]:
+    """Likely join conditions between datasets, from key-like columns with compatible types
+
+    Matches a `<entity>_id`/`<entity>_key` column against the same column where
+    it is unique, and `<entity>_id` against a unique `id` column when the other
+    dataset is that entity: its name (e.g. `cards_data` for `card_id`) or its
+    description (data dictionary linkage) says so. `id` is never paired with `id`.
+    names and descriptions map dataset names to the file stem and description.
+    """
+    keys = {
+        name: {c['name'].lower(): c for c in profile['columns'] if _is_key_name(c['name'])}
+        for name, profile in profiles.items()
+    }
+    datasets = list(profiles)
+    candidates = []
+    for left in datasets:
+        for right in datasets:
+            if left == right:
+                continue
+            for column_name, left_col in keys[left].items():
+                if column_name in ("id", "key"):
+                    # A dataset's own id only appears as the unique side of a pair
+                    continue
+                right_col = keys[right].get(column_name)
+                if right_col is not None:
+                    # Two foreign keys with the same name don't join rows; one side must be unique
+                    unique_left = _is_unique(left_col, profiles[left])
+                    if not _is_unique(right_col, profiles[right]) or (unique_left and datasets.index(left) > datasets.index(right)):
+                        continue
+                elif column_name.endswith("_id") and _is_unique(keys[right].get("id"), profiles[right]):
+                    entity = column_name[:-len("_id")]
+                    described = re.search(rf"\b{re.escape(column_name)}\b", (descriptions or {}).get(right, "").lower())
+                    if not (_entity_words(entity) & _entity_words((names or {}).get(right, right)) or described):
+                        continue
+                    right_col = keys[right]["id"]
+                else:
+                    continue
+                kinds = {_dtype_kind(left_col['dtype']), _dtype_kind(right_col['dtype'])}
+                # Integer ids become floats when the column has nulls
+                if len(kinds) == 1 or kinds == {"integer", "float"}:
+                    candidates.append(f"{left}.{left_col['name']} = {right}.{right_col['name']}")
+    return candidates
+
+
+def _is_unique(column: Optional[dict], profile: dict) -> bool:
+    return column is not None and column['distinct'] == profile['rows'] and column['nulls'] == 0
+
+
+def _dtype_kind(dtype: str) -> str:
+    if "int" in dtype:
+        return "integer"
+    if "float" in dtype:
+        return "float"
+    if "datetime" in dtype:
+        return "datetime"
+    return "text"
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from Pages.utils.dataset_cache import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join("cache", "response_cache.sqlite"))
+# Entries older than this are ignored and removed (seconds)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+# Least recently used entries beyond this count are evicted
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+# Cosine similarity needed for a near-duplicate question to count as a hit (0 disables embedding lookup)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop emoji/punctuation and collapse whitespace so trivially different phrasings match"""
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def cache_scope(input_data: list, model: str, previous_queries: List[str]) -> str:
+    """Hash of everything besides the question that the answer depends on
+
+    previous_queries keeps follow-up questions ("now plot it") from matching
+    answers given in a different conversation.
+    """
+    scope = {
+        'model': model,
+        'datasets': [[list(file_fingerprint(d.data_path)), d.engine] for d in input_data],
+        'context': [normalize_query(q) for q in previous_queries]
+    }
+    return hashlib.sha256(json.dumps(scope, sort_keys=True).encode()).hexdigest()
+
+
+def cacheable_answer(messages: list) -> bool:
+    """Whether an answer can be replayed to a later asker: none of its tool calls was stopped or lost its worker
+
+    Those outcomes (timeouts, cancels, memory limits, a busy or crashed worker)
+    say nothing about the question, so replaying them would only repeat the failure.
+    """
+    return not any(getattr(message, "status", None) == "error" for message in messages)
+
+
+class ResponseCache:
+    """Persistent cache of complete answers (messages, debug outputs and figures) with TTL and LRU eviction"""
+
+    def __init__(self, path: str, ttl: int, max_entries: int, similarity: float = 0.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding TEXT,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, query: str, scope: str) -> Optional[dict]:
+        """Return the stored payload for a question, trying an exact match first, then similar questions"""
+        normalized = normalize_query(query)
+        row = self._lookup(lambda conn: conn.execute(
+            "SELECT key, payload FROM responses WHERE key = ?", (self._key(normalized, scope),)).fetchone())
+        if row is None and self.similarity > 0:
+            # Embed outside the lock, it's a network call
+            embedding = self._embed(normalized)
+            if embedding is not None:
+                row = self._lookup(lambda conn: self._similar(conn, embedding, scope))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[1])
+
+    def _lookup(self, find):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            row = find(conn)
+            if row is not None:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, row[0]))
+            conn.commit()
+            return row
+
+    def put(self, query: str, scope: str, payload: dict):
+        normalized = normalize_query(query)
+        embedding = self._embed(normalized) if self.similarity > 0 else None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(normalized, scope), scope, normalized,
+                 json.dumps(embedding) if embedding else None,
+                 json.dumps(payload, default=str), now, now)
+            )
+            # Evict least recently used entries beyond the limit
+            conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def _key(self, normalized_query: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalized_query}".encode()).hexdigest()
+
+    def _similar(self, conn: sqlite3.Connection, embedding: List[float], scope: str):
+        best_row, best_score = None, self.similarity
+        for key, payload, stored in conn.execute(
+                "SELECT key, payload, embedding FROM responses WHERE scope = ? AND embedding IS NOT NULL", (scope,)):
+            score = _cosine(embedding, json.loads(stored))
+            if score >= best_score:
+                best_row, best_score = (key, payload), score
+        return best_row
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        try:
+            if self._embeddings is None:
+                from langchain_openai import OpenAIEmbeddings
+                self._embeddings = OpenAIEmbeddings(model=os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"))
+            return self._embeddings.embed_query(text)
+        except Exception as e:
+            # Similarity lookup is best effort; exact matches still work
+            logger.warning(f"Could not embed query for the response cache: {str(e)}")
+            return None
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+
+# Shared by all sessions, persisted across restarts
+response_cache = ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_SIMILARITY)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+from Pages.utils.code_analysis import normalize_code
+from Pages.utils.dataset_cache import file_fingerprint, DATASET_CACHE_CONTENT_HASH
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("cache", "tool_results"))
+# Disk budget for memoized tool results (in MB, 0 disables memoization)
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+
+
+def result_key(python_code: str, datasets: List[Tuple[str, str, str]]) -> str:
+    """Hash of the normalized code and the (name, path, engine) of every dataset it reads"""
+    key = {
+        'code': normalize_code(python_code),
+        'datasets': [[name, list(file_fingerprint(path, DATASET_CACHE_CONTENT_HASH)), engine]
+                     for name, path, engine in datasets]
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of code execution results, one JSON file per key, bounded by a byte budget
+
+    Every worker process has its own instance over the same directory; files are
+    written atomically, and the least recently used ones are removed first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            # The modification time doubles as the last access time for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        # Unique per call: threads of one worker can store results at the same time
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not store tool result in cache: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Another worker evicted it first
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+# One per process; all worker processes share the directory
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,230 @@
+"""Durable chat sessions: conversation records, graph checkpoints and variable snapshots
+
+A session can be picked up again after a server restart, and an idle
+session's execution worker can be shut down without losing its variables:
+they are written to a snapshot directory (DataFrames as Parquet, other
+values pickled) and loaded back by the next worker for that session.
+"""
+import importlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import types
+from typing import Iterable, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join("cache", "sessions.sqlite"))
+# Snapshots of session variables, one directory per session
+SESSION_SNAPSHOT_DIR = os.getenv("SESSION_SNAPSHOT_DIR", os.path.join("cache", "session_snapshots"))
+# Sessions untouched for this long are deleted with their snapshots and figures (days, 0 keeps them)
+SESSION_RETENTION_DAYS = float(os.getenv("SESSION_RETENTION_DAYS", "30"))
+# Write session variables to disk after each answer and before an idle worker is shut down
+SESSION_SNAPSHOTS = os.getenv("SESSION_SNAPSHOTS", "true").lower() == "true"
+
+# Values larger than this are not pickled into snapshots (they are recreated by re-running code)
+SNAPSHOT_MAX_PICKLE_BYTES = 256 * 1024 * 1024
+SNAPSHOT_MANIFEST = "manifest.json"
+SESSION_GC_INTERVAL = 3600
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:
+    # Older or slimmer installs: the graph runs without step checkpoints
+    SqliteSaver = None
+
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer():
+    """Process-wide SQLite-backed LangGraph checkpointer in the session database, or None if unavailable"""
+    global _checkpointer
+    if SqliteSaver is None:
+        return None
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            os.makedirs(os.path.dirname(SESSION_STORE_PATH) or ".", exist_ok=True)
+            _checkpointer = SqliteSaver(sqlite3.connect(SESSION_STORE_PATH, check_same_thread=False))
+        return _checkpointer
+
+
+def snapshot_dir(session_id: str) -> str:
+    return os.path.join(SESSION_SNAPSHOT_DIR, session_id)
+
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, SNAPSHOT_MANIFEST), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_value(name: str, value, directory: str) -> Optional[dict]:
+    """Write one variable, returning its manifest entry (None if it can't be stored)"""
+    if isinstance(value, types.ModuleType):
+        # Imported modules are re-imported by name
+        return {'kind': "module", 'module': value.__name__, 'file': None}
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        path = os.path.join(directory, f"{name}.parquet")
+        try:
+            frame.to_parquet(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            return {'kind': "series" if isinstance(value, pd.Series) else "parquet", 'file': os.path.basename(path)}
+        except Exception:
+            # e.g. mixed-type object columns or non-string column names; pickled below instead
+            pass
+    try:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    if len(data) > SNAPSHOT_MAX_PICKLE_BYTES:
+        return None
+    path = os.path.join(directory, f"{name}.pickle")
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+    return {'kind': "pickle", 'file': os.path.basename(path)}
+
+
+def write_snapshot(variables: dict, changed: Iterable[str], directory: str) -> list:
+    """Update a session snapshot, returning the names that couldn't be stored
+
+    variables holds all of the session's current variables; only the changed
+    ones are written again, and ones that no longer exist are removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+    lost = []
+    for name in changed:
+        entry = _write_value(name, variables[name], directory)
+        old = manifest.pop(name, None)
+        if entry is None:
+            lost.append(name)
+        else:
+            manifest[name] = entry
+        if old is not None and old['file'] and (entry is None or old['file'] != entry['file']):
+            _remove(os.path.join(directory, old['file']))
+    for name in set(manifest) - set(variables):
+        old = manifest.pop(name)
+        if old['file']:
+            _remove(os.path.join(directory, old['file']))
+    # The manifest is replaced last, so a crash mid-snapshot leaves the previous one readable
+    path = os.path.join(directory, SNAPSHOT_MANIFEST)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+    return lost
+
+
+def read_snapshot(directory: str) -> dict:
+    """Variables stored in a session snapshot (unreadable entries are skipped)"""
+    values = {}
+    for name, entry in _read_manifest(directory).items():
+        path = os.path.join(directory, entry['file'] or "")
+        try:
+            if entry['kind'] == "module":
+                values[name] = importlib.import_module(entry['module'])
+            elif entry['kind'] == "parquet":
+                values[name] = pd.read_parquet(path)
+            elif entry['kind'] == "series":
+                values[name] = pd.read_parquet(path).iloc[:, 0]
+            else:
+                with open(path, "rb") as f:
+                    values[name] = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not restore variable {name} from {directory}: {str(e)}")
+    return values
+
+
+def has_snapshot(session_id: str) -> bool:
+    return os.path.exists(os.path.join(snapshot_dir(session_id), SNAPSHOT_MANIFEST))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SessionStore:
+    """Conversation records (chat, figures per message, debug outputs, token usage) keyed by session id"""
+
+    def __init__(self, path: str, retention_days: float):
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self._conn = None
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    record TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.commit()
+        return self._conn
+
+    def save(self, session_id: str, record: dict):
+        payload = json.dumps(record, default=str)
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, payload, time.time()))
+            conn.commit()
+        self.maybe_gc()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT record FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, session_id: str):
+        # Imported here: the figure store is only needed when sessions are removed
+        from Pages.utils.figure_store import figure_store
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            # Graph checkpoints of the session's turns (threads are named "<session_id>:<turn>")
+            for table in ("checkpoints", "writes"):
+                try:
+                    conn.execute(f"DELETE FROM {table} WHERE thread_id LIKE ?", (f"{session_id}:%",))
+                except sqlite3.OperationalError:
+                    # No checkpointer, or one with a different schema
+                    pass
+            conn.commit()
+        shutil.rmtree(snapshot_dir(session_id), ignore_errors=True)
+        figure_store.delete_session(session_id)
+
+    def maybe_gc(self):
+        if self.retention <= 0 or time.time() - self._last_gc < SESSION_GC_INTERVAL:
+            return
+        self._last_gc = time.time()
+        with self._lock:
+            expired = [row[0] for row in self._connect().execute(
+                "SELECT session_id FROM sessions WHERE updated_at < ?", (time.time() - self.retention,))]
+        for session_id in expired:
+            try:
+                self.delete(session_id)
+            except Exception as e:
+                logger.warning(f"Could not delete expired session {session_id}: {str(e)}")
+
+
+# Process-wide store shared by all Streamlit sessions
+session_store = SessionStore(SESSION_STORE_PATH, SESSION_RETENTION_DAYS)
@@ -0,0 +1,109 @@
+import os
+import threading
+from typing import Optional
+
+from Pages.utils.ingest import columnar_paths, read_schema, schema_metadata
+
+try:
+    import duckdb
+except ImportError:
+    # Out-of-core execution is optional; without duckdb every dataset uses pandas
+    duckdb = None
+
+ENGINES = ("pandas", "duckdb")
+
+# Files larger than this default to the out-of-core engine (in MB)
+OUT_OF_CORE_THRESHOLD_MB = int(os.getenv("OUT_OF_CORE_THRESHOLD_MB", "1024"))
+# DuckDB spills to disk once it reaches this limit
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "4GB")
+DUCKDB_TEMP_DIRECTORY = os.getenv("DUCKDB_TEMP_DIRECTORY", os.path.join("uploads", ".duckdb_tmp"))
+# Largest result a SQL query may hand back as a pandas DataFrame
+SQL_RESULT_MAX_ROWS = int(os.getenv("SQL_RESULT_MAX_ROWS", "1000000"))
+
+_connection = None
+_connection_lock = threading.Lock()
+_local = threading.local()
+
+
+def out_of_core_available() -> bool:
+    return duckdb is not None
+
+
+def default_engine(data_path: str) -> str:
+    """Pick the execution engine for a file based on its size"""
+    if duckdb is not None and os.path.getsize(data_path) > OUT_OF_CORE_THRESHOLD_MB * 1024 * 1024:
+        return "duckdb"
+    return "pandas"
+
+
+def get_connection():
+    """Get this thread's cursor on the shared in-process DuckDB database"""
+    global _connection
+    if duckdb is None:
+        raise ImportError("duckdb is required for out-of-core datasets. Install it with: pip install duckdb")
+
+    with _connection_lock:
+        if _connection is None:
+            os.makedirs(DUCKDB_TEMP_DIRECTORY, exist_ok=True)
+            _connection = duckdb.connect(config={
+                'memory_limit': DUCKDB_MEMORY_LIMIT,
+                'temp_directory': DUCKDB_TEMP_DIRECTORY
+            })
+    # DuckDB connections aren't safe to share between threads, cursors are
+    if getattr(_local, 'cursor', None) is None:
+        _local.cursor = _connection.cursor()
+    return _local.cursor
+
+
+def open_relation(data_path: str, con=None):
+    """Expose a dataset as a lazy DuckDB relation that streams over the file"""
+    con = con or get_connection()
+    schema = read_schema(data_path)
+    arrow_path, _ = columnar_paths(data_path)
+    if schema and schema.get('format') == "arrow" and os.path.exists(arrow_path):
+        import pyarrow.dataset as ds
+        return con.from_arrow(ds.dataset(arrow_path, format="ipc"))
+    return con.read_csv(data_path)
+
+
+def relation_metadata(relation, data_path: Optional[str] = None) -> dict:
+    """Dataset metadata for a relation; the row count comes from the stored schema when available"""
+    schema = read_schema(data_path) if data_path else None
+    if schema is not None:
+        return schema_metadata(schema)
+
+    sample = relation.limit(1).df().to_dict(orient='records')
+    return {
+        'size': None,
+        'types': {col: str(dtype) for col, dtype in zip(relation.columns, relation.dtypes)},
+        'sample': sample[0] if sample else {}
+    }
+
+
+def run_query(query: str, input_data: list):
+    """Run SQL over the selected datasets (as tables dataset_0, dataset_1, ...)
+
+    Returns (DataFrame or None, truncated). Statements without a result set return None.
+    """
+    con = get_connection()
+    names = [f"dataset_{i}" for i in range(len(input_data))]
+    try:
+        # Registered on this thread's cursor only: views (create_view) live in the shared catalog,
+        # where concurrent queries over other datasets would see and replace each other's tables
+        for name, input_dataset in zip(names, input_data):
+            con.register(name, open_relation(input_dataset.data_path, con))
+
+        relation = con.sql(query)
+        if relation is None:
+            return None, False
+        df = relation.limit(SQL_RESULT_MAX_ROWS + 1).df()
+    finally:
+        for name in names:
+            try:
+                con.unregister(name)
+            except Exception:
+                # Never registered (its file failed to open)
+                pass
+    if len(df) > SQL_RESULT_MAX_ROWS:
+        return df.head(SQL_RESULT_MAX_ROWS), True
+    return df, False
@@ -0,0 +1,160 @@
+import io
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from Pages.graph.events import StdoutChunk
+
+# Most output kept per execution; beyond it only the beginning and the end are kept
+STDOUT_CAPTURE_MAX_CHARS = int(os.getenv("STDOUT_CAPTURE_MAX_CHARS", "200000"))
+# Output is streamed in chunks of about this size, or at least this often
+STREAM_CHUNK_CHARS = 4096
+STREAM_INTERVAL = 0.1
+
+
+class OutputCapture:
+    """Bounded capture of one execution's output, streamed incrementally
+
+    The first half of the budget is kept (and streamed) as it's written; after
+    that only the most recent output is kept, and the number of dropped
+    characters is reported where the gap is.
+    """
+
+    def __init__(self, send_event: Optional[Callable] = None, tool_call_id: str = "",
+                 max_chars: int = STDOUT_CAPTURE_MAX_CHARS):
+        self.send_event = send_event
+        self.tool_call_id = tool_call_id
+        self.head_limit = max_chars // 2
+        self.tail_limit = max_chars - self.head_limit
+        self.head = []
+        self.head_chars = 0
+        self.tail = deque()
+        self.tail_chars = 0
+        self.dropped = 0
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self._timer = None
+        # Writes come from the executing code, timed flushes from a timer thread
+        self._lock = threading.RLock()
+
+    def write(self, text: str) -> int:
+        written = len(text)
+        if not text:
+            return 0
+        room = self.head_limit - self.head_chars
+        if room > 0:
+            kept = text[:room]
+            self.head.append(kept)
+            self.head_chars += len(kept)
+            self._stream(kept)
+            text = text[room:]
+        if text:
+            self.tail.append(text)
+            self.tail_chars += len(text)
+            while self.tail_chars > self.tail_limit:
+                excess = self.tail_chars - self.tail_limit
+                oldest = self.tail[0]
+                if len(oldest) <= excess:
+                    self.tail.popleft()
+                    self.tail_chars -= len(oldest)
+                    self.dropped += len(oldest)
+                else:
+                    self.tail[0] = oldest[excess:]
+                    self.tail_chars -= excess
+                    self.dropped += excess
+        return written
+
+    def _stream(self, text: str):
+        if self.send_event is None:
+            return
+        with self._lock:
+            self._pending.append(text)
+            self._pending_chars += len(text)
+            if self._pending_chars >= STREAM_CHUNK_CHARS or time.monotonic() - self._last_flush >= STREAM_INTERVAL:
+                self.flush()
+            elif self._timer is None:
+                # Don't hold back output while the code goes on computing without printing
+                self._timer = threading.Timer(STREAM_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending and self.send_event is not None:
+                self.send_event(StdoutChunk(text="".join(self._pending), tool_call_id=self.tool_call_id))
+            self._pending = []
+            self._pending_chars = 0
+            self._last_flush = time.monotonic()
+
+    def _gap(self) -> str:
+        return f"\n...[{self.dropped:,} characters of output omitted]...\n" if self.dropped else ""
+
+    def close(self):
+        """Send whatever hasn't been streamed yet, including the kept end of overflowing output"""
+        self.flush()
+        if self.tail and self.send_event is not None:
+            self.send_event(StdoutChunk(text=self._gap() + "".join(self.tail), tool_call_id=self.tool_call_id))
+
+    def getvalue(self) -> str:
+        return "".join(self.head) + self._gap() + "".join(self.tail)
+
+
+_current_capture: ContextVar[Optional[OutputCapture]] = ContextVar("stdout_capture", default=None)
+
+
+class RoutedStdout(io.TextIOBase):
+    """sys.stdout replacement that sends writes to the capture of the current context
+
+    Installed once, so executions never swap the process-wide stream; writes
+    made outside a capture go to the original stream.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        capture = _current_capture.get()
+        if capture is None:
+            return self.fallback.write(text)
+        return capture.write(text)
+
+    def flush(self):
+        if _current_capture.get() is None:
+            self.fallback.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    @property
+    def encoding(self):
+        return getattr(self.fallback, "encoding", "utf-8")
+
+
+def install_stdout_router():
+    if not isinstance(sys.stdout, RoutedStdout):
+        sys.stdout = RoutedStdout(sys.stdout)
+
+
+@contextmanager
+def capture_stdout(send_event: Optional[Callable] = None, tool_call_id: str = ""):
+    """Capture print output of the code run inside the block (this context only)"""
+    install_stdout_router()
+    capture = OutputCapture(send_event, tool_call_id)
+    token = _current_capture.set(capture)
+    try:
+        yield capture
+    finally:
+        _current_capture.reset(token)
+        capture.close()
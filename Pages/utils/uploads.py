@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from Pages.utils.ingest import COLUMNAR_DIR, columnar_paths, ingest_csv, source_info, write_atomic, dump_json
+from Pages.utils.profiler import profile_path, start_profiling
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = "uploads"
+# Uploads are hashed and written in chunks of this size, never as one buffer
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _record_path(csv_path: str) -> str:
+    """Sidecar holding the content hash of an uploaded file"""
+    directory, filename = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(directory, COLUMNAR_DIR, f"{os.path.splitext(filename)[0]}.upload.json")
+
+
+def _chunks(stream):
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_BYTES), b""):
+        yield chunk
+
+
+def content_hash(stream) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in _chunks(stream):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def recorded_hash(csv_path: str) -> Optional[str]:
+    """Content hash stored at upload time, or None if missing or the file changed since"""
+    try:
+        with open(_record_path(csv_path), 'r') as f:
+            record = json.load(f)
+        current = source_info(csv_path)
+    except (OSError, ValueError):
+        return None
+    if record.get('size') != current['size'] or record.get('mtime_ns') != current['mtime_ns']:
+        return None
+    return record.get('hash')
+
+
+def _write_record(csv_path: str, digest: str):
+    path = _record_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda p: dump_json({**source_info(csv_path), 'hash': digest}, p))
+
+
+def _find_duplicate(digest: str, directory: str, exclude: str) -> Optional[str]:
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if filename.endswith('.csv') and os.path.abspath(path) != os.path.abspath(exclude) and recorded_hash(path) == digest:
+            return path
+    return None
+
+
+def _link_atomic(source: str, destination: str):
+    tmp_path = f"{destination}.{uuid.uuid4().hex}.tmp"
+    os.link(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def _link_duplicate(existing: str, path: str) -> bool:
+    """Make path a hard link to an identical upload, sharing its columnar copy and profile too"""
+    try:
+        _link_atomic(existing, path)
+    except OSError:
+        # e.g. a filesystem without hard links; the caller writes a copy
+        return False
+    for source, destination in zip(columnar_paths(existing) + (profile_path(existing),),
+                                   columnar_paths(path) + (profile_path(path),)):
+        if os.path.exists(source):
+            try:
+                _link_atomic(source, destination)
+            except OSError:
+                pass
+    return True
+
+
+def save_upload(file, directory: str = UPLOAD_DIR) -> Tuple[str, bool]:
+    """Store an uploaded file, returning (path, whether its content changed)
+
+    The upload is hashed first, so an identical file already under the same
+    name is not rewritten and one under another name is hard-linked instead
+    of copied. New content is streamed to a temporary file and renamed into
+    place, so readers never see a partial file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, file.name)
+    digest = content_hash(file)
+
+    if os.path.exists(path) and os.path.getsize(path) == file.size:
+        existing = recorded_hash(path)
+        if existing is None:
+            # Uploaded before hashes were recorded
+            with open(path, "rb") as f:
+                existing = content_hash(f)
+        if existing == digest:
+            _write_record(path, digest)
+            return path, False
+
+    duplicate = _find_duplicate(digest, directory, exclude=path)
+    if duplicate is None or not _link_duplicate(duplicate, path):
+        tmp_path = os.path.join(directory, f".{file.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in _chunks(file):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _write_record(path, digest)
+    return path, True
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+_pending: Dict[str, Future] = {}
+_pending_lock = threading.Lock()
+
+
+def start_ingest(csv_path: str, force: bool = False) -> Future:
+    """Convert and then profile a dataset in the background; repeated calls while it runs return the same future"""
+    key = os.path.abspath(csv_path)
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None and not future.done():
+            return future
+
+        def run():
+            try:
+                ingest_csv(csv_path, force=force)
+            except Exception as e:
+                # Datasets that can't be converted are read from the CSV
+                logger.warning(f"Could not pre-process {csv_path}, it will be read as CSV: {str(e)}")
+            return start_profiling(csv_path, force=force)
+
+        future = _executor.submit(run)
+        _pending[key] = future
+        return future
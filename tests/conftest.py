@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from Pages.data_models import InputData
+
+
+@pytest.fixture
+def make_dataset(tmp_path):
+    """Write a small CSV and return the InputData the agent would get for it"""
+    def make(name: str, frame: pd.DataFrame) -> InputData:
+        path = tmp_path / f"{name}.csv"
+        frame.to_csv(path, index=False)
+        return InputData(variable_name=name, data_path=str(path), data_description=f"{name} data")
+    return make
+
+
+@pytest.fixture
+def kernel(tmp_path, monkeypatch):
+    """A session kernel running in this process, with figures and memoized results kept under tmp_path"""
+    from Pages.utils import kernel as kernel_module
+    from Pages.utils.figure_store import FigureStore
+    from Pages.utils.result_cache import ResultCache
+
+    monkeypatch.setattr(kernel_module, "figure_store", FigureStore(str(tmp_path / "figures" / "store"), 0, 0))
+    monkeypatch.setattr(kernel_module, "result_cache", ResultCache(str(tmp_path / "results"), 0))
+    events = []
+    session = kernel_module.SessionKernel(events.append, "test-session")
+    session.events = events
+    return session
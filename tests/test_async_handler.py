@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from Pages.utils.async_handler import JobQueueFullError, JobScheduler
+
+
+def wait_for_status(scheduler, job_id, status, timeout=5):
+    deadline = time.time() + timeout
+    while scheduler.status(job_id)['status'] != status:
+        assert time.time() < deadline, scheduler.status(job_id)
+        time.sleep(0.01)
+
+
+def test_cancelled_queued_job_never_runs():
+    scheduler = JobScheduler(workers=1, max_per_user=1, queue_max=10, result_ttl=60)
+    release = threading.Event()
+    ran = []
+    blocker = scheduler.submit(release.wait, user_id="a")
+    wait_for_status(scheduler, blocker, "running")
+    queued = scheduler.submit(ran.append, 1, user_id="b")
+
+    assert scheduler.cancel(queued)
+    assert scheduler.status(queued)['status'] == "cancelled"
+
+    release.set()
+    wait_for_status(scheduler, blocker, "completed")
+    assert ran == []
+
+
+def test_running_job_is_only_cancelled_once_it_returns():
+    scheduler = JobScheduler(workers=1, max_per_user=1, queue_max=10, result_ttl=60)
+    interrupted = threading.Event()
+    release = threading.Event()
+    job_id = scheduler.submit(release.wait, user_id="a", on_cancel=interrupted.set)
+    wait_for_status(scheduler, job_id, "running")
+
+    assert not scheduler.cancel(job_id)
+    assert interrupted.is_set()
+    status = scheduler.status(job_id)
+    assert status['status'] == "running" and status['cancel_requested']
+
+    release.set()
+    wait_for_status(scheduler, job_id, "cancelled")
+
+
+def test_cancel_can_wait_for_the_running_job_to_stop():
+    scheduler = JobScheduler(workers=1, max_per_user=1, queue_max=10, result_ttl=60)
+    interrupted = threading.Event()
+    job_id = scheduler.submit(interrupted.wait, user_id="a", on_cancel=interrupted.set)
+    wait_for_status(scheduler, job_id, "running")
+
+    assert scheduler.cancel(job_id, wait=5)
+    assert scheduler.status(job_id)['status'] == "cancelled"
+    assert not scheduler.cancel(job_id)
+
+
+def test_jobs_run_in_priority_order_within_the_per_user_limit():
+    scheduler = JobScheduler(workers=2, max_per_user=1, queue_max=10, result_ttl=60)
+    release = threading.Event()
+    order = []
+    blocker = scheduler.submit(release.wait, user_id="a")
+    wait_for_status(scheduler, blocker, "running")
+    # The second worker is free, but user "a" is at its limit
+    low = scheduler.submit(order.append, "low", user_id="a", priority=1)
+    high = scheduler.submit(order.append, "high", user_id="a", priority=0)
+    time.sleep(0.1)
+    assert order == []
+    assert scheduler.status(high)['position'] == 1 and scheduler.status(low)['position'] == 2
+
+    release.set()
+    wait_for_status(scheduler, low, "completed")
+    assert order == ["high", "low"]
+
+
+def test_full_queue_rejects_new_jobs():
+    scheduler = JobScheduler(workers=1, max_per_user=1, queue_max=1, result_ttl=60)
+    release = threading.Event()
+    blocker = scheduler.submit(release.wait, user_id="a")
+    wait_for_status(scheduler, blocker, "running")
+    scheduler.submit(release.wait, user_id="a")
+
+    with pytest.raises(JobQueueFullError):
+        scheduler.submit(release.wait, user_id="a")
+    release.set()
@@ -0,0 +1,159 @@
+import builtins
+
+import pytest
+
+from Pages.utils.code_analysis import are_independent, code_object_names, is_memoizable, written_names
+
+READABLE = set(dir(builtins)) | {"pd", "np", "px", "pio", "dataset_0", "dataset_1", "plotly_figures"}
+# Per-call bindings the kernel tells are_independent to ignore
+PER_CALL = {"dataset_0", "dataset_1", "plotly_figures"}
+# Module names the kernel passes, so calls into libraries don't count as writes
+MODULES = {"pd", "px", "pio", "go", "sklearn"}
+
+
+@pytest.mark.parametrize("code", [
+    "print(dataset_0.describe())",
+    "print(dataset_0.groupby('region')['sales'].sum().sort_values())",
+    "print(dataset_0.merge(dataset_1, on='id').shape)",
+    "print([len(x) for x in (dataset_0, dataset_1)])",
+    "print(dataset_0['price'].apply(lambda v: v * 2).mean())",
+    "plotly_figures.append(px.histogram(dataset_0, x='price'))",
+])
+def test_read_only_code_is_memoizable(code):
+    assert is_memoizable(code, READABLE)
+
+
+@pytest.mark.parametrize("code", [
+    # Binds a session variable
+    "summary = dataset_0.describe()",
+    "for row in dataset_0.itertuples():\n    print(row)",
+    "def f(x):\n    return x\nprint(f(1))",
+    "import scipy\nprint(scipy.__version__)",
+    "try:\n    print(dataset_0.x)\nexcept AttributeError as err:\n    print(err)",
+    "print((n := len(dataset_0)))",
+    # Mutates shared objects
+    "dataset_0['total'] = dataset_0['a'] + dataset_0['b']",
+    "dataset_0.columns = ['a', 'b']",
+    "dataset_0.dropna(inplace=True)",
+    "pd.set_option('display.max_rows', 10)",
+    # Writes files or varies between runs
+    "dataset_0.to_csv('out.csv')",
+    "print(open('notes.txt').read())",
+    "print(dataset_0.sample(5))",
+    "print(np.random.rand(3))",
+    "print(pd.Timestamp.now())",
+    "print(pd.Timestamp('today'))",
+    "print(pd.to_datetime(dataset_0['day']) < pd.to_datetime('now'))",
+    "print(pd.Timestamp.today().date())",
+    "print(getattr(dataset_0, 'sample')(5))",
+    # Reads files that aren't part of the cache key
+    "print(pd.read_csv('uploads/other.csv').shape)",
+    "print(pd.read_parquet('uploads/other.parquet'))",
+    "print(dataset_0.merge(pd.read_excel('lookup.xlsx')))",
+    "pio.write_image(px.bar(dataset_0), 'chart.png')",
+    "print(sklearn.datasets.fetch_openml('iris'))",
+    "print(__builtins__.open('notes.txt').read())",
+    "print(dataset_0.__class__.__subclasses__())",
+    # Reads names it can't account for
+    "print(summary)",
+    "print(eval('dataset_0'))",
+    "print(locals()['dataset_0'])",
+    # Not valid Python
+    "print(",
+])
+def test_stateful_code_is_not_memoizable(code):
+    assert not is_memoizable(code, READABLE)
+
+
+def test_locals_of_nested_scopes_are_not_free_names():
+    assert is_memoizable("print(sorted({k: v for k, v in dataset_0.items()}))", READABLE)
+    # A comprehension variable leaking into top-level code would be a free name
+    assert not is_memoizable("print([k for k in dataset_0], k)", READABLE)
+
+
+def test_shadowed_library_names_are_not_readable():
+    # The kernel drops session variables from the readable set; `pd` rebound by the user is one
+    assert not is_memoizable("print(pd.DataFrame())", READABLE - {"pd"})
+
+
+def test_nondeterministic_libraries_are_not_memoizable():
+    assert not is_memoizable("print(sklearn.cluster.KMeans(3).fit(dataset_0).labels_)", READABLE | {"sklearn"})
+
+
+@pytest.mark.parametrize("codes", [
+    ["a = dataset_0['x'].sum()", "b = dataset_1['y'].mean()"],
+    ["print(dataset_0.shape)", "print(dataset_0.columns)"],
+    ["import numpy as np\na = np.log(dataset_0['x'])", "import numpy as np\nb = np.sqrt(dataset_1['y'])"],
+    ["plotly_figures.append(px.bar(dataset_0))", "plotly_figures.append(px.line(dataset_1))"],
+    ["for i in range(3):\n    print(i)", "total = dataset_1['y'].sum()"],
+])
+def test_unrelated_calls_are_independent(codes):
+    assert are_independent(codes, PER_CALL, MODULES)
+
+
+@pytest.mark.parametrize("codes", [
+    # One reads what the other writes, in either order
+    ["a = dataset_0['x'].sum()", "print(a)"],
+    ["print(a)", "a = dataset_0['x'].sum()"],
+    # Both write the same name
+    ["result = 1", "result = 2"],
+    # Augmented assignment and in-place mutation of a shared variable
+    ["counts += 1", "print(counts)"],
+    ["summary.append(1)", "print(len(summary))"],
+    ["summary['a'] = 1", "print(summary)"],
+    # Same name imported from different modules
+    ["import numpy as xp\nprint(xp)", "import cupy as xp\nprint(xp)"],
+    # Writes can't be determined
+    ["exec('a = 1')", "print(1)"],
+    ["globals()['a'] = 1", "print(1)"],
+    # Method calls may change the object they're called on
+    ["model.fit(X, y)", "print(model.predict(X))"],
+    ["fig.update_layout(title='Sales')", "fig.add_trace(go.Bar(y=[1]))"],
+    ["fig.update_layout(title='Sales')", "plotly_figures.append(fig)"],
+    ["summary.drop(columns='a', inplace=True)", "print(summary)"],
+])
+def test_conflicting_calls_are_not_independent(codes):
+    assert not are_independent(codes, PER_CALL, MODULES)
+
+
+def test_ignored_names_do_not_conflict():
+    codes = ["dataset_0['x'] = 1", "print(dataset_0)"]
+    assert not are_independent(codes)
+    assert are_independent(codes, PER_CALL)
+
+
+def test_single_call_is_independent():
+    assert are_independent(["a = 1"])
+
+
+def compiled(source: str, name: str):
+    namespace = {}
+    exec(source, namespace)
+    return namespace[name].__code__
+
+
+def test_code_object_names_include_nested_code_and_sql_strings():
+    code = compiled("def f():\n    g = lambda: dataset_1\n    return helper(dataset_0.query('t', 'SELECT * FROM dataset_2'))", "f")
+    assert {"helper", "dataset_0", "dataset_1", "dataset_2"} <= code_object_names(code)
+
+
+@pytest.mark.parametrize("source", [
+    "def f():\n    return globals()['dataset_0']",
+    "def f(i):\n    return eval(f'dataset_{i}')",
+    "def f(i):\n    return locals_map['dataset_' + str(i)]",
+])
+def test_code_object_names_are_unknown_for_runtime_lookups(source):
+    assert code_object_names(compiled(source, "f")) is None
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("model.fit(X, y)", {"model"}),
+    ("fig.update_layout(title='a').update_xaxes(range=[0, 1])", {"fig"}),
+    ("df.groupby('a')['b'].sum()", {"df"}),
+    ("df.loc[df.a > 0, 'b'] = 1", {"df"}),
+    ("summary = pd.concat([a, b])", {"summary"}),
+    ("import numpy as np\nprint(np.log(values).mean())", {"np"}),
+    ("print(len(values).bit_length(), ', '.join(names))", set()),
+])
+def test_written_names_count_method_calls_on_objects(code, expected):
+    assert written_names(code, MODULES) == expected
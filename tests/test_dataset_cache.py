@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Pages.utils.dataset_cache import DatasetCache
+
+
+def write_csv(path, rows: int) -> str:
+    pd.DataFrame({"id": range(rows), "value": [float(i) for i in range(rows)]}).to_csv(path, index=False)
+    return str(path)
+
+
+def frame_bytes(path: str) -> int:
+    return int(pd.read_csv(path).memory_usage(deep=True).sum())
+
+
+def test_unchanged_file_is_parsed_once(tmp_path):
+    path = write_csv(tmp_path / "a.csv", 10)
+    cache = DatasetCache(max_bytes=10 ** 9)
+    loads = []
+
+    def loader(p):
+        loads.append(p)
+        return pd.read_csv(p)
+
+    first = cache.get(path, loader)
+    second = cache.get(path, loader)
+
+    assert len(loads) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    assert first['size'] == second['size'] == 10
+    pd.testing.assert_frame_equal(first['data'], second['data'])
+
+
+def test_changed_file_is_reloaded_and_replaces_the_old_entry(tmp_path):
+    path = write_csv(tmp_path / "a.csv", 10)
+    cache = DatasetCache(max_bytes=10 ** 9)
+    cache.get(path, pd.read_csv)
+
+    write_csv(tmp_path / "a.csv", 20)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cache.get(path, pd.read_csv)['size'] == 20
+    assert cache.stats()['entries'] == 1
+
+
+def test_least_recently_used_entry_is_evicted_over_budget(tmp_path):
+    paths = [write_csv(tmp_path / f"{name}.csv", 100) for name in "abc"]
+    cache = DatasetCache(max_bytes=2 * frame_bytes(paths[0]))
+
+    cache.get(paths[0], pd.read_csv)
+    cache.get(paths[1], pd.read_csv)
+    cache.get(paths[0], pd.read_csv)
+    cache.get(paths[2], pd.read_csv)
+
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1
+    assert stats['current_bytes'] <= stats['max_bytes']
+    # b was used least recently, so a and c are still served from memory
+    cache.get(paths[0], pd.read_csv)
+    cache.get(paths[2], pd.read_csv)
+    assert cache.stats()['misses'] == 3
+
+
+def test_an_entry_larger_than_the_budget_is_still_kept(tmp_path):
+    path = write_csv(tmp_path / "a.csv", 100)
+    cache = DatasetCache(max_bytes=1)
+    cache.get(path, pd.read_csv)
+    cache.get(path, pd.read_csv)
+    assert cache.stats()['hits'] == 1
+
+
+def test_limit_to_lowers_the_budget_and_evicts(tmp_path):
+    paths = [write_csv(tmp_path / f"{name}.csv", 100) for name in "ab"]
+    cache = DatasetCache(max_bytes=10 ** 9)
+    for path in paths:
+        cache.get(path, pd.read_csv)
+
+    cache.limit_to(frame_bytes(paths[0]))
+    assert cache.stats()['entries'] == 1 and cache.stats()['max_bytes'] == frame_bytes(paths[0])
+    # Never raises the budget
+    cache.limit_to(10 ** 12)
+    assert cache.stats()['max_bytes'] == frame_bytes(paths[0])
+
+
+@pytest.mark.skipif(int(pd.__version__.split(".")[0]) < 3, reason="workers turn copy-on-write on under pandas 2")
+def test_in_place_edits_do_not_reach_the_cached_frame(tmp_path):
+    path = write_csv(tmp_path / "a.csv", 10)
+    cache = DatasetCache(max_bytes=10 ** 9)
+
+    df = cache.get(path, pd.read_csv)['data']
+    df.loc[0, "value"] = -1.0
+    df["extra"] = 1
+    df.drop(columns="id", inplace=True)
+
+    fresh = cache.get(path, pd.read_csv)['data']
+    assert list(fresh.columns) == ["id", "value"]
+    assert fresh.loc[0, "value"] == 0.0
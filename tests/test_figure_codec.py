@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+from Pages.utils.figure_codec import (
+    decode_figure, downsample_figure, encode_figure, grid_indices, minmax_indices)
+
+
+def trace_array(figure: go.Figure, index: int, key: str) -> np.ndarray:
+    return np.asarray(getattr(figure.data[index], key))
+
+
+def test_round_trip_keeps_arrays_and_layout():
+    rng = np.random.default_rng(1)
+    x = np.arange(5_000, dtype="int64")
+    y = rng.normal(size=5_000)
+    figure = go.Figure([go.Scatter(x=x, y=y, mode="lines", name="signal"),
+                        go.Bar(x=["a", "b", "c"], y=[1, 2, 3], name="small")],
+                       layout={"title": {"text": "Round trip"}})
+
+    restored = decode_figure(encode_figure(figure))
+
+    np.testing.assert_array_equal(trace_array(restored, 0, "x"), x)
+    np.testing.assert_array_equal(trace_array(restored, 0, "y"), y)
+    assert list(restored.data[1].x) == ["a", "b", "c"]
+    assert restored.data[0].name == "signal"
+    assert restored.layout.title.text == "Round trip"
+
+
+def test_round_trip_keeps_datetimes():
+    dates = pd.date_range("2024-01-01", periods=500, freq="h")
+    figure = go.Figure(go.Scatter(x=dates, y=np.arange(500)))
+    restored = decode_figure(encode_figure(figure))
+    np.testing.assert_array_equal(pd.to_datetime(trace_array(restored, 0, "x")), dates)
+
+
+def test_decode_accepts_file_objects():
+    figure = go.Figure(go.Scatter(y=np.arange(1_000)))
+    restored = decode_figure(io.BytesIO(encode_figure(figure)))
+    np.testing.assert_array_equal(trace_array(restored, 0, "y"), np.arange(1_000))
+
+
+def test_minmax_indices_keep_extremes_and_endpoints():
+    rng = np.random.default_rng(2)
+    y = rng.normal(size=10_000)
+    y[1234], y[8765] = 50.0, -50.0
+    buckets = 100
+
+    kept = minmax_indices(y, buckets)
+
+    assert kept[0] == 0 and kept[-1] == len(y) - 1
+    assert np.all(np.diff(kept) > 0)
+    assert len(kept) <= 2 * buckets + 2
+    assert {1234, 8765} <= set(kept)
+    # Each bucket's minimum and maximum survive
+    for bucket in np.array_split(np.arange(len(y)), buckets):
+        assert bucket[np.argmin(y[bucket])] in kept and bucket[np.argmax(y[bucket])] in kept
+
+
+def test_grid_indices_keep_one_point_per_occupied_cell():
+    x = np.array([0.0, 0.1, 0.2, 9.9, 10.0, np.nan, 5.0])
+    y = np.array([0.0, 0.1, 0.0, 9.9, 10.0, 1.0, np.nan])
+
+    kept = grid_indices(x, y, cells=2)
+
+    # Points 0-2 share the bottom-left cell, 3-4 the top-right one; NaN points are skipped
+    assert list(kept) == [0, 3]
+
+
+def test_grid_indices_cover_every_cluster():
+    rng = np.random.default_rng(3)
+    centers = [(0, 0), (0, 100), (100, 0), (100, 100)]
+    points = np.concatenate([rng.normal(c, 1, size=(2_000, 2)) for c in centers])
+
+    kept = grid_indices(points[:, 0], points[:, 1], cells=50)
+
+    assert len(kept) < len(points) // 10
+    clusters = set(map(tuple, np.round(points[kept] / 100) * 100))
+    assert clusters == {(float(a), float(b)) for a, b in centers}
+
+
+@pytest.mark.parametrize("mode", ["lines", "markers"])
+def test_downsample_figure_respects_the_point_limit(mode):
+    n = 50_000
+    figure = go.Figure(go.Scattergl(x=np.arange(n), y=np.sin(np.arange(n) / 100), mode=mode))
+
+    reduced, notes = downsample_figure(figure, max_points=1_000)
+
+    assert len(notes) == 1 and "50,000 points reduced" in notes[0]
+    assert len(reduced.data[0].x) == len(reduced.data[0].y) <= 1_000
+
+
+def test_small_figures_are_not_downsampled():
+    figure = go.Figure(go.Scatter(y=np.arange(100)))
+    reduced, notes = downsample_figure(figure, max_points=1_000)
+    assert reduced is figure and notes == []
@@ -0,0 +1,51 @@
+import os
+
+import plotly.graph_objects as go
+import pytest
+
+from Pages.utils.figure_store import FigureStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FigureStore(str(tmp_path / "figures" / "store"), retention_days=0, max_bytes=0)
+
+
+def figure():
+    return go.Figure(go.Bar(x=["a", "b"], y=[1, 2]))
+
+
+def test_saved_figures_load_back_and_are_indexed_by_session(store):
+    figure_id = store.save(figure(), "s1")
+    assert store.exists(figure_id)
+    assert list(store.load(figure_id).data[0].y) == [1, 2]
+    assert store.session_figures("s1") == [figure_id]
+
+
+def test_copies_survive_the_original_session(store):
+    original = store.save_all([figure(), figure()], "s1")
+
+    copies = store.copy_to_session(original, "s2")
+
+    assert len(copies) == 2 and not set(copies) & set(original)
+    assert store.session_figures("s2") == copies
+    store.delete_session("s1")
+    assert not any(store.exists(f) for f in original)
+    assert all(store.exists(f) for f in copies)
+    assert list(store.load(copies[0]).data[0].x) == ["a", "b"]
+
+
+def test_copying_a_deleted_figure_fails_without_leaving_copies(store):
+    kept, deleted = store.save_all([figure(), figure()], "s1")
+    os.remove(store.path(deleted))
+
+    assert store.copy_to_session([kept, deleted], "s2") is None
+    assert store.session_figures("s2") == []
+    assert sorted(os.listdir(store.directory)) == [kept]
+
+
+def test_gc_keeps_the_newest_figures_within_budget(store):
+    ids = store.save_all([figure() for _ in range(3)], "s1")
+    store.max_bytes = os.path.getsize(store.path(ids[-1]))
+    assert store.gc() == 2
+    assert [store.exists(f) for f in ids] == [False, False, True]
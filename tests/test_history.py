@@ -0,0 +1,67 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from Pages.graph.history import OLD_TOOL_OUTPUT_CHARS, group_messages, message_tokens, trim_history
+
+
+def tool_turn(question: str, call_id: str, output: str = "ok"):
+    return [
+        HumanMessage(content=question),
+        AIMessage(content="", tool_calls=[{"name": "complete_python_task", "args": {"python_code": "print(1)"},
+                                           "id": call_id}]),
+        ToolMessage(content=output, name="complete_python_task", tool_call_id=call_id),
+        AIMessage(content=f"answer to {question}"),
+    ]
+
+
+def test_tool_results_are_grouped_with_their_call():
+    messages = tool_turn("q1", "c1")
+    groups = group_messages(messages)
+    assert [len(g) for g in groups] == [1, 2, 1]
+    assert isinstance(groups[1][0], AIMessage) and isinstance(groups[1][1], ToolMessage)
+
+
+def test_parallel_tool_results_share_one_group():
+    call = AIMessage(content="", tool_calls=[{"name": "t", "args": {}, "id": "a"}, {"name": "t", "args": {}, "id": "b"}])
+    results = [ToolMessage(content="x", tool_call_id="a"), ToolMessage(content="y", tool_call_id="b")]
+    assert group_messages([call] + results) == [[call] + results]
+
+
+def test_orphaned_tool_results_are_dropped():
+    messages = [ToolMessage(content="stale", tool_call_id="gone"), HumanMessage(content="q")]
+    assert group_messages(messages) == [[messages[1]]]
+
+
+def test_history_within_budget_is_unchanged():
+    messages = tool_turn("q1", "c1") + tool_turn("q2", "c2")
+    assert trim_history(messages, budget=100_000) == messages
+
+
+def test_current_turn_is_always_kept():
+    messages = tool_turn("q1", "c1") + tool_turn("q2", "c2", output="x" * 10_000)
+    trimmed = trim_history(messages, budget=10)
+    assert trimmed[-4:] == messages[-4:]
+    assert "4 earlier messages were omitted" in trimmed[0].content
+
+
+def test_oldest_groups_are_dropped_without_splitting_tool_calls():
+    messages = tool_turn("q1", "c1") + tool_turn("q2", "c2") + tool_turn("q3", "c3")
+    # Room for the current turn plus the final answer and tool call of the previous one
+    current = messages[-4:]
+    budget = sum(message_tokens(m) for m in current + messages[5:8])
+    trimmed = trim_history(messages, budget=budget)
+    assert isinstance(trimmed[0], HumanMessage) and "omitted" in trimmed[0].content
+    assert trimmed[1:] == messages[5:]
+    # Every tool result still follows the call that produced it
+    for i, message in enumerate(trimmed):
+        if isinstance(message, ToolMessage):
+            assert isinstance(trimmed[i - 1], AIMessage) and trimmed[i - 1].tool_calls
+
+
+def test_earlier_tool_outputs_are_truncated():
+    messages = tool_turn("q1", "c1", output="x" * 10 * OLD_TOOL_OUTPUT_CHARS) + tool_turn("q2", "c2")
+    trimmed = trim_history(messages, budget=100_000)
+    old_output = trimmed[2]
+    assert isinstance(old_output, ToolMessage) and old_output.tool_call_id == "c1"
+    assert len(old_output.content) < 2 * OLD_TOOL_OUTPUT_CHARS
+    assert "characters of earlier output omitted" in old_output.content
+    assert trimmed[4:] == messages[4:]
@@ -0,0 +1,122 @@
+import pandas as pd
+import pytest
+
+from Pages.utils import ingest
+from Pages.utils.ingest import ingest_csv, load_dataset, schema_metadata
+
+pytest.importorskip("pyarrow")
+
+CSV = """day,timestamp,clock,count,price,label,flag
+2024-01-01,2024-01-01 10:00:00,10:00:00,1,1.5,a,true
+2024-01-02,,11:30:00,,2.5,,false
+2024-01-03,2024-01-03 12:15:00,12:00:00,3,,c,true
+"""
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_text(CSV)
+    return str(path)
+
+
+def test_arrow_copy_loads_like_read_csv(csv_path):
+    schema = ingest_csv(csv_path)
+    assert schema['format'] == "arrow"
+    pd.testing.assert_frame_equal(load_dataset(csv_path), pd.read_csv(csv_path))
+
+
+def test_csv_fallback_loads_the_same_dtypes(csv_path, monkeypatch):
+    arrow_dtypes = load_dataset(csv_path).dtypes
+    monkeypatch.setattr(ingest, "feather", None)
+    schema = ingest_csv(csv_path, force=True)
+    assert schema['format'] is None
+    pd.testing.assert_series_equal(load_dataset(csv_path).dtypes, arrow_dtypes)
+
+
+def test_dates_stay_text_and_parse_with_to_datetime(csv_path):
+    df = load_dataset(csv_path)
+    assert df["day"].tolist() == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert pd.to_datetime(df["day"]).dt.year.tolist() == [2024, 2024, 2024]
+    assert pd.to_datetime(df["timestamp"]).isna().tolist() == [False, True, False]
+
+
+def test_schema_dtypes_match_the_loaded_frame(csv_path):
+    types = schema_metadata(ingest_csv(csv_path))['types']
+    assert types == {col: str(dtype) for col, dtype in load_dataset(csv_path).dtypes.items()}
+
+
+def test_types_guessed_from_the_first_block_are_widened(tmp_path, monkeypatch):
+    # Small blocks, so later rows disagree with the types inferred from the first one
+    monkeypatch.setattr(ingest, "INGEST_BLOCK_BYTES", 64)
+    rows = [f"{i},{i},x{i}" for i in range(50)] + ["50,0.5,51", "51,unknown,52"]
+    path = tmp_path / "wide.csv"
+    path.write_text("id,amount,code\n" + "\n".join(rows) + "\n")
+
+    schema = ingest_csv(str(path))
+
+    assert schema['format'] == "arrow" and schema['rows'] == 52
+    df = load_dataset(str(path))
+    assert df["amount"].tolist()[-2:] == ["0.5", "unknown"]
+    pd.testing.assert_frame_equal(df, pd.read_csv(path))
+
+
+def test_loaded_frames_are_writable(csv_path):
+    df = load_dataset(csv_path)
+    df.loc[0, "price"] = 10.0
+    df["count"] = df["count"].fillna(0)
+    assert df.loc[0, "price"] == 10.0 and df["count"].tolist() == [1.0, 0.0, 3.0]
+
+
+def test_ingest_is_reused_until_the_csv_changes(csv_path):
+    first = ingest_csv(csv_path)
+    assert ingest_csv(csv_path) == first
+    with open(csv_path, "a") as f:
+        f.write("2024-01-04,,,4,4.5,d,false\n")
+    assert ingest_csv(csv_path)['rows'] == 4
+
+
+def test_write_atomic_uses_a_temporary_file_per_writer(tmp_path):
+    target = tmp_path / "out.txt"
+    seen = []
+
+    def write(path):
+        seen.append(path)
+        with open(path, "w") as f:
+            f.write("done")
+
+    ingest.write_atomic(str(target), write)
+    ingest.write_atomic(str(target), write)
+
+    assert seen[0] != seen[1] and all(p.endswith(".tmp") for p in seen)
+    assert target.read_text() == "done"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.txt"]
+
+
+def test_failed_write_removes_only_its_own_temporary_file(tmp_path):
+    target = tmp_path / "out.txt"
+    other_writer = tmp_path / "out.txt.tmp"
+    other_writer.write_text("in progress")
+
+    def fail(path):
+        with open(path, "w") as f:
+            f.write("partial")
+        raise ValueError("conversion failed")
+
+    with pytest.raises(ValueError):
+        ingest.write_atomic(str(target), fail)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.txt.tmp"]
+    assert not target.exists()
+
+
+def test_failed_arrow_conversion_falls_back_to_csv(tmp_path, monkeypatch):
+    def fail(*args):
+        raise ValueError("unsupported")
+
+    monkeypatch.setattr(ingest, "_stream_to_arrow", fail)
+    path = tmp_path / "data.csv"
+    path.write_text(CSV)
+
+    assert ingest_csv(str(path))['format'] is None
+    assert not [p for p in (tmp_path / ingest.COLUMNAR_DIR).iterdir() if p.name.endswith(".tmp")]
@@ -0,0 +1,133 @@
+import pandas as pd
+import pytest
+
+SALES = pd.DataFrame({"region": ["north", "south", "north"], "amount": [10, 20, 30]})
+COSTS = pd.DataFrame({"region": ["north", "south"], "cost": [5, 7]})
+
+
+@pytest.fixture
+def datasets(make_dataset):
+    return [make_dataset("sales", SALES), make_dataset("costs", COSTS)]
+
+
+def test_only_referenced_datasets_are_bound(kernel, datasets):
+    result = kernel.execute("print(type(dataset_0).__name__, 'dataset_1' in globals())", datasets[:1])
+    assert result['status'] == 'ok'
+    assert result['output'].split() == ["DataFrame", "False"]
+
+
+def test_datasets_are_not_kept_between_calls(kernel, datasets):
+    kernel.execute("total = dataset_0['amount'].sum()", datasets)
+    assert "dataset_0" not in kernel.namespace
+    assert kernel.namespace["total"] == 60
+
+
+def test_functions_from_earlier_calls_get_their_datasets(kernel, datasets):
+    assert kernel.execute("def total():\n    return dataset_1['cost'].sum()", datasets)['status'] == 'ok'
+
+    result = kernel.execute("print(total())", datasets)
+
+    assert result['status'] == 'ok', result.get('error')
+    assert result['output'].strip() == "12"
+
+
+def test_datasets_reached_through_nested_session_code_are_bound(kernel, datasets):
+    kernel.execute(
+        "def by_region():\n    return dataset_0.groupby('region')['amount'].sum()\n"
+        "class Report:\n    def north(self):\n        return by_region()['north']\n"
+        "report = Report()", datasets)
+
+    result = kernel.execute("print(report.north())", datasets)
+
+    assert result['status'] == 'ok', result.get('error')
+    assert result['output'].strip() == "40"
+
+
+def test_session_code_with_dynamic_lookups_gets_every_dataset(kernel, datasets):
+    kernel.execute("def pick(i):\n    return globals()[f'dataset_{i}']", datasets)
+    result = kernel.execute("print(len(pick(1)))", datasets)
+    assert result['status'] == 'ok', result.get('error')
+    assert result['output'].strip() == "2"
+
+
+def test_errors_are_reported_and_leave_no_datasets_behind(kernel, datasets):
+    result = kernel.execute("dataset_0['missing']", datasets)
+    assert result['status'] == 'error' and result['error_type'] == 'KeyError'
+    assert "dataset_0" not in kernel.namespace
+
+
+def test_variables_report_the_session_state(kernel, datasets):
+    result = kernel.execute("summary = dataset_0.describe()\ncount = len(dataset_1)", datasets)
+    assert result['variables'] == {'summary': 'DataFrame', 'count': 'int', 'plotly_figures': 'list', '_metadata': 'dict'}
+
+
+def test_memoized_figures_outlive_the_session_that_made_them(kernel, datasets, monkeypatch, tmp_path):
+    from Pages.utils import kernel as kernel_module
+    from Pages.utils.result_cache import ResultCache
+
+    monkeypatch.setattr(kernel_module, "result_cache", ResultCache(str(tmp_path / "memo"), 10 * 1024 * 1024))
+    code = "plotly_figures.append(px.bar(dataset_0, x='region', y='amount'))\nprint('plotted')"
+    first = kernel.execute(code, datasets)
+    other = kernel_module.SessionKernel(lambda event: None, "other-session")
+
+    replayed = other.execute(code, datasets)
+
+    assert replayed.get('cached') and replayed['output'] == first['output']
+    assert len(replayed['image_files']) == 1 and replayed['image_files'] != first['image_files']
+    kernel_module.figure_store.delete_session("test-session")
+    assert kernel_module.figure_store.exists(replayed['image_files'][0])
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    from Pages.utils import kernel as kernel_module
+    monkeypatch.setattr(kernel_module, "PARALLEL_TOOL_CALLS", 4)
+
+
+def calls(*codes):
+    return [{'python_code': code, 'tool_call_id': f"call-{i}"} for i, code in enumerate(codes)]
+
+
+def test_independent_calls_run_concurrently_and_merge_their_variables(kernel, datasets, parallel):
+    batch = kernel.execute_batch(calls(
+        "import time\ntime.sleep(0.5)\ntotal = dataset_0['amount'].sum()",
+        "import time\ntime.sleep(0.5)\ncost = dataset_1['cost'].sum()"), datasets)
+
+    assert [r['status'] for r in batch['results']] == ['ok', 'ok']
+    assert kernel.namespace['total'] == 60 and kernel.namespace['cost'] == 12
+    assert "dataset_0" not in kernel.namespace
+
+
+def test_dependent_calls_run_in_order(kernel, datasets, parallel):
+    batch = kernel.execute_batch(calls("x = len(dataset_0)", "print(x * 2)"), datasets)
+    assert batch['results'][1]['output'].strip() == "6"
+
+
+def test_calls_to_session_functions_keep_their_figures(kernel, datasets, parallel):
+    kernel.execute("def plot(df):\n    plotly_figures.append(px.bar(df, x='region', y='amount'))", datasets)
+
+    batch = kernel.execute_batch(calls("plot(dataset_0)", "n = len(dataset_1)"), datasets)
+
+    assert [r['status'] for r in batch['results']] == ['ok', 'ok']
+    assert len(batch['results'][0]['image_files']) == 1
+    assert kernel.namespace['n'] == 2
+
+
+def test_mutating_calls_on_a_shared_object_run_in_order(kernel, datasets, parallel):
+    kernel.execute("from sklearn.linear_model import LinearRegression\nmodel = LinearRegression()", datasets)
+
+    batch = kernel.execute_batch(calls(
+        "model.fit(dataset_0[['amount']], dataset_0['amount'])",
+        "print(round(float(model.predict(pd.DataFrame({'amount': [5]}))[0]), 3))"), datasets)
+
+    assert batch['results'][1]['status'] == 'ok', batch['results'][1].get('error')
+    assert batch['results'][1]['output'].strip() == "5.0"
+
+
+def test_method_calls_mark_objects_for_the_next_snapshot(kernel, datasets):
+    kernel.execute("from sklearn.linear_model import LinearRegression\nmodel = LinearRegression()", datasets)
+    kernel.unsaved = set()
+
+    kernel.execute("model.fit(dataset_0[['amount']], dataset_0['amount'])", datasets)
+
+    assert "model" in kernel.unsaved
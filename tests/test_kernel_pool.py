@@ -0,0 +1,176 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from Pages.utils import kernel_pool as pool_module
+from Pages.utils.kernel_pool import KernelCrashedError, KernelHandle, KernelLimitError, KernelPool, KernelPoolFullError
+
+
+class FakeHandle:
+    """Stands in for a worker process: records requests and can hold them until released"""
+
+    log = []
+    hold = {}
+    snapshots = set()
+
+    def __init__(self, session_id, context):
+        self.session_id = session_id
+        self.busy = False
+        self.leases = 0
+        self.last_used = time.time()
+        self.closed = False
+        self.restore_pending = session_id in self.snapshots
+
+    def is_alive(self):
+        return not self.closed
+
+    def request(self, op, on_event=None, **args):
+        gate = self.hold.get((self.session_id, op))
+        if gate is not None:
+            gate['started'].set()
+            gate['release'].wait(5)
+        if self.closed:
+            raise KernelCrashedError(f"worker for {self.session_id} was shut down")
+        if op == "snapshot":
+            self.snapshots.add(self.session_id)
+        self.log.append((self.session_id, op))
+        self.last_used = time.time()
+        return {'status': 'ok'}
+
+    def shutdown(self):
+        self.closed = True
+
+
+def hold(session_id, op):
+    gate = {'started': threading.Event(), 'release': threading.Event()}
+    FakeHandle.hold[(session_id, op)] = gate
+    return gate
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeHandle.log, FakeHandle.hold, FakeHandle.snapshots = [], {}, set()
+    monkeypatch.setattr(pool_module, "KernelHandle", FakeHandle)
+    monkeypatch.setattr(pool_module, "SESSION_SNAPSHOTS", True)
+    monkeypatch.setattr(pool_module, "has_snapshot", lambda session_id: session_id in FakeHandle.snapshots)
+    monkeypatch.setattr(pool_module, "snapshot_dir", lambda session_id: session_id)
+    pool = KernelPool(max_workers=1, idle_timeout=3600)
+    monkeypatch.setattr(pool, "_start_reaper", lambda: None)
+    return pool
+
+
+def test_a_leased_worker_is_not_evicted(pool):
+    gate = hold("a", "execute")
+    thread = threading.Thread(target=pool.request, args=("a", "execute"))
+    thread.start()
+    # The request has its worker but hasn't marked it busy (as between get and handle.request)
+    assert gate['started'].wait(5)
+
+    with pytest.raises(KernelPoolFullError):
+        pool.request("b", "execute")
+
+    gate['release'].set()
+    thread.join()
+    assert ("a", "execute") in FakeHandle.log
+    assert pool.workers["a"].leases == 0
+
+
+def test_idle_worker_is_evicted_with_a_snapshot(pool):
+    pool.request("a", "execute")
+    pool.request("b", "execute")
+    deadline = time.time() + 5
+    while "a" in pool.paging_out and time.time() < deadline:
+        time.sleep(0.01)
+    assert ("a", "snapshot") in FakeHandle.log
+    assert list(pool.workers) == ["b"]
+
+
+def test_restore_waits_for_the_previous_workers_snapshot(pool):
+    pool.request("a", "execute")
+    gate = hold("a", "snapshot")
+    # b evicts a, whose snapshot is held half-written
+    pool.request("b", "execute")
+    assert gate['started'].wait(5)
+
+    threading.Timer(0.2, gate['release'].set).start()
+    # a comes back before its old worker has finished paging out
+    pool.request("a", "execute")
+
+    a_ops = [op for session_id, op in FakeHandle.log if session_id == "a"]
+    assert a_ops == ["execute", "snapshot", "restore", "execute"]
+
+
+def test_reaping_skips_leased_workers(pool):
+    pool.idle_timeout = 0
+    gate = hold("a", "execute")
+    thread = threading.Thread(target=pool.request, args=("a", "execute"))
+    thread.start()
+    assert gate['started'].wait(5)
+
+    pool.reap_idle()
+    assert "a" in pool.workers
+
+    gate['release'].set()
+    thread.join()
+    pool.reap_idle()
+    assert "a" not in pool.workers
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    """A real worker process, storing its figures and nothing else under tmp_path"""
+    monkeypatch.setenv("FIGURE_STORE_DIR", str(tmp_path / "figures"))
+    monkeypatch.setenv("RESULT_CACHE_MAX_MB", "0")
+    monkeypatch.setattr(pool_module, "SESSION_SNAPSHOTS", False)
+    handle = KernelHandle("limits", multiprocessing.get_context("spawn"))
+    # Wait for the worker to start, so limits apply to the code rather than its imports
+    handle.request("variables")
+    yield handle
+    handle.shutdown()
+
+
+def run(handle, code):
+    return handle.request("execute", python_code=code, input_data=[])
+
+
+def cancel_when_busy(handle):
+    def cancel():
+        while not handle.busy:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        handle.cancel()
+    threading.Thread(target=cancel, daemon=True).start()
+
+
+def test_cancelled_code_stops_and_keeps_the_session(worker):
+    run(worker, "x = 1")
+    cancel_when_busy(worker)
+
+    with pytest.raises(KernelLimitError) as error:
+        run(worker, "while True:\n    x += 1")
+
+    assert (error.value.reason, error.value.worker_lost) == ("cancelled", False)
+    assert worker.is_alive()
+    assert int(run(worker, "print(x)")['output']) > 1
+
+
+def test_code_over_the_time_limit_is_interrupted(worker, monkeypatch):
+    monkeypatch.setattr(pool_module, "EXECUTION_TIMEOUT", 0.5)
+
+    with pytest.raises(KernelLimitError) as error:
+        run(worker, "import time\nwhile True:\n    time.sleep(0.01)")
+
+    assert (error.value.reason, error.value.worker_lost) == ("timeout", False)
+
+
+def test_code_that_ignores_the_interrupt_is_killed(worker, monkeypatch):
+    monkeypatch.setattr(pool_module, "INTERRUPT_GRACE_PERIOD", 0.5)
+    cancel_when_busy(worker)
+
+    with pytest.raises(KernelLimitError) as error:
+        run(worker, "import time\nwhile True:\n    try:\n        time.sleep(0.01)\n    except BaseException:\n        pass")
+
+    assert (error.value.reason, error.value.worker_lost) == ("cancelled", True)
+    assert not worker.is_alive()
@@ -0,0 +1,91 @@
+import os
+
+import pandas as pd
+
+from Pages.utils.profiler import build_profile, compact_profile, join_key_candidates, profile_dataset, profile_path
+
+
+def column(profile: dict, name: str) -> dict:
+    return next(c for c in profile['columns'] if c['name'] == name)
+
+
+def key_profile(rows: int, **columns) -> dict:
+    # columns map names to (dtype, distinct, nulls)
+    return {'rows': rows, 'columns': [{'name': name, 'dtype': dtype, 'distinct': distinct, 'nulls': nulls}
+                                      for name, (dtype, distinct, nulls) in columns.items()]}
+
+
+def test_build_profile_describes_each_column():
+    df = pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'amount': [10.0, 20.0, None, 40.0],
+        'city': ["Oslo", "Oslo", "Rome", None],
+        'day': pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]),
+    })
+
+    profile = build_profile(df)
+
+    assert profile['rows'] == 4
+    amount = column(profile, 'amount')
+    assert (amount['nulls'], amount['distinct'], amount['min'], amount['max']) == (1, 3, 10.0, 40.0)
+    assert amount['quantiles']['0.5'] == 20.0 and not amount['key_candidate']
+    assert column(profile, 'city')['top_values'] == [["Oslo", 2], ["Rome", 1]]
+    assert str(column(profile, 'day')['min']).startswith("2024-01-01")
+    assert column(profile, 'id')['key_candidate']
+
+
+def test_compact_profile_has_one_line_per_column():
+    profile = build_profile(pd.DataFrame({'id': [1, 2], 'city': ["Oslo", "Rome"]}))
+
+    lines = compact_profile(profile, max_columns=1).splitlines()
+
+    assert lines[0] == "Rows: 2"
+    assert lines[1].startswith("- id: int64") and lines[1].endswith("key candidate")
+    assert lines[2] == "- ... 1 more columns"
+
+
+def test_entity_id_joins_the_unique_id_of_the_named_dataset():
+    profiles = {
+        'dataset_0': key_profile(100, id=("int64", 100, 0), card_id=("float64", 20, 5)),
+        'dataset_1': key_profile(20, id=("int64", 20, 0)),
+    }
+
+    assert join_key_candidates(profiles, names={'dataset_1': "cards_data"}) == \
+        ["dataset_0.card_id = dataset_1.id"]
+    # Without a name or description linking card_id to dataset_1, its id is unrelated
+    assert join_key_candidates(profiles, names={'dataset_1': "users"}) == []
+    assert join_key_candidates(profiles, names={'dataset_1': "users"},
+                               descriptions={'dataset_1': "One row per card, referenced by card_id"}) == \
+        ["dataset_0.card_id = dataset_1.id"]
+
+
+def test_foreign_keys_only_join_a_unique_side():
+    profiles = {
+        'dataset_0': key_profile(100, client_id=("int64", 30, 0)),
+        'dataset_1': key_profile(50, client_id=("int64", 30, 0)),
+        'dataset_2': key_profile(30, client_id=("int64", 30, 0)),
+    }
+
+    assert join_key_candidates(profiles) == ["dataset_0.client_id = dataset_2.client_id",
+                                             "dataset_1.client_id = dataset_2.client_id"]
+
+
+def test_ids_and_incompatible_types_are_not_paired():
+    profiles = {
+        'dataset_0': key_profile(10, id=("int64", 10, 0), order_key=("object", 10, 0)),
+        'dataset_1': key_profile(10, id=("int64", 10, 0), order_key=("int64", 10, 0)),
+    }
+
+    assert join_key_candidates(profiles) == []
+
+
+def test_profile_is_stored_once_per_file_version(tmp_path):
+    csv_path = tmp_path / "sales.csv"
+    csv_path.write_text("id,amount\n1,10\n2,20\n")
+
+    first = profile_dataset(str(csv_path))
+    assert os.path.exists(profile_path(str(csv_path)))
+    assert profile_dataset(str(csv_path)) == first
+
+    csv_path.write_text("id,amount\n1,10\n2,20\n3,30\n")
+    assert profile_dataset(str(csv_path))['rows'] == 3
@@ -0,0 +1,68 @@
+import time
+
+import pandas as pd
+import pytest
+from langchain_core.messages import AIMessage, ToolMessage
+
+from Pages.utils.response_cache import ResponseCache, cache_scope, cacheable_answer, normalize_query
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "responses.sqlite"), ttl=3600, max_entries=3)
+
+
+def test_trivially_different_phrasings_share_an_entry(cache):
+    cache.put("What is the average price?", "scope", {'answer': 1})
+    assert normalize_query("  what is the AVERAGE price 🤔") == normalize_query("What is the average price?")
+    assert cache.get("what is the  average price", "scope") == {'answer': 1}
+
+
+def test_entries_are_scoped(cache):
+    cache.put("average price", "scope-a", {'answer': 1})
+    assert cache.get("average price", "scope-b") is None
+
+
+def test_scope_changes_with_the_data_model_and_conversation(make_dataset):
+    dataset = make_dataset("sales", pd.DataFrame({"price": [1, 2]}))
+    scope = cache_scope([dataset], "gpt-4o", [])
+    assert cache_scope([dataset], "gpt-4o", []) == scope
+    assert cache_scope([dataset], "gpt-4o-mini", []) != scope
+    assert cache_scope([dataset], "gpt-4o", ["plot it"]) != scope
+
+    pd.DataFrame({"price": [1, 2, 3]}).to_csv(dataset.data_path, index=False)
+    assert cache_scope([dataset], "gpt-4o", []) != scope
+
+
+def test_expired_entries_are_not_returned(cache):
+    cache.ttl = 0
+    cache.put("average price", "scope", {'answer': 1})
+    time.sleep(0.01)
+    assert cache.get("average price", "scope") is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for question in ["q1", "q2", "q3"]:
+        cache.put(question, "scope", {'answer': question})
+    cache.get("q1", "scope")
+    cache.put("q4", "scope", {'answer': "q4"})
+
+    assert cache.get("q2", "scope") is None
+    assert [cache.get(q, "scope")['answer'] for q in ["q1", "q3", "q4"]] == ["q1", "q3", "q4"]
+
+
+def answer(status: str) -> list:
+    return [
+        AIMessage(content="", tool_calls=[{"name": "complete_python_task", "args": {"python_code": "1"}, "id": "c1"}]),
+        ToolMessage(content="output", tool_call_id="c1", status=status),
+        AIMessage(content="The average is 3."),
+    ]
+
+
+def test_answers_with_completed_tool_calls_are_cacheable():
+    assert cacheable_answer(answer("success"))
+    assert cacheable_answer([AIMessage(content="No tools needed.")])
+
+
+def test_answers_with_stopped_or_lost_executions_are_not_cacheable():
+    assert not cacheable_answer(answer("error"))
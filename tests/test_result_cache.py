@@ -0,0 +1,63 @@
+import os
+
+from Pages.utils.result_cache import ResultCache, result_key
+
+
+def write_csv(path, text: str) -> str:
+    path.write_text(text)
+    return str(path)
+
+
+def test_key_ignores_comments_and_formatting(tmp_path):
+    datasets = [("dataset_0", write_csv(tmp_path / "a.csv", "x\n1\n"), "pandas")]
+
+    assert result_key("print(dataset_0.x.sum())", datasets) == \
+        result_key("# total\nprint( dataset_0.x.sum() )\n", datasets)
+    assert result_key("print(dataset_0.x.sum())", datasets) != result_key("print(dataset_0.x.mean())", datasets)
+
+
+def test_key_changes_with_the_dataset_file_and_engine(tmp_path):
+    path = write_csv(tmp_path / "a.csv", "x\n1\n")
+    before = result_key("print(dataset_0.x.sum())", [("dataset_0", path, "pandas")])
+
+    assert result_key("print(dataset_0.x.sum())", [("dataset_0", path, "duckdb")]) != before
+    write_csv(tmp_path / "a.csv", "x\n1\n2\n")
+    assert result_key("print(dataset_0.x.sum())", [("dataset_0", path, "pandas")]) != before
+
+
+def test_round_trip_and_stats(tmp_path):
+    cache = ResultCache(str(tmp_path / "results"), max_bytes=10 ** 6)
+
+    assert cache.get("k") is None
+    cache.put("k", {'output': "42", 'figures': []})
+
+    assert cache.get("k") == {'output': "42", 'figures': []}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_least_recently_used_results_are_evicted_over_budget(tmp_path):
+    value = {'output': "x" * 1000}
+    cache = ResultCache(str(tmp_path), max_bytes=2500)
+    cache.put("a", value)
+    cache.put("b", value)
+    # "a" was stored first, but reading it makes "b" the least recently used
+    os.utime(cache._path("a"), ns=(10 ** 18, 10 ** 18))
+    os.utime(cache._path("b"), ns=(15 * 10 ** 17, 15 * 10 ** 17))
+    cache.get("a")
+    cache.put("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value and cache.get("c") == value
+
+
+def test_unserializable_result_is_skipped(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 6)
+
+    cache.put("k", {'output': object()})
+
+    assert cache.get("k") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_zero_budget_disables_the_cache():
+    assert not ResultCache("unused", max_bytes=0).enabled
@@ -0,0 +1,78 @@
+import math
+import os
+
+import pandas as pd
+
+from Pages.utils import figure_store as figure_store_module
+from Pages.utils import session_store as session_store_module
+from Pages.utils.figure_store import FigureStore
+from Pages.utils.session_store import SessionStore, has_snapshot, read_snapshot, snapshot_dir, write_snapshot
+
+SALES = pd.DataFrame({"region": ["north", "south", "north"], "amount": [10, 20, 30]})
+
+
+def test_snapshot_round_trip(tmp_path):
+    variables = {
+        'frame': SALES,
+        'series': SALES.set_index("region")["amount"],
+        'mixed': pd.DataFrame({"value": [1, "a", 2.5]}),
+        'settings': {'top': 3, 'regions': ["north"]},
+        'math': math,
+    }
+
+    assert write_snapshot(variables, variables, str(tmp_path)) == []
+    restored = read_snapshot(str(tmp_path))
+
+    pd.testing.assert_frame_equal(restored['frame'], SALES)
+    pd.testing.assert_series_equal(restored['series'], variables['series'])
+    pd.testing.assert_frame_equal(restored['mixed'], variables['mixed'])
+    assert restored['settings'] == variables['settings']
+    assert restored['math'] is math
+
+
+def test_unpicklable_values_are_reported_lost(tmp_path):
+    variables = {'square': lambda x: x * x, 'n': 3}
+
+    assert write_snapshot(variables, variables, str(tmp_path)) == ["square"]
+    assert read_snapshot(str(tmp_path)) == {'n': 3}
+
+
+def test_only_changed_variables_are_rewritten_and_removed_ones_dropped(tmp_path):
+    write_snapshot({'a': 1, 'b': SALES}, ["a", "b"], str(tmp_path))
+
+    write_snapshot({'a': 2, 'c': 5}, ["c"], str(tmp_path))
+
+    # "a" wasn't reported as changed, so the stored value stays
+    assert read_snapshot(str(tmp_path)) == {'a': 1, 'c': 5}
+    assert sorted(os.listdir(tmp_path)) == ["a.pickle", "c.pickle", "manifest.json"]
+
+
+def test_kernel_variables_survive_a_new_worker(kernel, make_dataset, tmp_path):
+    datasets = [make_dataset("sales", SALES)]
+    kernel.execute("north = dataset_0[dataset_0.region == 'north']\ntotal = int(north.amount.sum())", datasets)
+    directory = str(tmp_path / "snapshot")
+
+    assert kernel.snapshot(directory) == {'status': 'ok', 'saved': 2, 'lost': []}
+    # Nothing changed since, so the next snapshot writes nothing
+    assert kernel.snapshot(directory)['saved'] == 0
+
+    restored = type(kernel)(kernel.events.append, kernel.session_id)
+    assert restored.restore(directory)['variables'] == {'north': "DataFrame", 'total': "int"}
+    result = restored.execute("print(total, len(north))", datasets)
+    assert result['output'].strip() == "40 2"
+
+
+def test_deleting_a_session_removes_its_record_and_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store_module, "SESSION_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    monkeypatch.setattr(figure_store_module, "figure_store", FigureStore(str(tmp_path / "figures"), 0, 0))
+    store = SessionStore(str(tmp_path / "sessions.sqlite"), retention_days=0)
+    store.save("s1", {'chat': ["hello"]})
+    write_snapshot({'n': 1}, ["n"], snapshot_dir("s1"))
+
+    assert store.load("s1") == {'chat': ["hello"]}
+    assert has_snapshot("s1")
+
+    store.delete("s1")
+
+    assert store.load("s1") is None
+    assert not has_snapshot("s1")